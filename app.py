@@ -1,22 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-import requests
-from bs4 import BeautifulSoup
+from flask import Flask, render_template, request, redirect, url_for, flash, Response
+from markupsafe import Markup
+import click
 import time
 import os
-import random
+import sys
 import threading
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, JSON, Boolean
-from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import text
-from models import db, Stock, History
-from datetime import datetime
-from flask_migrate import Migrate
+from sqlalchemy import inspect, text, tuple_, func, select
+from sqlalchemy.engine import make_url
+from models import db, Stock, History, RefreshJob
+from datetime import datetime, timedelta
+import io
+import csv
+import json
+import hashlib
+import math
+import sqlite3
+import zlib
 import logging
 import traceback
-from scoring import extract_values, compute_score
 from threading import Lock
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from batch_writer import BatchWriter, StockIndex, build_stock_row, pack_breakdown, record_score_changes
+from rescore import rescore_from_payloads, rescore_stocks
+from payload_cache import PayloadCache
+from cache import DataVersion, FacetCache, PageCache
+from metrics import RefreshMetrics
+from profiling import RefreshProfiler
+from history import (BREAKDOWN_HISTORY_COLUMNS, INTERVALS, RETENTION_KEEP, compact_history, prune_history, score_series,
+                     top_movers, with_breakdown)
+from purge import purge_all, purge_stock
+from scheduler import (CircuitBreaker, RefreshScheduler, TIER_FAVORITE, TIER_HIGH_SCORE, TIER_VOLATILE, TIER_NORMAL,
+                       plan_retry)
+from refresh_jobs import (JOB_PLANNING, JOB_STOPPED, KIND_RETRY, Heartbeat, active_job, checkpoint, claim_items,
+                          finish_job, mark_running, plan_job, request_stop, reserve_job, stop_requested, worker_id)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,98 +42,320 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///stocks.db').replace("postgres://", "postgresql://")
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite:///') and not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite:////'):
+    # Keep relative SQLite paths relative to the working directory (Flask-SQLAlchemy would use instance/)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.abspath(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_pre_ping': True,
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+    }
+    # connect_args override the URL's query, so only default to TLS when neither the URL nor PGSSLMODE picks a mode
+    if 'sslmode' not in make_url(app.config['SQLALCHEMY_DATABASE_URI']).query and not os.environ.get('PGSSLMODE'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'sslmode': 'require'}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.secret_key = os.environ.get('SECRET_KEY', '11abe499f15247d1de9102f8d5e5f556')
+app.config['KLSESCREENER_URL'] = os.environ.get('KLSESCREENER_URL', 'https://www.klsescreener.com')
+app.config['I3INVESTOR_URL'] = os.environ.get('I3INVESTOR_URL', 'https://klse.i3investor.com')
+# Concurrent fetch stage for background_refresh: worker threads and max in-flight requests per host
+app.config['REFRESH_WORKERS'] = int(os.environ.get('REFRESH_WORKERS', 8))
+app.config['REFRESH_HOST_CONCURRENCY'] = int(os.environ.get('REFRESH_HOST_CONCURRENCY', 4))
+# Stocks buffered by background_refresh before each bulk upsert + commit
+app.config['REFRESH_BATCH_SIZE'] = int(os.environ.get('REFRESH_BATCH_SIZE', 100))
+# Stocks refreshed more recently than this are skipped by background_refresh
+app.config['REFRESH_STALE_HOURS'] = float(os.environ.get('REFRESH_STALE_HOURS', 20))
+# Shorter intervals for the priority tiers (see scheduler.py); due stocks are fetched tier by tier
+app.config['REFRESH_FAVORITE_HOURS'] = float(os.environ.get('REFRESH_FAVORITE_HOURS', 4))
+app.config['REFRESH_HIGH_SCORE_HOURS'] = float(os.environ.get('REFRESH_HIGH_SCORE_HOURS', 12))
+app.config['REFRESH_VOLATILE_HOURS'] = float(os.environ.get('REFRESH_VOLATILE_HOURS', 12))
+app.config['REFRESH_HIGH_SCORE'] = int(os.environ.get('REFRESH_HIGH_SCORE', 140))
+app.config['REFRESH_VOLATILE_CHANGES'] = int(os.environ.get('REFRESH_VOLATILE_CHANGES', 2))
+# flask prune-history defaults: History older than this many days is thinned to one snapshot per stock per KEEP bucket
+app.config['HISTORY_RETENTION_DAYS'] = int(os.environ.get('HISTORY_RETENTION_DAYS', 365))
+app.config['HISTORY_RETENTION_KEEP'] = os.environ.get('HISTORY_RETENTION_KEEP', 'week')
+# Circuit breaker: stocks failing this many times in a row are skipped until the cooldown passes
+app.config['RETRY_BREAKER_FAILURES'] = int(os.environ.get('RETRY_BREAKER_FAILURES', 3))
+app.config['RETRY_BREAKER_COOLDOWN_HOURS'] = float(os.environ.get('RETRY_BREAKER_COOLDOWN_HOURS', 24))
+# Local cache of raw all.json payloads (empty path disables it)
+app.config['PAYLOAD_CACHE_PATH'] = os.environ.get('PAYLOAD_CACHE_PATH', 'payload_cache.db')
+app.config['PAYLOAD_CACHE_TTL_HOURS'] = float(os.environ.get('PAYLOAD_CACHE_TTL_HOURS', 12))
+app.config['PAYLOAD_CACHE_MAX_MB'] = int(os.environ.get('PAYLOAD_CACHE_MAX_MB', 200))
+# File holding the data version shared by all workers on the host (empty = per-process only)
+app.config['DATA_VERSION_FILE'] = os.environ.get('DATA_VERSION_FILE', 'data_version')
+# Per-worker memory cap of rendered index page tables (0 disables the page cache)
+app.config['PAGE_CACHE_MAX_MB'] = float(os.environ.get('PAGE_CACHE_MAX_MB', 16))
+# Seconds without a checkpoint before a refresh job's claims are considered abandoned
+app.config['REFRESH_CLAIM_TIMEOUT'] = int(os.environ.get('REFRESH_CLAIM_TIMEOUT', 300))
+# /refresh/events: seconds between updates and max stream length before the client reconnects
+app.config['SSE_INTERVAL'] = float(os.environ.get('SSE_INTERVAL', 2))
+app.config['SSE_MAX_SECONDS'] = int(os.environ.get('SSE_MAX_SECONDS', 20))
+# Hours the cached stock listing is trusted (with a cheap count probe) before a full resync
+app.config['LISTING_SYNC_HOURS'] = float(os.environ.get('LISTING_SYNC_HOURS', 24))
+# Shared HTTP client: keep-alive pool size, per-host rate limit (req/s, 0 = off), retries and retry budget
+app.config['HTTP_POOL_SIZE'] = int(os.environ.get('HTTP_POOL_SIZE', 10))
+app.config['HTTP_RATE_LIMIT'] = float(os.environ.get('HTTP_RATE_LIMIT', 0))
+app.config['HTTP_MAX_RETRIES'] = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+app.config['HTTP_RETRY_BUDGET'] = float(os.environ.get('HTTP_RETRY_BUDGET', 0.2))
+# Refresh profiling (see profiling.py): off, stages, sql or cprofile; cProfile dumps go to REFRESH_PROFILE_DIR
+app.config['REFRESH_PROFILE'] = os.environ.get('REFRESH_PROFILE', 'off')
+app.config['REFRESH_PROFILE_DIR'] = os.environ.get('REFRESH_PROFILE_DIR', 'profiles')
 db.init_app(app)
-migrate = Migrate(app, db)
-
-# Custom engine with retry and connection pooling
-# Configure connection args based on database type
-database_url = app.config['SQLALCHEMY_DATABASE_URI']
-if 'postgresql' in database_url:
-    engine = create_engine(
-        database_url,
-        pool_pre_ping=True,
-        pool_size=5,
-        max_overflow=10,
-        pool_timeout=30,
-        connect_args={'sslmode': 'require'}
-    )
-else:
-    # SQLite doesn't support connection pooling the same way
-    engine = create_engine(database_url)
-Session = sessionmaker(bind=engine)
 
+# One pooled engine: Flask-SQLAlchemy's, shared by the routes, the refresh
+# threads and the CLI through plain sessions that need no app context
 with app.app_context():
-    db.create_all()
+    engine = db.engine
+Session = sessionmaker(bind=engine)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+# First revision in migrations/: the schema from before migrations were tracked
+BASELINE_REVISION = 'c0c12fa9eb24'
+
+def migrate_extension():
+    """Flask-Migrate (and Alembic), imported and registered on first use rather than in every web worker."""
+    from flask_migrate import Migrate
+    if 'migrate' not in app.extensions:
+        Migrate(app, db, directory=MIGRATIONS_DIR)
+    return app.extensions['migrate']
+
+def init_db():
+    """
+    Bring the schema up to date through the Flask-Migrate migrations; idempotent.
+
+    An empty database gets create_all and is stamped at the latest revision.
+    A database from before migrations were tracked (tables, but no revision
+    from migrations/) is stamped at the baseline first, then upgraded.
+
+    Run once per deploy (flask init-db) instead of in every worker at import.
+    """
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    from flask_migrate import stamp, upgrade
+    with app.app_context():
+        script = ScriptDirectory.from_config(migrate_extension().migrate.get_config(MIGRATIONS_DIR))
+        with engine.connect() as conn:
+            tables = set(inspect(conn).get_table_names()) - {'alembic_version'}
+            current = MigrationContext.configure(conn).get_current_revision()
+        if not tables:
+            db.metadata.create_all(engine)
+            stamp(MIGRATIONS_DIR, 'head')
+            return
+        if current is None or current not in {rev.revision for rev in script.walk_revisions()}:
+            logger.info(f"Schema has no known revision ({current}), stamping baseline {BASELINE_REVISION}")
+            if current is not None:
+                # Left by migrations generated outside this repo; stamp can't step from a revision it doesn't know
+                with engine.begin() as conn:
+                    conn.execute(text('DELETE FROM alembic_version'))
+            stamp(MIGRATIONS_DIR, BASELINE_REVISION)
+        upgrade(MIGRATIONS_DIR)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the schema, or apply pending migrations."""
+    init_db()
+    click.echo("Database schema is up to date.")
+
+class MigrateCommands(click.Group):
+    """
+    `flask db ...` from Flask-Migrate, imported (with Alembic) only when a
+    migration command is actually run rather than in every web worker.
+    """
+
+    def commands_group(self):
+        from flask_migrate.cli import db as db_commands
+        migrate_extension()
+        return db_commands
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        # Take over the real group's options and callback, which put --directory/-x on g for the subcommands
+        group = self.commands_group()
+        self.params, self.callback = group.params, group.callback
+        return super().make_context(info_name, args, parent=parent, **extra)
+
+    def list_commands(self, ctx):
+        return self.commands_group().list_commands(ctx)
 
-# Global state management with lock and queue for messages
+    def get_command(self, ctx, name):
+        return self.commands_group().get_command(ctx, name)
+
+app.cli.add_command(MigrateCommands('db', help='Perform database migrations.'))
+
+# Refresh state lives in the RefreshJob/RefreshItem tables; these only track
+# this process's own refresh thread and the messages it leaves for index()
 refresh_lock = Lock()
-refresh_running = False
-refresh_stop_flag = False
+refresh_thread = None
+refresh_stop_event = threading.Event()
 refresh_message_queue = Queue()
+refresh_metrics = RefreshMetrics()
+# Per-run stage/SQL timings of background_refresh and background_retry, served by /refresh/profile
+refresh_profiler = RefreshProfiler(app.config['REFRESH_PROFILE'], app.config['REFRESH_PROFILE_DIR'])
+refresh_profiler.attach(engine)
 
-def get_all_stock_codes():
-    codes = []
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (compatible; YourApp/1.0; +https://yourapp.com)',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, br, zstd',
-        'Content-Type': 'application/json'
-    }
-    url = "https://klse.i3investor.com/wapi/web/stock/listing/datatables"
-    size = 500
-    start = 0
-    max_retries = 3
-
-    while True:
-        body = {
-            "dtDraw": 7,
-            "start": start,
-            "order": [{"column": 1, "dir": "asc"}],
-            "page": start // size,
-            "size": size,
-            "marketList": ["ACE", "ETF", "MAIN"],
-            "sectorList": [],
-            "subsectorList": [],
-            "type": "",
-            "stockType": ""
-        }
-        for attempt in range(max_retries):
-            try:
-                resp = requests.post(url, headers=headers, json=body, timeout=15)
-                resp.raise_for_status()
-                data = resp.json()
-                if 'data' not in data or not data['data']:
-                    logger.info(f"No more data at start={start}, stopping pagination")
-                    return list(set(codes))
-                for row in data['data']:
-                    if len(row) < 2: continue
-                    name_html = row[1]
-                    soup = BeautifulSoup(name_html, 'html.parser')
-                    a_tag = soup.find('a')
-                    if a_tag:
-                        code = a_tag['href'].split('/')[-1]
-                        # Skip warrant-like codes
-                        if any(suffix in code for suffix in ['WA', 'WB', 'WD', 'WC']):
-                            continue
-                        short_name = a_tag.text.strip()
-                        full_name = soup.get_text(separator=' ').strip().replace(short_name, '').replace(' ', '')
-                        name = f"{short_name} - {full_name}"
-                        if code and name: codes.append((code, name))
-                total_records = data.get('recordsTotal', len(codes) + start)
-                if start + len(data['data']) >= total_records: break
-                start += size
+# Single pooled HTTP client shared by the listing scraper and the fetch pool,
+# created (importing requests) on first use so page-serving workers never load it
+http = None
+http_lock = Lock()
+
+def get_http():
+    global http
+    with http_lock:
+        if http is None:
+            from http_client import HttpClient
+            http = HttpClient(
+                pool_size=app.config['HTTP_POOL_SIZE'],
+                max_per_host=app.config['REFRESH_HOST_CONCURRENCY'],
+                rate_limit=app.config['HTTP_RATE_LIMIT'],
+                max_retries=app.config['HTTP_MAX_RETRIES'],
+                retry_budget=app.config['HTTP_RETRY_BUDGET']
+            )
+        return http
+
+payload_cache = PayloadCache(
+    app.config['PAYLOAD_CACHE_PATH'],
+    # A refresh stamps last_refreshed with the time it ran, so a cached body may never be served past the
+    # shortest tier interval; older entries are revalidated with a conditional GET instead
+    ttl=min(app.config['PAYLOAD_CACHE_TTL_HOURS'], app.config['REFRESH_FAVORITE_HOURS'],
+            app.config['REFRESH_HIGH_SCORE_HOURS'], app.config['REFRESH_VOLATILE_HOURS'],
+            app.config['REFRESH_STALE_HOURS']) * 3600,
+    max_bytes=app.config['PAYLOAD_CACHE_MAX_MB'] * 1024 * 1024
+) if app.config['PAYLOAD_CACHE_PATH'] else None
+
+# Bumped by every write path; cached facets, counts and pages are dropped when it changes
+data_version = DataVersion(app.config['DATA_VERSION_FILE'] or None)
+facet_cache = FacetCache(data_version)
+page_cache = PageCache(data_version, max_bytes=int(app.config['PAGE_CACHE_MAX_MB'] * 1024 * 1024))
+
+retry_breaker = CircuitBreaker(threshold=app.config['RETRY_BREAKER_FAILURES'],
+                               cooldown=timedelta(hours=app.config['RETRY_BREAKER_COOLDOWN_HOURS']))
+
+@refresh_profiler.timed('listing')
+def get_all_stock_codes(force=False):
+    """
+    Stock universe as [(code, name)], from the synced listing cache when it is current.
+    """
+    from listing import sync_listing
+    session = Session()
+    try:
+        return sync_listing(session, get_http(), app.config['I3INVESTOR_URL'],
+                            timedelta(hours=app.config['LISTING_SYNC_HOURS']), force=force)
+    finally:
+        session.close()
+
+# A cache entry that cannot be read (corrupt body, locked or damaged SQLite file) is treated as a miss
+PAYLOAD_CACHE_ERRORS = (sqlite3.Error, zlib.error, ValueError)
+
+def discard_cached_payload(code, error):
+    logger.warning(f"Ignoring unreadable cached payload for {code}: {error}")
+    try:
+        payload_cache.discard(code)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not evict cached payload for {code}: {e}")
+
+def fetch_stock_data(code, revalidate=False):
+    """
+    Fetch the all.json payload for a stock. Safe to call from worker threads.
+
+    Served from payload_cache while the entry is within its TTL; older
+    entries, and every entry when revalidate is set, are revalidated with
+    If-None-Match / If-Modified-Since. An entry that cannot be read back is
+    evicted and the stock is fetched as if it were not cached.
+
+    Returns:
+        Tuple of (stock_data, error_message); exactly one of them is None
+    """
+    import requests
+    url = f"{app.config['KLSESCREENER_URL']}/v2/stocks/view/{code}/all.json"
+    cached = None
+    if payload_cache:
+        try:
+            cached = payload_cache.get(code)
+            if cached and not revalidate and payload_cache.is_fresh(cached):
+                stock_data = json.loads(cached.body)
+                refresh_profiler.count('payload_cache_hits')
+                return stock_data, None
+        except PAYLOAD_CACHE_ERRORS as e:
+            discard_cached_payload(code, e)
+            cached = None
+    headers = {}
+    if cached and cached.etag:
+        headers['If-None-Match'] = cached.etag
+    if cached and cached.last_modified:
+        headers['If-Modified-Since'] = cached.last_modified
+    started = time.perf_counter()
+    try:
+        with refresh_profiler.stage('http'):
+            resp = get_http().get(url, headers=headers, timeout=10)
+        refresh_metrics.observe('fetch', time.perf_counter() - started)
+    except requests.RequestException as e:
+        logger.error(f"Fetch error for {code}: {e}")
+        return None, f"Failed to fetch {code}"
+    if resp.status_code == 304 and cached:
+        try:
+            stock_data = json.loads(cached.body)
+            payload_cache.touch(code)
+        except PAYLOAD_CACHE_ERRORS as e:
+            # The validators matched a body we can no longer read; drop it and fetch unconditionally
+            discard_cached_payload(code, e)
+            return fetch_stock_data(code, revalidate=revalidate)
+        refresh_profiler.count('payload_cache_revalidated')
+        return stock_data, None
+    try:
+        with refresh_profiler.stage('parse'):
+            stock_data = resp.json()
+    except requests.JSONDecodeError as e:
+        logger.error(f"JSON decode error for {code}: {e}, Response: {resp.text[:200]}")
+        return None, f"Failed to parse JSON for {code}"
+    if payload_cache:
+        try:
+            payload_cache.put(code, resp.content, resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        except PAYLOAD_CACHE_ERRORS as e:
+            logger.warning(f"Could not cache payload for {code}: {e}")
+    return stock_data, None
+
+def fetch_many(items, workers=None, should_stop=None):
+    """
+    Fetch payloads for an iterable of (code, name) pairs on a thread pool.
+
+    Yields (code, name, stock_data, error_message) in completion order; an
+    exception in a worker only fails that stock. Only
+    the HTTP work runs on the pool; the caller consumes results on its own
+    thread, so DB writes stay on a single writer. At most 2x workers fetches
+    are queued at a time and no new ones are submitted once should_stop()
+    returns True.
+    """
+    workers = workers or app.config['REFRESH_WORKERS']
+    items = iter(items)
+    in_flight = {}
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch')
+
+    def submit_next():
+        for code, name in items:
+            in_flight[pool.submit(fetch_stock_data, code)] = (code, name)
+            return True
+        return False
+
+    try:
+        for _ in range(workers * 2):
+            if not submit_next():
                 break
-            except requests.RequestException as e:
-                logger.warning(f"API fetch error at start={start} (attempt {attempt + 1}/3): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                else:
-                    break
-        else: break
-    logger.info(f"Retrieved {len(codes)} stock codes")
-    return list(set(codes))
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                code, name = in_flight.pop(future)
+                try:
+                    stock_data, error = future.result()
+                except Exception as e:
+                    logger.error(f"Fetch worker error for {code}: {e}")
+                    stock_data, error = None, f"Failed to fetch {code}: {e}"
+                yield code, name, stock_data, error
+                if not (should_stop and should_stop()):
+                    submit_next()
+    finally:
+        for future in in_flight:
+            future.cancel()
+        pool.shutdown(wait=False)
 
 def update_stock_data(session, code, name, stock_data=None):
     stock = session.query(Stock).filter_by(code=code).first()
@@ -123,124 +363,542 @@ def update_stock_data(session, code, name, stock_data=None):
         stock = Stock(code=code, name=name)
         session.add(stock)
         session.commit()
+        data_version.bump()
     logger.info(f"Found/created stock {code}")
 
+    fetch_error = None
     if not stock_data:
-        url = f"https://www.klsescreener.com/v2/stocks/view/{code}/all.json"
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                resp = requests.get(url, headers={'User-Agent': 'Mozilla/5.0 (compatible; YourApp/1.0; +https://yourapp.com)'}, timeout=10)
-                resp.raise_for_status()
-                stock_data = resp.json()
-                break
-            except requests.JSONDecodeError as e:
-                logger.error(f"JSON decode error for {code} (attempt {attempt + 1}/{max_retries}): {e}, Response: {resp.text}")
-                if attempt == max_retries - 1:
-                    return False, f"Failed to parse JSON for {code}", 0
-                time.sleep(2 ** attempt)  # Exponential backoff
-            except requests.RequestException as e:
-                logger.error(f"Fetch error for {code} (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt == max_retries - 1:
-                    return False, f"Failed to fetch {code}", 0
-                time.sleep(2 ** attempt)
-
-    values = extract_values(stock_data)
-    new_score, new_breakdown = compute_score(**values)
+        # Asked for by hand, so always check upstream rather than trusting the cache TTL
+        stock_data, fetch_error = fetch_stock_data(code, revalidate=True)
+    if fetch_error:
+        stock.failure_count = (stock.failure_count or 0) + 1
+        stock.last_error, stock.last_failed_at = fetch_error, datetime.utcnow()
+        session.commit()
+        return False, fetch_error, 0
+
+    row = build_stock_row(stock_data)
+    new_score = row['current_score']
     if stock.current_score != new_score and stock.current_score != 0:
-        history = History(stock_id=stock.id, score=stock.current_score, breakdown=stock.breakdown,
+        history = History(stock_id=stock.id, score=stock.current_score, **pack_breakdown(stock.breakdown),
                           growth_cagr=stock.growth_cagr, div_yield=stock.div_yield, pe_ratio=stock.pe_ratio,
-                          roe=stock.roe, profit=stock.profit, cash_positive=stock.cash_positive)
+                          roe=stock.roe, profit=stock.profit, cash_positive=stock.cash_positive,
+                          date=row['last_refreshed'])
         session.add(history)
-    stock.growth_cagr = values['growth']
-    stock.div_yield = values['div_yield']
-    stock.pe_ratio = values['per']
-    stock.roe = values['roe']
-    stock.profit = values['margin']
-    stock.cash_positive = values['cash_positive']
-    stock.current_score = new_score
-    stock.breakdown = new_breakdown
-    stock.industry = stock_data.get('Sector', {}).get('name', 'Unknown')
-    stock.market = stock_data.get('Sector', {}).get('Board', {}).get('name', 'Unknown')
-    stock.last_updated = datetime.utcnow()
-    stock.last_refreshed = datetime.utcnow()
+        record_score_changes(session, [{'stock_id': stock.id, 'score': stock.current_score, 'date': history.date}],
+                             {stock.id: new_score})
+    for column, value in row.items():
+        setattr(stock, column, value)
     session.commit()
+    data_version.bump()
     logger.info(f"Updated {code} with score: {new_score}")
     return True, f"Updated {code} with score: {new_score}", 1
 
 def background_refresh():
-    global refresh_running, refresh_stop_flag
-    with refresh_lock:
-        refresh_running = True
-        logger.info("Refresh process started, refresh_running set to True")
+    """
+    Join the active refresh job, or resume/create one, and work it until done or stopped.
+
+    The job is reserved before the listing sync, so two processes starting a
+    refresh at once end up on the same job.
+    """
     session = Session()
-    codes = get_all_stock_codes()
-    today = datetime.utcnow().date()
-    updated_count = 0
-    if not codes:
-        logger.warning("No stock codes retrieved from get_all_stock_codes")
-        with refresh_lock:
-            refresh_running = False
+    job = None
+    try:
+        with refresh_profiler.run('refresh'):
+            claim_timeout = timedelta(seconds=app.config['REFRESH_CLAIM_TIMEOUT'])
+            max_age = timedelta(hours=app.config['REFRESH_STALE_HOURS'])
+            index = None
+            job, created = reserve_job(session, claim_timeout, max_age)
+            if not created and job.status == JOB_PLANNING:
+                logger.info(f"Refresh job {job.id} is still being planned by another worker")
+                return
+            if created:
+                with job_heartbeat(job.id):
+                    codes = get_all_stock_codes()
+                    if not codes:
+                        logger.warning("No stock codes retrieved from get_all_stock_codes")
+                        finish_job(session, job.id, error="No stock codes retrieved")
+                        return
+                    with refresh_profiler.stage('plan'):
+                        scheduler = refresh_scheduler().load(session)
+                        plan_job(session, job, scheduler.plan(codes))
+                index = scheduler.index()
+            run_refresh_job(session, job.id, index)
+    except Exception as e:
+        logger.error(f"Refresh failed: {e}, Traceback: {traceback.format_exc()}")
+        refresh_message_queue.put(f"Refresh failed: {e}")
+        if job is not None:
+            fail_job(session, job.id, str(e))
+    finally:
         session.close()
-        return
-    for code, name in codes:
-        if refresh_stop_flag:
-            logger.info("Refresh stopped by user request")
+
+def background_retry(job_id):
+    """
+    Work a retry_failed job on the fetch pool; same claim/checkpoint loop as a refresh.
+    """
+    session = Session()
+    try:
+        with refresh_profiler.run('retry'):
+            run_refresh_job(session, job_id)
+    except Exception as e:
+        logger.error(f"Retry failed: {e}, Traceback: {traceback.format_exc()}")
+        refresh_message_queue.put(f"Retry failed: {e}")
+        fail_job(session, job_id, str(e))
+    finally:
+        session.close()
+
+def fail_job(session, job_id, error):
+    """
+    Close a job as failed after an unexpected error, so it stops counting as a running refresh.
+    """
+    try:
+        session.rollback()
+        finish_job(session, job_id, error=error)
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Could not mark job {job_id} failed: {e}")
+
+def job_heartbeat(job_id, worker=None):
+    """Keep job_id (and worker's claims) alive in the background, three times per claim timeout."""
+    return Heartbeat(Session, job_id, worker, app.config['REFRESH_CLAIM_TIMEOUT'] / 3)
+
+def refresh_scheduler():
+    return RefreshScheduler(
+        intervals={
+            TIER_FAVORITE: timedelta(hours=app.config['REFRESH_FAVORITE_HOURS']),
+            TIER_HIGH_SCORE: timedelta(hours=app.config['REFRESH_HIGH_SCORE_HOURS']),
+            TIER_VOLATILE: timedelta(hours=app.config['REFRESH_VOLATILE_HOURS']),
+            TIER_NORMAL: timedelta(hours=app.config['REFRESH_STALE_HOURS']),
+        },
+        high_score=app.config['REFRESH_HIGH_SCORE'],
+        volatile_changes=app.config['REFRESH_VOLATILE_CHANGES'],
+        breaker=retry_breaker
+    )
+
+def run_refresh_job(session, job_id, index=None):
+    """
+    Claim batches of a job's items, fetch them on the pool and checkpoint each batch.
+
+    A batch is only marked done after its stock rows are committed, so a
+    crashed worker's claims simply expire and are picked up again. index is
+    the StockIndex of the scheduler that just planned the job, if any;
+    otherwise (joined, resumed and retry jobs) it is loaded here.
+    """
+    worker = worker_id()
+    claim_timeout = timedelta(seconds=app.config['REFRESH_CLAIM_TIMEOUT'])
+    if index is None:
+        index = StockIndex.load(session)
+    # Flushed explicitly once per claimed batch, right before its checkpoint
+    writer = BatchWriter(session, batch_size=sys.maxsize, index=index, on_flush=data_version.bump)
+    mark_running(session, job_id)
+    refresh_profiler.note(job_id=job_id)
+    logger.info(f"Worker {worker} joined refresh job {job_id}")
+    while not refresh_stop_event.is_set() and not stop_requested(session, job_id):
+        with refresh_profiler.stage('claim'):
+            items = claim_items(session, job_id, worker, app.config['REFRESH_BATCH_SIZE'], claim_timeout)
+        if not items:
             break
-        stock = session.query(Stock).filter_by(code=code).first()
-        if stock and stock.last_refreshed and stock.last_refreshed.date() == today:
-            logger.info(f"Skipping {code} as it was refreshed today")
-            continue
-        success, message, count = update_stock_data(session, code, name)
-        updated_count += count
-        if not success:
-            refresh_message_queue.put(message)
+        ids = {item.code: item.id for item in items}
+        # Claims are extended while the batch runs, however long the fetches take
+        with job_heartbeat(job_id, worker):
+            done, failed = [], {}
+            # fetch_wait: time this thread waits on the pool for the next payload
+            fetched = fetch_many(((item.code, item.name) for item in items), should_stop=refresh_stop_event.is_set)
+            for code, name, stock_data, error in refresh_profiler.iterate('fetch_wait', fetched):
+                refresh_profiler.count('stocks')
+                if not error:
+                    try:
+                        with refresh_profiler.stage('score'):
+                            row = build_stock_row(stock_data)
+                    except Exception as e:
+                        # One malformed payload fails its stock, not the batch
+                        logger.error(f"Scoring error for {code}: {e}, Traceback: {traceback.format_exc()}")
+                        error = f"Failed to score {code}: {e}"
+                if error:
+                    writer.add_failed(code, name, error)
+                    failed[ids[code]] = error
+                    refresh_message_queue.put(error)
+                    refresh_metrics.count('failed')
+                    continue
+                writer.add(code, name, row)
+                done.append(ids[code])
+                refresh_metrics.count('fetched')
+            started = time.perf_counter()
+            with refresh_profiler.stage('db_write'):
+                writer.flush()
+            refresh_metrics.observe('db_write', time.perf_counter() - started)
+            refresh_metrics.count('updated', len(done))
+            released = [item_id for item_id in ids.values() if item_id not in failed and item_id not in done]
+            with refresh_profiler.stage('checkpoint'):
+                checkpoint(session, job_id, worker, done, failed, released)
+    if refresh_stop_event.is_set():
+        request_stop(session, job_id)
+    job = finish_job(session, job_id)
+    if job is None:
+        logger.info(f"Worker {worker} left refresh job {job_id}; other workers still hold items")
+    elif job.status == JOB_STOPPED:
+        refresh_message_queue.put(f"{job.kind.capitalize()} process stopped by user.")
+    elif job.kind == KIND_RETRY:
+        refresh_message_queue.put(f"Retry complete! Updated {job.updated} failed stocks, {job.failed} still failing.")
+        logger.info(f"Retry job {job_id} completed: {job.updated} updated, {job.failed} failed, {job.skipped} held")
+    else:
+        refresh_message_queue.put(f"Refresh complete! Updated {job.updated} stocks.")
+        logger.info(f"Refresh job {job_id} completed: {job.updated} updated, {job.failed} failed, {job.skipped} skipped")
+
+def is_refresh_running(session):
     with refresh_lock:
-        if not refresh_stop_flag:
-            refresh_message_queue.put(f"Refresh complete! Updated {updated_count} stocks.")
-        else:
-            refresh_message_queue.put("Refresh process stopped by user.")
-        refresh_running = False
-        logger.info("Refresh process ended, refresh_running set to False")
-    session.close()
+        if refresh_thread and refresh_thread.is_alive():
+            return True
+    return active_job(session, timedelta(seconds=app.config['REFRESH_CLAIM_TIMEOUT'])) is not None
+
+def refresh_status(session, job_id=None):
+    """
+    Progress of the given (default: latest) refresh job (counts from the database,
+    shared by all workers) plus this process's throughput, latency percentiles and ETA.
+    """
+    if job_id:
+        job = session.get(RefreshJob, job_id)
+    else:
+        job = session.query(RefreshJob).order_by(RefreshJob.id.desc()).first()
+    metrics = refresh_metrics.snapshot()
+    status = {
+        'running': is_refresh_running(session),
+        'job': None,
+        'rate': round(metrics['rate'], 3),
+        'eta_seconds': None,
+        'latency': metrics['latency'],
+        'process_counters': metrics['counters'],
+    }
+    if job:
+        processed = (job.skipped or 0) + (job.updated or 0) + (job.failed or 0)
+        remaining = max((job.total or 0) - processed, 0)
+        status['job'] = {
+            'id': job.id, 'kind': job.kind, 'status': job.status, 'total': job.total, 'skipped': job.skipped,
+            'updated': job.updated, 'failed': job.failed, 'remaining': remaining,
+            'created_at': job.created_at, 'started_at': job.started_at,
+            'finished_at': job.finished_at, 'heartbeat_at': job.heartbeat_at, 'last_error': job.last_error,
+        }
+        if status['running'] and metrics['rate'] > 0:
+            status['eta_seconds'] = round(remaining / metrics['rate'])
+    return status
+
+def finite_or_none(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: finite_or_none(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite_or_none(item) for item in value]
+    return value
+
+def dumps_json(obj):
+    """Compact JSON with datetimes as ISO strings and NaN/inf as null (bare NaN is not valid JSON)."""
+    try:
+        return json.dumps(obj, default=lambda value: value.isoformat(), separators=(',', ':'), allow_nan=False)
+    except ValueError:
+        return json.dumps(finite_or_none(obj), default=lambda value: value.isoformat(), separators=(',', ':'))
+
+def encode_cursor(stock):
+    return f"{int(bool(stock.is_favorite))}:{stock.current_score or 0}:{stock.id}"
+
+def decode_cursor(value):
+    try:
+        favorite, score, stock_id = value.split(':')
+        return bool(int(favorite)), int(score), int(stock_id)
+    except (AttributeError, ValueError):
+        return None
+
+def load_facets(session):
+    """Industry and market values with their stock counts, for the filter dropdowns."""
+    return {
+        'industry': dict(session.query(Stock.industry, func.count()).filter(Stock.industry.isnot(None), Stock.industry != '').group_by(Stock.industry).order_by(Stock.industry).all()),
+        'market': dict(session.query(Stock.market, func.count()).filter(Stock.market.isnot(None), Stock.market != '').group_by(Stock.market).order_by(Stock.market).all()),
+    }
+
+def listing_filters():
+    """Filters shared by index() and /api/stocks, parsed from the query string."""
+    return {
+        'favorites_only': request.args.get('favorites_only', 'false').lower() == 'true',
+        'industry': request.args.get('industry'),
+        'market': request.args.get('market'),
+        'min_score': request.args.get('min_score', type=float),
+        'max_score': request.args.get('max_score', type=float),
+    }
+
+def apply_listing_filters(query, filters):
+    if filters['favorites_only']:
+        query = query.filter(Stock.is_favorite == True)
+    if filters['industry']:
+        query = query.filter(Stock.industry == filters['industry'])
+    if filters['market']:
+        query = query.filter(Stock.market == filters['market'])
+    if filters['min_score'] is not None:
+        query = query.filter(Stock.current_score >= filters['min_score'])
+    if filters['max_score'] is not None:
+        query = query.filter(Stock.current_score <= filters['max_score'])
+    return query
+
+LISTING_ORDER = (Stock.is_favorite.desc(), Stock.current_score.desc(), Stock.id.desc())
+
+def after_cursor(query, cursor):
+    return query.filter(tuple_(Stock.is_favorite, Stock.current_score, Stock.id) < tuple_(*cursor))
 
 @app.route('/')
 def index():
     session = Session()
     page = request.args.get('page', 1, type=int)
     per_page = 50
-    offset = (page - 1) * per_page
-    query = session.query(Stock).order_by(Stock.is_favorite.desc(), Stock.current_score.desc())
-    favorites_only = request.args.get('favorites_only', 'false').lower() == 'true'
-    industry = request.args.get('industry')
-    market = request.args.get('market')
-    min_score = request.args.get('min_score', type=float)
-    max_score = request.args.get('max_score', type=float)
-    if favorites_only:
-        query = query.filter(Stock.is_favorite == True)
-    if industry:
-        query = query.filter(Stock.industry == industry)
-    if market:
-        query = query.filter(Stock.market == market)
-    if min_score is not None:
-        query = query.filter(Stock.current_score >= min_score)
-    if max_score is not None:
-        query = query.filter(Stock.current_score <= max_score)
-    total_stocks = query.count()
-    stocks = query.offset(offset).limit(per_page).all()
-    unique_industries = [i[0] for i in session.query(Stock.industry).distinct().all() if i[0]]
-    unique_markets = [m[0] for m in session.query(Stock.market).distinct().all() if m[0]]
+    filters = listing_filters()
+    query = apply_listing_filters(session.query(Stock).order_by(*LISTING_ORDER), filters)
+    total_stocks = facet_cache.get(('total',) + tuple(filters.values()), query.count)
+    # Keyset mode: ?after=<cursor> continues after the last row of the previous page
+    after = request.args.get('after')
+
+    def render_table():
+        current_page = page
+        cursor = decode_cursor(after)
+        if cursor:
+            stocks = after_cursor(query, cursor).limit(per_page).all()
+            current_page = None
+        else:
+            stocks = query.offset((page - 1) * per_page).limit(per_page).all()
+        next_cursor = encode_cursor(stocks[-1]) if len(stocks) == per_page else None
+        facets = facet_cache.get('facets', lambda: load_facets(session))
+        total_pages = ((total_stocks + per_page - 1) // per_page if total_stocks else 1) if current_page else None
+        return render_template('_stock_table.html', stocks=stocks, current_page=current_page, total_pages=total_pages, total_stocks=total_stocks, next_cursor=next_cursor, unique_industries=list(facets['industry']), unique_markets=list(facets['market']), facet_counts=facets, **filters)
+
+    # Flash messages and the refresh banner stay per request; only the table is cached
+    stock_table = page_cache.get(tuple(filters.values()) + (page, after), render_table)
+    refresh_running = is_refresh_running(session)
     session.close()
     while not refresh_message_queue.empty():
         flash(refresh_message_queue.get())
-    return render_template('index.html', stocks=stocks, current_page=page, total_pages=(total_stocks + per_page - 1) // per_page if total_stocks else 1, total_stocks=total_stocks, unique_industries=unique_industries, unique_markets=unique_markets, favorites_only=favorites_only, industry=industry, market=market, min_score=min_score, max_score=max_score, refresh_running=refresh_running)
+    return render_template('index.html', stock_table=Markup(stock_table), total_stocks=total_stocks, refresh_running=refresh_running)
+
+# Columns returned by /api/stocks; breakdown is only loaded when asked for
+API_COLUMNS = [Stock.id, Stock.code, Stock.name, Stock.industry, Stock.market, Stock.current_score, Stock.is_favorite,
+               Stock.growth_cagr, Stock.div_yield, Stock.pe_ratio, Stock.roe, Stock.profit, Stock.cash_positive,
+               Stock.last_updated, Stock.last_refreshed]
+
+@app.route('/api/stocks')
+def api_stocks():
+    """
+    JSON listing with the same filters and ordering as index().
+
+    Supports ?page=, ?per_page= (max 500), ?after=<cursor> and ?breakdown=true.
+    The ETag combines the data version and the query string, so a poll with
+    a matching If-None-Match gets a 304 without touching the database.
+    """
+    etag = request_etag()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+    cursor = decode_cursor(request.args.get('after'))
+    columns = API_COLUMNS + ([Stock.breakdown] if request.args.get('breakdown', 'false').lower() == 'true' else [])
+    filters = listing_filters()
+    session = Session()
+    try:
+        query = apply_listing_filters(session.query(*columns).order_by(*LISTING_ORDER), filters)
+        total = facet_cache.get(('total',) + tuple(filters.values()), query.count)
+        if cursor:
+            rows = after_cursor(query, cursor).limit(per_page).all()
+        else:
+            rows = query.offset((page - 1) * per_page).limit(per_page).all()
+    finally:
+        session.close()
+    stocks = [row._asdict() for row in rows]
+    body = {
+        'total': total,
+        'page': None if cursor else page,
+        'per_page': per_page,
+        'next_cursor': encode_cursor(rows[-1]) if len(rows) == per_page else None,
+        'stocks': stocks,
+    }
+    return versioned_json(body, etag)
+
+def request_etag():
+    """ETag of a read endpoint: the data version plus the full path and query string."""
+    return hashlib.sha1(f"{data_version.get()}{request.full_path}".encode()).hexdigest()
+
+def versioned_json(body, etag):
+    resp = Response(dumps_json(body), mimetype='application/json')
+    resp.headers['ETag'] = f'"{etag}"'
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.route('/api/stocks/<code>/history')
+def api_stock_history(code):
+    """
+    Score and metric series of one stock.
+
+    ?interval=raw (default, every snapshot), day or week (bucketed server-side),
+    inclusive ?start= / ?end= dates (YYYY-MM-DD), ?limit= (max 5000) and
+    ?breakdown=true to include each raw snapshot's breakdown.
+    """
+    etag = request_etag()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    interval = request.args.get('interval', 'raw')
+    if interval not in INTERVALS:
+        return Response(f"Unsupported interval: {interval}", status=400)
+    start, end = history_range()
+    limit = min(max(request.args.get('limit', 5000, type=int), 1), 5000)
+    session = Session()
+    try:
+        stock = session.query(Stock.id, Stock.code, Stock.name, Stock.current_score, Stock.last_refreshed) \
+            .filter(Stock.code == code.upper()).first()
+        if stock is None:
+            return Response(f"Stock {code} not found", status=404)
+        series = score_series(session, interval, start, end, stock_id=stock.id, limit=limit,
+                              breakdown=request.args.get('breakdown', 'false').lower() == 'true')
+    finally:
+        session.close()
+    return versioned_json({'stock': stock._asdict(), 'interval': interval, 'series': series}, etag)
+
+@app.route('/api/history')
+def api_market_history():
+    """
+    Market-wide score and metric series bucketed by ?interval=day (default) or week.
+
+    Takes ?industry=, ?market= and an inclusive ?start= / ?end= date range.
+    """
+    etag = request_etag()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    interval = request.args.get('interval', 'day')
+    if interval not in ('day', 'week'):
+        return Response(f"Unsupported interval: {interval}", status=400)
+    start, end = history_range()
+    session = Session()
+    try:
+        series = score_series(session, interval, start, end, industry=request.args.get('industry'),
+                              market=request.args.get('market'))
+    finally:
+        session.close()
+    return versioned_json({'interval': interval, 'series': series}, etag)
+
+@app.route('/api/movers')
+def api_movers():
+    """
+    Biggest score changes since the latest refresh job started (or ?since=YYYY-MM-DD).
+
+    ?direction=up or down keeps only gains or losses; ?limit= (max 500).
+    """
+    etag = request_etag()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 500)
+    session = Session()
+    try:
+        since = request.args.get('since', type=parse_date)
+        if since is None:
+            since = session.execute(select(func.max(RefreshJob.created_at))).scalar()
+        movers = top_movers(session, since, limit, request.args.get('direction'))
+    finally:
+        session.close()
+    return versioned_json({'since': since, 'movers': movers}, etag)
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK_SIZE = 1000
+HISTORY_EXPORT_COLUMNS = [Stock.code, Stock.name, History.date, History.score, *BREAKDOWN_HISTORY_COLUMNS,
+                          History.growth_cagr, History.div_yield, History.pe_ratio, History.roe,
+                          History.profit, History.cash_positive]
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+def history_range():
+    """Inclusive ?start= / ?end= dates as a half-open [start, end) datetime range."""
+    start = request.args.get('start', type=parse_date)
+    end = request.args.get('end', type=parse_date)
+    return start, end + timedelta(days=1) if end else None
+
+def stream_export(statement, fmt, filename, transform=None):
+    """
+    Stream a SELECT as CSV or NDJSON without materialising it.
+
+    Rows come through a server-side cursor (stream_results/yield_per) on a
+    session owned by the generator, so memory stays flat however large the
+    result is. transform, if given, maps each row dict to the dict written.
+    """
+    def generate():
+        session = Session()
+        try:
+            result = session.execute(statement.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE))
+            keys = list(result.keys())
+            if transform:
+                keys = list(transform(dict.fromkeys(keys)))
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(keys)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            for rows in result.partitions():
+                if transform:
+                    rows = [transform(row._asdict()) for row in rows]
+                if fmt == 'csv':
+                    for row in rows:
+                        values = row.values() if transform else row
+                        writer.writerow([json.dumps(v) if isinstance(v, dict) else v for v in values])
+                    chunk = buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    lines = [dumps_json(row if transform else row._asdict()) for row in rows]
+                    chunk = '\n'.join(lines) + '\n'
+                yield chunk
+        finally:
+            session.close()
+
+    resp = Response(generate(), mimetype=EXPORT_FORMATS[fmt])
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return resp
+
+@app.route('/export/stocks.<fmt>')
+def export_stocks(fmt):
+    """All stocks matching the index() filters, as CSV or NDJSON."""
+    if fmt not in EXPORT_FORMATS:
+        return Response(f"Unsupported format: {fmt}", status=404)
+    query = apply_listing_filters(select(*API_COLUMNS, Stock.breakdown).order_by(*LISTING_ORDER), listing_filters())
+    return stream_export(query, fmt, 'stocks')
+
+@app.route('/export/history.<fmt>')
+def export_history(fmt):
+    """
+    Score history joined to its stock, as CSV or NDJSON.
+
+    Takes the index() filters (applied to the stock), an optional ?code=,
+    and an inclusive ?start= / ?end= date range (YYYY-MM-DD).
+    """
+    if fmt not in EXPORT_FORMATS:
+        return Response(f"Unsupported format: {fmt}", status=404)
+    query = apply_listing_filters(
+        select(*HISTORY_EXPORT_COLUMNS).join(Stock, History.stock_id == Stock.id).order_by(History.stock_id, History.date),
+        listing_filters()
+    )
+    code = request.args.get('code')
+    start, end = history_range()
+    if code:
+        query = query.filter(Stock.code == code.upper())
+    if start:
+        query = query.filter(History.date >= start)
+    if end:
+        query = query.filter(History.date < end)
+    return stream_export(query, fmt, 'history', transform=with_breakdown)
 
 @app.route('/start_refresh', methods=['POST'])
 def start_refresh():
-    global refresh_running, refresh_stop_flag
+    global refresh_thread
+    session = Session()
+    try:
+        running = is_refresh_running(session)
+    finally:
+        session.close()
     with refresh_lock:
-        if not refresh_running:
-            refresh_stop_flag = False
+        if not running and not (refresh_thread and refresh_thread.is_alive()):
+            refresh_stop_event.clear()
             refresh_thread = threading.Thread(target=background_refresh)
             refresh_thread.daemon = True
             refresh_thread.start()
@@ -252,24 +910,107 @@ def start_refresh():
 
 @app.route('/stop_refresh', methods=['POST'])
 def stop_refresh():
-    global refresh_stop_flag
-    with refresh_lock:
-        refresh_stop_flag = True
-        logger.info("Stop refresh flag set to True")
-    flash("Refresh process will stop after current stock.")
+    refresh_stop_event.set()
+    session = Session()
+    try:
+        job = active_job(session, timedelta(seconds=app.config['REFRESH_CLAIM_TIMEOUT']))
+        if job:
+            request_stop(session, job.id)
+            logger.info(f"Stop requested for refresh job {job.id}")
+    finally:
+        session.close()
+    flash("Refresh process will stop after the current batch.")
     return redirect(url_for('index'))
 
+@app.cli.command('sync-listing')
+def sync_listing_command():
+    """Fetch the full stock listing now and store it, ignoring the cache."""
+    click.echo(f"Synced {len(get_all_stock_codes(force=True))} stock codes.")
+
+@app.cli.command('refresh-worker')
+def refresh_worker_command():
+    """Join the running refresh job (or resume/start one) and work it in this process."""
+    background_refresh()
+
+@app.route('/refresh/status')
+def refresh_status_view():
+    """JSON progress of the latest job, or of ?job=<id> (the handle returned by /retry_failed)."""
+    session = Session()
+    try:
+        status = refresh_status(session, request.args.get('job', type=int))
+    finally:
+        session.close()
+    return Response(dumps_json(status), mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/refresh/profile')
+def refresh_profile_view():
+    """
+    JSON stage/SQL timings of the refresh running in this process and of the last finished one.
+
+    Empty unless REFRESH_PROFILE is set; the summaries are per process, so
+    with several workers each reports the runs it worked itself.
+    """
+    return Response(dumps_json(refresh_profiler.snapshot()), mimetype='application/json',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/metrics')
+def metrics_view():
+    """Prometheus text exposition of refresh counters, latencies and current job progress."""
+    session = Session()
+    try:
+        status = refresh_status(session)
+    finally:
+        session.close()
+    job = status['job'] or {}
+    gauges = {
+        'running': int(status['running']),
+        'job_total': job.get('total') or 0,
+        'job_remaining': job.get('remaining') or 0,
+        'job_updated': job.get('updated') or 0,
+        'job_failed': job.get('failed') or 0,
+        'job_skipped': job.get('skipped') or 0,
+        'eta_seconds': status['eta_seconds'] or 0,
+    }
+    return Response(refresh_metrics.prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/refresh/events')
+def refresh_events():
+    """
+    Server-Sent Events stream of refresh_status every couple of seconds.
+
+    Sends a final 'done' event once no refresh is running. Each stream holds
+    a worker thread, so streams end after SSE_MAX_SECONDS (kept well below
+    the gunicorn timeout) and the browser reconnects after SSE_INTERVAL, as
+    told by the retry field.
+    """
+    def generate():
+        deadline = time.monotonic() + app.config['SSE_MAX_SECONDS']
+        yield f"retry: {int(app.config['SSE_INTERVAL'] * 1000)}\n\n"
+        while time.monotonic() < deadline:
+            session = Session()
+            try:
+                status = refresh_status(session)
+            finally:
+                session.close()
+            payload = dumps_json(status)
+            if not status['running']:
+                yield f"event: done\ndata: {payload}\n\n"
+                return
+            yield f"data: {payload}\n\n"
+            time.sleep(app.config['SSE_INTERVAL'])
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/clear_all', methods=['POST'])
 def clear_all():
+    session = Session()
     try:
-        session = Session()
-        # Delete all records
-        session.query(History).delete()
-        session.query(Stock).delete()
-        # Reset sequences with text() for raw SQL
-        session.execute(text("ALTER SEQUENCE stock_id_seq RESTART WITH 1"))
-        session.execute(text("ALTER SEQUENCE history_id_seq RESTART WITH 1"))
-        session.commit()
+        if is_refresh_running(session):
+            flash("Refresh is running; clear data after it finishes.")
+            return redirect(url_for('index'))
+        purge_all(session)
+        data_version.bump()
         flash("All stock and history data cleared, sequences reset.")
     except Exception as e:
         session.rollback()
@@ -280,13 +1021,10 @@ def clear_all():
 
 @app.route('/clear_stock/<code>', methods=['POST'])
 def clear_stock(code):
+    session = Session()
     try:
-        session = Session()
-        stock = session.query(Stock).filter_by(code=code).first()
-        if stock:
-            session.query(History).filter_by(stock_id=stock.id).delete()
-            session.delete(stock)
-            session.commit()
+        if purge_stock(session, code):
+            data_version.bump()
             flash(f"Stock {code} and its history cleared.")
         else:
             flash(f"Stock {code} not found.")
@@ -299,34 +1037,125 @@ def clear_stock(code):
 
 @app.route('/retry_failed', methods=['POST'])
 def retry_failed():
+    """
+    Queue every failed stock as a retry job and work it in the background.
+
+    Returns at once: a redirect with the job id flashed, or 202 with the job
+    handle and its status URL when the client asks for JSON.
+    """
+    global refresh_thread
+    session = Session()
+    job_id = None
     try:
-        session = Session()
-        failed_stocks = session.query(Stock).filter(
-            Stock.current_score == 0,
-            Stock.breakdown == {}
-        ).all()
-        if not failed_stocks:
-            logger.info("No failed stocks found for retry.")
-            flash("No failed stocks to retry.")
-            session.close()
-            return redirect(url_for('index'))
-        logger.info(f"Starting retry for {len(failed_stocks)} failed stocks.")
-        updated_count = 0
-        for stock in failed_stocks:
-            success, message, count = update_stock_data(session, stock.code, stock.name)
-            updated_count += count
-            if not success:
-                flash(message)
-        flash(f"Retry complete! Updated {updated_count} failed stocks.")
+        running = is_refresh_running(session)
+        with refresh_lock:
+            if running or (refresh_thread and refresh_thread.is_alive()):
+                message = "A refresh is running; failed stocks can be retried once it finishes."
+            else:
+                planned = plan_retry(session, retry_breaker)
+                due = sum(1 for _, _, priority in planned if priority is not None)
+                if not due:
+                    message = f"No failed stocks to retry ({len(planned)} held by the circuit breaker)."
+                else:
+                    job, created = reserve_job(session, timedelta(seconds=app.config['REFRESH_CLAIM_TIMEOUT']),
+                                               kind=KIND_RETRY)
+                    if not created:
+                        message = "A refresh is running; failed stocks can be retried once it finishes."
+                    else:
+                        job_id = plan_job(session, job, planned).id
+                        refresh_stop_event.clear()
+                        refresh_thread = threading.Thread(target=background_retry, args=(job_id,), daemon=True)
+                        refresh_thread.start()
+                        message = (f"Retrying {due} failed stocks in the background (job {job_id}, "
+                                   f"{len(planned) - due} held by the circuit breaker).")
     except Exception as e:
         logger.error(f"Database error during retry_failed: {e}, Traceback: {traceback.format_exc()}")
-        flash(f"Database error: {e}")
         session.rollback()
+        message = f"Database error: {e}"
     finally:
         session.close()
-        logger.info(f"Session closed after retry_failed, total updated: {updated_count}")
+    logger.info(message)
+    if request.accept_mimetypes.best == 'application/json':
+        body = {'message': message, 'job_id': job_id,
+                'status_url': url_for('refresh_status_view', job=job_id) if job_id else None}
+        return Response(dumps_json(body), status=202 if job_id else 200, mimetype='application/json')
+    flash(message)
     return redirect(url_for('index'))
 
+@app.route('/rescore', methods=['POST'])
+def rescore():
+    session = Session()
+    if is_refresh_running(session):
+        session.close()
+        flash("Refresh is running; rescore after it finishes.")
+        return redirect(url_for('index'))
+    try:
+        stats = rescore_stocks(session)
+        data_version.bump()
+        flash(f"Rescored {stats['scanned']} stocks in {stats['seconds']:.2f}s, {stats['changed']} changed.")
+    except Exception as e:
+        logger.error(f"Database error during rescore: {e}, Traceback: {traceback.format_exc()}")
+        session.rollback()
+        flash(f"Database error: {e}")
+    finally:
+        session.close()
+    return redirect(url_for('index'))
+
+@app.cli.command('rescore')
+@click.option('--chunk-size', default=1000, show_default=True, help='Stocks loaded and updated per batch.')
+@click.option('--from-cache', is_flag=True, help='Re-extract values from cached payloads instead of stored inputs.')
+def rescore_command(chunk_size, from_cache):
+    """Recompute all scores from stored inputs without refetching."""
+    session = Session()
+    try:
+        if from_cache:
+            if not payload_cache:
+                raise click.ClickException("PAYLOAD_CACHE_PATH is not set.")
+            stats = rescore_from_payloads(session, payload_cache.items(), chunk_size=chunk_size)
+            data_version.bump()
+            click.echo(f"Replayed {stats['scanned']} cached payloads in {stats['seconds']:.2f}s, "
+                       f"{stats['changed']} changed, {stats['skipped']} skipped.")
+            return
+        stats = rescore_stocks(session, chunk_size=chunk_size)
+        data_version.bump()
+    finally:
+        session.close()
+    click.echo(f"Rescored {stats['scanned']} stocks in {stats['seconds']:.2f}s, {stats['changed']} changed.")
+
+@app.cli.command('compact-history')
+@click.option('--chunk-size', default=5000, show_default=True, help='History rows converted per batch.')
+def compact_history_command(chunk_size):
+    """Move JSON breakdowns of existing History rows into the packed columns."""
+    session = Session()
+    try:
+        stats = compact_history(session, chunk_size=chunk_size)
+    finally:
+        session.close()
+    click.echo(f"Packed {stats['packed']} of {stats['scanned']} History breakdowns in {stats['seconds']:.2f}s.")
+    if stats['packed']:
+        click.echo("Run VACUUM (SQLite) or VACUUM FULL history (Postgres) to return the space to the OS.")
+
+@app.cli.command('prune-history')
+@click.option('--days', type=int, default=None, help='Age in days past which History is thinned [HISTORY_RETENTION_DAYS].')
+@click.option('--keep', type=click.Choice(RETENTION_KEEP), default=None,
+              help='Snapshot kept per stock and bucket; none deletes [HISTORY_RETENTION_KEEP].')
+@click.option('--chunk-size', default=5000, show_default=True, help='History rows deleted per transaction.')
+def prune_history_command(days, keep, chunk_size):
+    """Delete or downsample old History in small transactions."""
+    days = app.config['HISTORY_RETENTION_DAYS'] if days is None else days
+    keep = keep or app.config['HISTORY_RETENTION_KEEP']
+    if keep not in RETENTION_KEEP:
+        raise click.ClickException(f"HISTORY_RETENTION_KEEP must be one of {', '.join(RETENTION_KEEP)}.")
+    session = Session()
+    try:
+        stats = prune_history(session, datetime.utcnow() - timedelta(days=days), keep=keep, chunk_size=chunk_size)
+        if stats['deleted']:
+            data_version.bump()
+    finally:
+        session.close()
+    click.echo(f"Deleted {stats['deleted']} of {stats['scanned']} History rows older than {days} days "
+               f"in {stats['seconds']:.2f}s.")
+
 @app.route('/favorite/<code>', methods=['POST'])
 def favorite(code):
     try:
@@ -335,6 +1164,7 @@ def favorite(code):
         if stock:
             stock.is_favorite = not stock.is_favorite
             session.commit()
+            data_version.bump()
             flash(f"{stock.name} favorite toggled!")
         session.close()
     except Exception as e:
@@ -359,4 +1189,5 @@ def manual_refresh():
     return render_template('manual_refresh.html')
 
 if __name__ == '__main__':
+    init_db()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,275 @@
+import logging
+from collections import namedtuple
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Stock, History, ScoreChange
+from scoring import extract_values, compute_score
+
+logger = logging.getLogger(__name__)
+
+# Stock.status
+STOCK_OK, STOCK_FAILED = 'ok', 'failed'
+# Stock columns overwritten on every successful refresh
+SCORE_COLUMNS = ['growth_cagr', 'div_yield', 'pe_ratio', 'roe', 'profit', 'latest_profit', 'cash_positive',
+                 'current_score', 'breakdown', 'industry', 'market', 'last_updated', 'last_refreshed',
+                 'status', 'failure_count', 'last_error']
+# Stock columns copied into a History snapshot when the score changes
+HISTORY_COLUMNS = ['growth_cagr', 'div_yield', 'pe_ratio', 'roe', 'profit', 'cash_positive']
+# Breakdown key -> small integer History column; the other keys are sums of these
+BREAKDOWN_COLUMNS = {'G': 'g_points', 'D': 'd_points', 'P_PER': 'p_per_points',
+                     'P_PM': 'p_pm_points', 'R': 'r_points', 'C': 'c_points'}
+
+
+def unpack_breakdown(values) -> dict:
+    """
+    Rebuild the breakdown dict (G, D, P_PER, GDP, P_PM, R, C, PRC, W) from a
+    mapping of History columns, falling back to its JSON breakdown.
+    """
+    if values.get('g_points') is None:
+        return values.get('breakdown') or {}
+    g, d, p_per, p_pm, r, c = (values[column] for column in BREAKDOWN_COLUMNS.values())
+    gdp, prc = g + d + p_per, p_pm + r + c
+    return {'G': g, 'D': d, 'P_PER': p_per, 'GDP': gdp, 'P_PM': p_pm, 'R': r, 'C': c, 'PRC': prc,
+            'W': max(0, gdp + prc)}
+
+
+def pack_breakdown(breakdown: Optional[dict]) -> dict:
+    """
+    History column values for a breakdown: the packed components, or the JSON
+    as-is when packing would not round-trip (missing keys, non-integer points).
+    """
+    packed = {column: (breakdown or {}).get(key) for key, column in BREAKDOWN_COLUMNS.items()}
+    if all(isinstance(value, int) and not isinstance(value, bool) and -32768 <= value <= 32767 for value in packed.values()) \
+            and unpack_breakdown(packed) == breakdown:
+        return dict(packed, breakdown=None)
+    return dict(dict.fromkeys(BREAKDOWN_COLUMNS.values()), breakdown=breakdown)
+
+
+def build_stock_row(stock_data: dict) -> dict:
+    """
+    Score an all.json payload and map it onto Stock column values.
+    """
+    values = extract_values(stock_data)
+    score, breakdown = compute_score(**values)
+    now = datetime.utcnow()
+    return {
+        'growth_cagr': values['growth'],
+        'div_yield': values['div_yield'],
+        'pe_ratio': values['per'],
+        'roe': values['roe'],
+        'profit': values['margin'],
+        'latest_profit': values['profit'],
+        'cash_positive': values['cash_positive'],
+        'current_score': score,
+        'breakdown': breakdown,
+        'industry': stock_data.get('Sector', {}).get('name', 'Unknown'),
+        'market': stock_data.get('Sector', {}).get('Board', {}).get('name', 'Unknown'),
+        'last_updated': now,
+        'last_refreshed': now,
+        'status': STOCK_OK,
+        'failure_count': 0,
+        'last_error': None,
+    }
+
+
+IndexEntry = namedtuple('IndexEntry', ['id', 'last_refreshed', 'current_score'])
+
+
+class StockIndex:
+    """
+    In-memory code -> (id, last_refreshed, current_score) map for one refresh run.
+
+    Built from RefreshScheduler's preload (or loaded with a single query) and
+    kept current by BatchWriter, so new-row detection and history comparison
+    don't need a per-stock lookup. Skip decisions live in RefreshScheduler.plan.
+    """
+
+    def __init__(self, entries: dict[str, IndexEntry]):
+        self.entries = entries
+
+    @classmethod
+    def load(cls, session) -> 'StockIndex':
+        rows = session.execute(select(Stock.code, Stock.id, Stock.last_refreshed, Stock.current_score))
+        return cls({code: IndexEntry(stock_id, last_refreshed, score) for code, stock_id, last_refreshed, score in rows})
+
+    def get(self, code: str) -> Optional[IndexEntry]:
+        return self.entries.get(code)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.entries
+
+    def update(self, code: str, current_score: int, last_refreshed: datetime) -> None:
+        entry = self.entries.get(code)
+        self.entries[code] = IndexEntry(entry.id if entry else None, last_refreshed, current_score)
+
+
+def dialect_insert(session):
+    name = session.get_bind().dialect.name
+    if name == 'postgresql':
+        return postgresql.insert
+    if name == 'sqlite':
+        return sqlite.insert
+    return None
+
+
+def record_score_changes(session, history: list[dict], scores: dict[int, int]) -> None:
+    """
+    Upsert the ScoreChange row of every stock that just got a History snapshot.
+
+    Args:
+        history: History rows being inserted (stock_id, score = previous score, date)
+        scores: stock_id -> new score
+    """
+    changes = [{'stock_id': h['stock_id'], 'previous_score': h['score'], 'score': scores[h['stock_id']],
+                'delta': scores[h['stock_id']] - h['score'], 'changed_at': h['date']} for h in history]
+    if not changes:
+        return
+    dialect_insert_fn = dialect_insert(session)
+    if dialect_insert_fn is None:
+        for change in changes:
+            session.merge(ScoreChange(**change))
+        return
+    stmt = dialect_insert_fn(ScoreChange.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ScoreChange.stock_id],
+        set_={column: stmt.excluded[column] for column in ('previous_score', 'score', 'delta', 'changed_at')}
+    )
+    session.execute(stmt, changes)
+
+
+class BatchWriter:
+    """
+    Accumulates refreshed Stock rows and writes them in chunks.
+
+    Each flush finds the stocks whose score changed (from the StockIndex when
+    one is given, else with one query over the chunk), bulk-inserts History
+    snapshots and ScoreChange rows for them, upserts the Stock rows with
+    INSERT ... ON CONFLICT (code) and commits once. Dialects without ON
+    CONFLICT fall back to ORM merges inside the same single commit.
+
+    Args:
+        session: SQLAlchemy session owned by the refresh thread
+        batch_size: Rows buffered before an automatic flush
+        index: Optional preloaded StockIndex, kept in sync on every flush
+        on_flush: Optional callback run after each successful commit
+    """
+
+    def __init__(self, session, batch_size: int = 100, index: Optional[StockIndex] = None,
+                 on_flush: Optional[Callable[[], Any]] = None):
+        self.session = session
+        self.batch_size = batch_size
+        self.index = index
+        self.on_flush = on_flush
+        self.rows: dict[str, dict] = {}
+        self.failed: dict[str, tuple[str, Optional[str]]] = {}
+
+    def add(self, code: str, name: str, row: dict) -> None:
+        self.failed.pop(code, None)
+        self.rows[code] = dict(row, code=code, name=name)
+        self._maybe_flush()
+
+    def add_failed(self, code: str, name: str, error: Optional[str] = None) -> None:
+        """
+        Record a failed fetch: new stocks are created with status failed (score 0)
+        for retry_failed, and every stock's failure_count and last_error are updated.
+        """
+        if code not in self.rows:
+            self.failed[code] = (name, error)
+            self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        if len(self.rows) + len(self.failed) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write everything buffered. Returns the number of Stock rows updated.
+        """
+        if not self.rows and not self.failed:
+            return 0
+        rows = list(self.rows.values())
+        now = datetime.utcnow()
+        failed = [{'code': code, 'name': name, 'status': STOCK_FAILED, 'failure_count': 1, 'last_error': error,
+                   'last_failed_at': now} for code, (name, error) in self.failed.items()]
+        self.rows, self.failed = {}, {}
+        try:
+            self._write_history(rows)
+            self._upsert(rows, failed)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        if self.index is not None:
+            for row in rows:
+                self.index.update(row['code'], row['current_score'], row['last_refreshed'])
+            for row in failed:
+                if row['code'] not in self.index:
+                    self.index.update(row['code'], 0, None)
+        if self.on_flush:
+            self.on_flush()
+        logger.info(f"Flushed {len(rows)} stocks ({len(failed)} failed) to the database")
+        return len(rows)
+
+    def _write_history(self, rows: list[dict]) -> None:
+        if self.index is not None:
+            codes = []
+            for row in rows:
+                entry = self.index.get(row['code'])
+                if entry and entry.current_score not in (None, 0) and entry.current_score != row['current_score']:
+                    codes.append(row['code'])
+        else:
+            codes = [row['code'] for row in rows]
+        if not codes:
+            return
+        columns = [Stock.id, Stock.code, Stock.current_score, Stock.breakdown] + [getattr(Stock, c) for c in HISTORY_COLUMNS]
+        previous = {r.code: r for r in self.session.execute(select(*columns).where(Stock.code.in_(codes)))}
+        history, scores = [], {}
+        for row in rows:
+            old = previous.get(row['code'])
+            if old is None or old.current_score in (None, 0) or old.current_score == row['current_score']:
+                continue
+            snapshot = {c: getattr(old, c) for c in HISTORY_COLUMNS}
+            history.append(dict(snapshot, **pack_breakdown(old.breakdown), stock_id=old.id, score=old.current_score,
+                                date=row['last_refreshed']))
+            scores[old.id] = row['current_score']
+        if history:
+            self.session.execute(insert(History), history)
+            record_score_changes(self.session, history, scores)
+
+    def _upsert(self, rows: list[dict], failed: list[dict]) -> None:
+        dialect_insert_fn = dialect_insert(self.session)
+        if dialect_insert_fn is None:
+            for row in rows:
+                stock = self.session.query(Stock).filter_by(code=row['code']).first() or Stock(code=row['code'], name=row['name'])
+                for column in SCORE_COLUMNS:
+                    setattr(stock, column, row[column])
+                self.session.add(stock)
+            for row in failed:
+                stock = self.session.query(Stock).filter_by(code=row['code']).first()
+                if stock is None:
+                    self.session.add(Stock(**row))
+                else:
+                    stock.failure_count = (stock.failure_count or 0) + 1
+                    stock.last_error, stock.last_failed_at = row['last_error'], row['last_failed_at']
+            return
+        table = Stock.__table__
+        if rows:
+            stmt = dialect_insert_fn(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.code],
+                set_={column: stmt.excluded[column] for column in SCORE_COLUMNS}
+            )
+            self.session.execute(stmt, rows)
+        if failed:
+            # Existing stocks keep their data and status; only the failure tracking changes
+            stmt = dialect_insert_fn(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.code],
+                set_={'failure_count': func.coalesce(table.c.failure_count, 0) + 1,
+                      'last_error': stmt.excluded.last_error, 'last_failed_at': stmt.excluded.last_failed_at}
+            )
+            self.session.execute(stmt, failed)
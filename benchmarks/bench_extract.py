@@ -0,0 +1,182 @@
+"""
+Micro-benchmark for scoring.extract_values on recorded payloads.
+
+Replays every payload in a PayloadCache file (or synthetic payloads shaped
+like klsescreener all.json when no cache is given), checks the output is
+identical to the previous multi-pass implementation kept below, and times
+both.
+
+    python benchmarks/bench_extract.py [--cache payload_cache.db] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from payload_cache import PayloadCache
+from scoring import extract_values
+
+
+# Reference: extract_values / clean_float before the single-pass rewrite
+def legacy_clean_float(value: Any) -> float:
+    """
+    Safely convert value to float, handling None, commas, and invalid strings.
+    """
+    if value is None:
+        return 0.0
+    str_val = str(value).replace(',', '')  # Remove commas (e.g., '1,057.27' → '1057.27')
+    try:
+        return float(str_val)
+    except (ValueError, TypeError):
+        return 0.0
+
+def legacy_extract_values(stock_data: dict) -> dict[str, float]:
+    """
+    Extract necessary values from stock_data JSON for scoring.
+    
+    Args:
+        stock_data: JSON response from KLSEScreener API
+        
+    Returns:
+        Dictionary with keys: growth, div_yield, per, roe, margin, profit, cash_positive, cash_ratio
+    """
+    # Extract div_yield, per, roe from Stock
+    stock = stock_data.get('Stock', {})
+    div_yield = legacy_clean_float(stock.get('DY', 0))
+    per = legacy_clean_float(stock.get('PE', 999))  # Default high for invalid
+    roe = legacy_clean_float(stock.get('ROE', 0))
+    
+    # Extract growth from StockIndicator or calculate manually
+    indicators = stock_data.get('StockIndicator', {})
+    growth = legacy_clean_float(indicators.get('cagr_5y', 0))
+    if growth == 0:
+        reports = stock_data.get('FinancialReport', [])
+        if reports:
+            annual_profits = defaultdict(float)
+            for report in reports:
+                year = report['financial_year_end'][:4]  # Extract year
+                profit = legacy_clean_float(report.get('profit_loss', 0))
+                annual_profits[year] += profit
+            
+            years = sorted(annual_profits.keys(), reverse=True)[:5]
+            if len(years) >= 2:
+                latest_year = years[0]
+                earliest_year = years[-1]
+                latest_profit = annual_profits[latest_year]
+                earliest_profit = annual_profits[earliest_year]
+                if earliest_profit <= 0 or latest_profit <= 0:
+                    growth = 0
+                else:
+                    num_years = len(years) - 1
+                    growth = ((latest_profit / earliest_profit) ** (1 / num_years) - 1)
+            else:
+                growth = legacy_clean_float(indicators.get('cagr_3y', 0))
+    
+    growth = growth * 100
+    # Extract profit, revenue for margin, and cash_flow from latest report
+    profit = 0
+    revenue = 1
+    cash_positive = False
+    reports = stock_data.get('FinancialReport', [])
+    if reports:
+        # Sort by date to get latest
+        latest = max(reports, key=lambda r: datetime.strptime(r['quarter_date_end'], '%Y-%m-%d'))
+        profit = legacy_clean_float(latest.get('profit_loss', 0))
+        revenue = legacy_clean_float(latest.get('revenue', 1))
+        # Check operating CF if available, else fallback to any positive profit in last 4 quarters
+        if 'operating_cf' in latest:
+            cash_positive = legacy_clean_float(latest.get('operating_cf', 0)) > 0
+        else:
+            cash_positive = any(legacy_clean_float(r.get('profit_loss', 0)) > 0 for r in reports[-4:])  # Last year approx
+    
+    margin = (profit / revenue * 100) if revenue else 0
+
+    # Cash ratio from balance sheet or StockIndicator (handle list case)
+    bs = stock_data.get('stock_bs', {})
+    if not isinstance(bs, dict):
+        bs = stock_data.get('StockIndicator', {})  # Fallback to indicators for warrants
+    total_cash = legacy_clean_float(bs.get('total_cash', 0))
+    total_debt = legacy_clean_float(bs.get('total_debt', 0))
+    total_equity = legacy_clean_float(bs.get('total_equity', 0))
+    cash_ratio = (total_cash / total_equity * 100) if total_equity > 0 else 0
+    cash_positive = cash_positive or (total_cash > total_debt)  # Enhanced check
+
+    return {
+        'growth': growth,
+        'div_yield': div_yield,
+        'per': per,
+        'roe': roe,
+        'margin': margin,  # Profit margin
+        'profit': profit,
+        'cash_positive': 1 if cash_positive else 0,
+        'cash_ratio': cash_ratio
+    }
+
+
+def synthetic_payload(rng: random.Random, quarters: int = 40) -> dict:
+    def number(low, high):
+        value = rng.uniform(low, high)
+        return f"{value:,.2f}" if rng.random() < 0.7 else round(value, 2)
+
+    end = date(2025, 6, 30)
+    reports = []
+    for q in range(quarters):
+        quarter_end = end - timedelta(days=91 * q)
+        report = {
+            'financial_year_end': f"{quarter_end.year}-12-31",
+            'quarter_date_end': quarter_end.isoformat(),
+            'profit_loss': number(-5000, 20000),
+            'revenue': number(1000, 200000),
+        }
+        if rng.random() < 0.5:
+            report['operating_cf'] = number(-3000, 10000)
+        reports.append(report)
+    rng.shuffle(reports)
+    return {
+        'Stock': {'DY': number(0, 9), 'PE': number(-10, 40), 'ROE': number(-5, 30)},
+        'StockIndicator': {'cagr_5y': 0 if rng.random() < 0.6 else number(-0.2, 0.4), 'cagr_3y': number(-0.2, 0.4)},
+        'FinancialReport': reports,
+        'stock_bs': {'total_cash': number(0, 1e6), 'total_debt': number(0, 1e6), 'total_equity': number(-1e5, 2e6)},
+        'Sector': {'name': 'Technology', 'Board': {'name': 'Main Market'}},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--cache', help='PayloadCache SQLite file with recorded payloads')
+    parser.add_argument('--count', type=int, default=1000, help='Synthetic payloads when no cache is given')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.cache:
+        payloads = [data for _, data in PayloadCache(args.cache).items()]
+    else:
+        rng = random.Random(0)
+        payloads = [synthetic_payload(rng) for _ in range(args.count)]
+
+    for i, payload in enumerate(payloads):
+        expected, actual = legacy_extract_values(payload), extract_values(payload)
+        if expected != actual:
+            raise SystemExit(f"Mismatch on payload {i}: {expected} vs {actual}")
+
+    timings = {}
+    for name, fn in [('legacy', legacy_extract_values), ('single-pass', extract_values)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for payload in payloads:
+                fn(payload)
+        timings[name] = (time.perf_counter() - start) / (args.repeat * len(payloads))
+
+    print(f"{len(payloads)} payloads x {args.repeat}, outputs identical")
+    for name, seconds in timings.items():
+        print(f"{name:12s} {seconds * 1e6:8.1f} us/payload")
+    print(f"speedup      {timings['legacy'] / timings['single-pass']:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+History read paths on millions of rows: per-stock series, market-wide buckets and movers.
+
+Loads synthetic Stock/History rows into a throwaway SQLite database (or
+DATABASE_URL if set) and times the /api history endpoints through the Flask
+test client. Movers are also timed the old way, from a full History scan.
+--drop-index removes ix_history_stock_date first, to show what it buys.
+
+    python benchmarks/bench_history.py [--stocks 1500] [--rows 2000000] [--repeat 20] [--drop-index]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed(session, models, stocks: int, rows: int) -> None:
+    from sqlalchemy import insert
+    Stock, History, ScoreChange = models
+    rng = random.Random(0)
+    session.execute(insert(Stock), [{'code': f"{i:06d}", 'name': f"STOCK{i}", 'current_score': rng.randint(1, 200),
+                                     'breakdown': {}, 'industry': f"Industry{i % 12}"} for i in range(stocks)])
+    ids = [stock_id for stock_id, in session.query(Stock.id)]
+    end = datetime.utcnow()
+    span = 730 * 86400
+    latest = {}
+    batch = []
+    for i in range(rows):
+        stock_id = rng.choice(ids)
+        date = end - timedelta(seconds=rng.randrange(span))
+        score = rng.randint(1, 200)
+        batch.append({'stock_id': stock_id, 'date': date, 'score': score, 'breakdown': {'G': 30, 'D': 15},
+                      'growth_cagr': rng.uniform(-20, 40), 'div_yield': rng.uniform(0, 8),
+                      'pe_ratio': rng.uniform(3, 60), 'roe': rng.uniform(-10, 30),
+                      'profit': rng.uniform(-20, 40), 'cash_positive': rng.choice([0.0, 1.0])})
+        if stock_id not in latest or latest[stock_id][0] < date:
+            latest[stock_id] = (date, score)
+        if len(batch) == 50_000:
+            session.execute(insert(History), batch)
+            batch = []
+    if batch:
+        session.execute(insert(History), batch)
+    session.execute(insert(ScoreChange), [{'stock_id': stock_id, 'previous_score': score, 'score': score + 5,
+                                           'delta': 5 - (stock_id % 11), 'changed_at': date}
+                                          for stock_id, (date, score) in latest.items()])
+    session.commit()
+
+
+def timed(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--stocks', type=int, default=1500)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--drop-index', action='store_true')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    os.environ['PAYLOAD_CACHE_PATH'] = ''
+    os.environ['DATA_VERSION_FILE'] = ''
+    import app as stock_app
+    from sqlalchemy import func, select, text
+    from models import Stock, History, ScoreChange
+
+    stock_app.init_db()
+    session = stock_app.Session()
+    if session.query(History).count() < args.rows:
+        started = time.perf_counter()
+        seed(session, (Stock, History, ScoreChange), args.stocks, args.rows)
+        print(f"Seeded {args.rows} History rows in {time.perf_counter() - started:.1f}s")
+    if args.drop_index:
+        session.execute(text("DROP INDEX IF EXISTS ix_history_stock_date"))
+        session.commit()
+    codes = [code for code, in session.query(Stock.code).limit(50)]
+    since = datetime.utcnow() - timedelta(days=7)
+
+    def movers_from_history():
+        # What a movers view costs without ScoreChange: latest snapshot per stock from all of History
+        latest = select(History.stock_id, func.max(History.date).label('date')).group_by(History.stock_id).subquery()
+        session.execute(
+            select(Stock.code, History.score, (Stock.current_score - History.score).label('delta'))
+            .join(latest, (History.stock_id == latest.c.stock_id) & (History.date == latest.c.date))
+            .join(Stock, Stock.id == History.stock_id)
+            .where(History.date >= since)
+            .order_by(func.abs(Stock.current_score - History.score).desc()).limit(20)
+        ).all()
+
+    client = stock_app.app.test_client()
+    rng = random.Random(1)
+
+    def get(url):
+        resp = client.get(url)
+        assert resp.status_code == 200, resp.status_code
+
+    start = (datetime.utcnow() - timedelta(days=90)).strftime('%Y-%m-%d')
+    print(f"{args.stocks} stocks, {args.rows} History rows, index {'dropped' if args.drop_index else 'present'}, "
+          f"mean of {args.repeat} requests")
+    print(f"stock series raw:           {timed(lambda: get(f'/api/stocks/{rng.choice(codes)}/history'), args.repeat):9.2f} ms")
+    print(f"stock series weekly:        {timed(lambda: get(f'/api/stocks/{rng.choice(codes)}/history?interval=week'), args.repeat):9.2f} ms")
+    print(f"market daily, 90 days:      {timed(lambda: get(f'/api/history?start={start}'), args.repeat):9.2f} ms")
+    print(f"market weekly, all:         {timed(lambda: get('/api/history?interval=week'), max(args.repeat // 10, 1)):9.2f} ms")
+    print(f"movers (ScoreChange):       {timed(lambda: get('/api/movers?since=2000-01-01'), args.repeat):9.2f} ms")
+    print(f"movers (History scan):      {timed(movers_from_history, max(args.repeat // 10, 1)):9.2f} ms")
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+History storage and scan time before and after compact_history packs the breakdowns.
+
+Loads synthetic History rows with full JSON breakdowns (the old format) into a
+throwaway SQLite database (or DATABASE_URL if set), measures the table size
+and two full scans, runs compact_history, reclaims the space and measures again.
+
+    python benchmarks/bench_history_storage.py [--rows 500000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed(session, History, rows: int) -> None:
+    from sqlalchemy import insert
+    from scoring import compute_score
+    rng = random.Random(0)
+    batch = []
+    for i in range(rows):
+        values = {'growth': rng.uniform(-20, 40), 'div_yield': rng.uniform(0, 8), 'per': rng.uniform(3, 60),
+                  'roe': rng.uniform(-10, 30), 'margin': rng.uniform(-20, 40), 'profit': rng.uniform(-1, 1),
+                  'cash_positive': rng.randint(0, 1)}
+        score, breakdown = compute_score(**values)
+        batch.append({'stock_id': i % 1500 + 1, 'score': score, 'breakdown': breakdown,
+                      'growth_cagr': values['growth'], 'div_yield': values['div_yield'], 'pe_ratio': values['per'],
+                      'roe': values['roe'], 'profit': values['margin'], 'cash_positive': float(values['cash_positive'])})
+        if len(batch) == 50_000:
+            session.execute(insert(History), batch)
+            batch = []
+    if batch:
+        session.execute(insert(History), batch)
+    session.commit()
+
+
+def table_bytes(session) -> int:
+    from sqlalchemy import text
+    if session.get_bind().dialect.name == 'postgresql':
+        session.commit()
+        session.connection().execution_options(isolation_level='AUTOCOMMIT').exec_driver_sql('VACUUM FULL history')
+        return session.execute(text("SELECT pg_total_relation_size('history')")).scalar()
+    session.commit()
+    session.connection().exec_driver_sql('VACUUM')
+    # dbstat is not compiled into every SQLite; fall back to the whole file
+    try:
+        return session.execute(text("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE '%history%'")).scalar()
+    except Exception:
+        session.rollback()
+        return session.execute(text('PRAGMA page_count')).scalar() * session.execute(text('PRAGMA page_size')).scalar()
+
+
+def timed(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    os.environ['PAYLOAD_CACHE_PATH'] = ''
+    os.environ['DATA_VERSION_FILE'] = ''
+    import app as stock_app
+    from sqlalchemy import func, select
+    from history import BREAKDOWN_HISTORY_COLUMNS, compact_history, with_breakdown
+    from models import History
+
+    stock_app.init_db()
+    session = stock_app.Session()
+    if session.query(History).count() < args.rows:
+        seed(session, History, args.rows)
+
+    def breakdown_scan():
+        # Every breakdown, in the old dict shape
+        for row in session.execute(select(History.id, *BREAKDOWN_HISTORY_COLUMNS).execution_options(yield_per=10_000)):
+            with_breakdown(row._asdict())
+
+    def score_scan():
+        session.execute(select(History.stock_id, func.avg(History.score)).group_by(History.stock_id)).all()
+
+    def report(label: str) -> tuple[int, float, float]:
+        size = table_bytes(session)
+        breakdown_ms = timed(breakdown_scan, args.repeat)
+        score_ms = timed(score_scan, args.repeat)
+        print(f"{label:8} {size / 2**20:9.1f} MiB  {size / args.rows:6.1f} B/row  "
+              f"breakdown scan {breakdown_ms:8.1f} ms  score scan {score_ms:7.1f} ms")
+        return size, breakdown_ms, score_ms
+
+    print(f"{args.rows} History rows, mean of {args.repeat} scans")
+    before = report('JSON')
+    stats = compact_history(session)
+    print(f"compact_history packed {stats['packed']} rows in {stats['seconds']:.1f}s")
+    after = report('packed')
+    print(f"size {after[0] / before[0] - 1:+.0%}, breakdown scan {after[1] / before[1] - 1:+.0%}, "
+          f"score scan {after[2] / before[2] - 1:+.0%}")
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Page latency of the index() listing: OFFSET page 1 vs page 500 vs keyset cursor.
+
+Loads synthetic Stock rows into a throwaway SQLite database (or DATABASE_URL
+if set) and times requests through the Flask test client.
+
+    python benchmarks/bench_listing.py [--rows 50000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+INDUSTRIES = ['Technology', 'Property', 'Plantation', 'Energy', 'Financial Services', 'Consumer Products']
+MARKETS = ['Main Market', 'ACE Market', 'ETF']
+
+
+def seed(session, Stock, rows: int) -> None:
+    rng = random.Random(0)
+    batch = []
+    for i in range(rows):
+        batch.append({
+            'code': f"{i:06d}", 'name': f"STOCK{i}", 'current_score': rng.randint(0, 200),
+            'is_favorite': rng.random() < 0.01, 'breakdown': {}, 'industry': rng.choice(INDUSTRIES),
+            'market': rng.choice(MARKETS),
+        })
+        if len(batch) == 5000:
+            session.bulk_insert_mappings(Stock, batch)
+            batch = []
+    if batch:
+        session.bulk_insert_mappings(Stock, batch)
+    session.commit()
+
+
+def timed(client, url: str, repeat: int) -> float:
+    client.get(url)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        resp = client.get(url)
+        assert resp.status_code == 200, resp.status_code
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    os.environ['PAYLOAD_CACHE_PATH'] = ''
+    os.environ['DATA_VERSION_FILE'] = ''
+    import app as stock_app
+    from models import Stock
+
+    stock_app.init_db()
+    session = stock_app.Session()
+    if session.query(Stock).count() < args.rows:
+        seed(session, Stock, args.rows)
+    page = min(500, args.rows // 50)
+    row = session.query(Stock).order_by(Stock.is_favorite.desc(), Stock.current_score.desc(), Stock.id.desc()) \
+        .offset((page - 1) * 50 - 1).first()
+    cursor = stock_app.encode_cursor(row)
+    session.close()
+
+    client = stock_app.app.test_client()
+    print(f"{args.rows} stocks, mean of {args.repeat} requests")
+    print(f"OFFSET page 1:      {timed(client, '/?page=1', args.repeat):8.2f} ms")
+    print(f"OFFSET page {page}:    {timed(client, f'/?page={page}', args.repeat):8.2f} ms")
+    print(f"keyset page {page}:    {timed(client, f'/?after={cursor}', args.repeat):8.2f} ms")
+    print(f"OFFSET page {page // 6} + industry: {timed(client, f'/?page={page // 6}&industry=Technology', args.repeat):8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
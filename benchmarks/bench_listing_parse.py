@@ -0,0 +1,85 @@
+"""
+Listing row parse cost: BeautifulSoup (previous implementation) vs listing.parse_listing_row.
+
+Uses recorded datatables responses when given (a JSON file holding a list of
+response bodies), otherwise synthetic rows in the same shape. Asserts both
+parsers agree on every row before timing them.
+
+    python benchmarks/bench_listing_parse.py [--pages recorded.json] [--rows 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from listing import parse_listing_row
+
+
+def bs4_parse_listing_row(name_html):
+    # Reference: the per-row parse get_all_stock_codes used before the regex extractor
+    soup = BeautifulSoup(name_html, 'html.parser')
+    a_tag = soup.find('a')
+    if a_tag:
+        code = a_tag['href'].split('/')[-1]
+        if any(suffix in code for suffix in ['WA', 'WB', 'WD', 'WC']):
+            return None
+        short_name = a_tag.text.strip()
+        full_name = soup.get_text(separator=' ').strip().replace(short_name, '').replace(' ', '')
+        name = f"{short_name} - {full_name}"
+        if code and name:
+            return code, name
+    return None
+
+
+def synthetic_rows(n: int) -> list[str]:
+    rng = random.Random(0)
+    words = ['GLOBAL', 'HOLDINGS', 'BERHAD', 'BHD', 'TECH', 'PLANTATIONS', 'M&amp;A', 'RESOURCES', 'CAPITAL']
+    rows = []
+    for i in range(n):
+        code = f"{rng.randint(0, 9999):04d}" + rng.choice(['', '', '', 'WA', 'PA'])
+        short = ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rng.randint(3, 8)))
+        full = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+        rows.append(f'<a href="/web/stock/overview/{code}" target="_blank">{short}</a>'
+                    f'<br><span class="text-muted small">{short} {full}</span>')
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pages', help='JSON file with a list of recorded datatables responses')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.pages:
+        with open(args.pages) as f:
+            rows = [row[1] for page in json.load(f) for row in page.get('data', []) if len(row) >= 2]
+    else:
+        rows = synthetic_rows(args.rows)
+
+    for name_html in rows:
+        expected, actual = bs4_parse_listing_row(name_html), parse_listing_row(name_html)
+        if expected != actual:
+            raise SystemExit(f"Mismatch for {name_html!r}: {expected} vs {actual}")
+
+    timings = {}
+    for name, fn in [('BeautifulSoup', bs4_parse_listing_row), ('regex', parse_listing_row)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for name_html in rows:
+                fn(name_html)
+        timings[name] = (time.perf_counter() - start) / (args.repeat * len(rows))
+
+    print(f"{len(rows)} rows x {args.repeat}, outputs identical")
+    for name, seconds in timings.items():
+        print(f"{name:14s} {seconds * 1e6:8.1f} us/row")
+    print(f"speedup        {timings['BeautifulSoup'] / timings['regex']:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
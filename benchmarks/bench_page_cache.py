@@ -0,0 +1,100 @@
+"""
+Index page throughput with and without the page cache, under a mixed read load.
+
+Loads synthetic Stock rows into a throwaway SQLite database (or DATABASE_URL
+if set) and replays the same skewed sequence of index URLs (early pages and
+popular filters most often) through the Flask test client, once with the
+cache disabled and once enabled. --write-every N toggles a favorite every N
+requests, which bumps the data version and empties the cache, as a refresh
+or a user would.
+
+    python benchmarks/bench_page_cache.py [--rows 5000] [--requests 2000] [--threads 4] [--write-every 0]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_listing import INDUSTRIES, MARKETS, seed
+
+
+def workload(requests: int, pages: int) -> list[str]:
+    rng = random.Random(0)
+    filters = [''] * 6 + [f"&industry={industry}" for industry in INDUSTRIES] + \
+        [f"&market={market}" for market in MARKETS] + ['&favorites_only=true', '&min_score=150']
+    # Page n is requested about 1/n as often as page 1
+    weights = [1 / page for page in range(1, pages + 1)]
+    return [f"/?page={rng.choices(range(1, pages + 1), weights)[0]}{rng.choice(filters)}" for _ in range(requests)]
+
+
+def run(flask_app, urls: list[str], threads: int, write_every: int, code: str) -> float:
+    lock = threading.Lock()
+    position = iter(range(len(urls)))
+
+    def worker():
+        client = flask_app.test_client()
+        while True:
+            with lock:
+                i = next(position, None)
+            if i is None:
+                return
+            if write_every and i % write_every == write_every - 1:
+                assert client.post(f'/favorite/{code}').status_code == 302
+            resp = client.get(urls[i])
+            assert resp.status_code == 200, resp.status_code
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return len(urls) / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--write-every', type=int, default=0, help='POST /favorite every N requests (0 = read only)')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+    os.environ['PAYLOAD_CACHE_PATH'] = ''
+    os.environ['DATA_VERSION_FILE'] = ''
+    import app as stock_app
+    from models import Stock
+
+    stock_app.init_db()
+    session = stock_app.Session()
+    if session.query(Stock).count() < args.rows:
+        seed(session, Stock, args.rows)
+    code = session.query(Stock.code).order_by(Stock.current_score).first().code
+    session.close()
+
+    cache = stock_app.page_cache
+    max_bytes = cache.max_bytes or 16 * 1024 * 1024
+    urls = workload(args.requests, max(args.rows // 50, 1))
+    print(f"{args.rows} stocks, {args.requests} requests over {len(set(urls))} URLs, {args.threads} threads, "
+          f"{'write every %d' % args.write_every if args.write_every else 'read only'}")
+    cache.max_bytes = 0
+    uncached = run(stock_app.app, urls, args.threads, args.write_every, code)
+    print(f"no cache:    {uncached:8.1f} req/s")
+    cache.max_bytes = max_bytes
+    cached = run(stock_app.app, urls, args.threads, args.write_every, code)
+    stats = cache.stats()
+    print(f"page cache:  {cached:8.1f} req/s  x{cached / uncached:.1f}  hit rate "
+          f"{stats['hits'] / max(stats['hits'] + stats['misses'], 1):.0%}, {stats['entries']} entries, "
+          f"{stats['bytes'] / 2**20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+End-to-end refresh throughput against a local stub upstream: stocks/sec, DB queries per stock, peak memory.
+
+Starts stub_upstream.StubUpstream in this process (recorded fixtures or
+synthetic data, with the given latency and error rate) and runs
+background_refresh in a fresh Python process per database target: a
+throwaway SQLite file, plus --postgres URL when given. Run 1 inserts every
+stock; each later run shifts the stub's payloads and refetches everything,
+so it takes the update path (History rows, score changes). Queries per
+stock come from the refresh profiler at the sql level.
+
+The --postgres database is treated as throwaway: its tables are dropped first.
+The app requires TLS unless the URL (or PGSSLMODE) sets sslmode, so a local
+server without TLS needs ?sslmode=disable.
+
+    python benchmarks/bench_refresh.py [--stocks 1500] [--runs 2] [--latency-ms 100] [--error-rate 0.02]
+        [--workers 8] [--host-concurrency 4] [--batch-size 100] [--postgres 'postgresql://localhost/bench?sslmode=disable']
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from refresh_jobs import JOB_COMPLETED
+from stub_upstream import add_fixture_arguments, stub_from_args
+
+
+def peak_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker(runs: int) -> None:
+    """Runs inside the target process; prints one JSON result per refresh run."""
+    import requests
+    import app as stock_app
+    from models import db, RefreshJob, History
+
+    if stock_app.engine.dialect.name != 'sqlite':
+        db.metadata.drop_all(stock_app.engine)
+    stock_app.init_db()
+    baseline = peak_rss_mib()
+    for run in range(runs):
+        if run:
+            requests.post(f"{stock_app.app.config['KLSESCREENER_URL']}/_stub/generation", timeout=10)
+        started = time.perf_counter()
+        stock_app.background_refresh()
+        seconds = time.perf_counter() - started
+        profile = stock_app.refresh_profiler.last_summary or {}
+        session = stock_app.Session()
+        job = session.query(RefreshJob).order_by(RefreshJob.id.desc()).first()
+        history = session.query(History).count()
+        session.close()
+        processed = (job.updated or 0) + (job.failed or 0) if job else 0
+        stages = profile.get('stages', {})
+        print(json.dumps({
+            'run': run + 1, 'seconds': seconds, 'status': job.status if job else None,
+            'updated': job.updated if job else 0, 'failed': job.failed if job else 0, 'history': history,
+            'stocks_per_second': processed / seconds if seconds else 0,
+            'queries_per_stock': profile.get('sql', {}).get('per_stock'),
+            'stages': {name: stages[name]['seconds'] for name in ('listing', 'fetch_wait', 'db_write', 'checkpoint')
+                       if name in stages},
+            'rss_baseline': baseline, 'rss_peak': peak_rss_mib(),
+        }), flush=True)
+
+
+def measure(label: str, database_url: str, stub_url: str, args: argparse.Namespace) -> list[dict]:
+    env = dict(os.environ, DATABASE_URL=database_url, KLSESCREENER_URL=stub_url, I3INVESTOR_URL=stub_url,
+               PAYLOAD_CACHE_PATH='', DATA_VERSION_FILE='', REFRESH_PROFILE='sql',
+               REFRESH_WORKERS=str(args.workers), REFRESH_HOST_CONCURRENCY=str(args.host_concurrency),
+               REFRESH_BATCH_SIZE=str(args.batch_size),
+               # Every stock is due on every run
+               REFRESH_STALE_HOURS='0', REFRESH_FAVORITE_HOURS='0', REFRESH_HIGH_SCORE_HOURS='0',
+               REFRESH_VOLATILE_HOURS='0')
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', '--runs', str(args.runs)],
+                         cwd=ROOT, env=env, capture_output=True, text=True)
+    if out.returncode:
+        raise SystemExit(f"{label} failed:\n{out.stderr[-3000:]}")
+    results = [json.loads(line) for line in out.stdout.splitlines() if line.startswith('{')]
+    for result in results:
+        queries = result['queries_per_stock']
+        stages = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in result['stages'].items())
+        print(f"{label:10} run {result['run']} ({'insert' if result['run'] == 1 else 'update'}): "
+              f"{result['updated']} updated, {result['failed']} failed in {result['seconds']:.1f}s, "
+              f"{result['stocks_per_second']:.1f} stocks/s, "
+              f"{'%.2f' % queries if queries is not None else '?'} queries/stock, "
+              f"peak RSS {result['rss_peak']:.0f} MiB (+{result['rss_peak'] - result['rss_baseline']:.0f}), "
+              f"{result['history']} History rows; {stages}")
+        if result['status'] != JOB_COMPLETED:
+            print(f"{label:10} run {result['run']} ended {result['status']}")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_fixture_arguments(parser)
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=8, help='REFRESH_WORKERS')
+    parser.add_argument('--host-concurrency', type=int, default=4, help='REFRESH_HOST_CONCURRENCY')
+    parser.add_argument('--batch-size', type=int, default=100, help='REFRESH_BATCH_SIZE')
+    parser.add_argument('--postgres', help='Also run against this (throwaway) Postgres-compatible database')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.runs)
+        return
+
+    stub = stub_from_args(args).start()
+    print(f"Stub upstream: {len(stub.codes)} stocks, {len(stub.bodies)} payloads "
+          f"({stub.mean_payload_bytes / 1024:.1f} KiB mean), latency {args.latency_ms:.0f}+{args.jitter_ms:.0f} ms, "
+          f"error rate {args.error_rate:.0%}; {args.workers} workers, host concurrency {args.host_concurrency}, "
+          f"batch {args.batch_size}")
+    targets = [('sqlite', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")]
+    if args.postgres:
+        targets.append(('postgres', args.postgres))
+    try:
+        for label, database_url in targets:
+            stub.generation = 0
+            measure(label, database_url, stub.url, args)
+    finally:
+        stub.stop()
+    print(f"Stub served {stub.counts['listing']} listing pages, {stub.counts['payload']} payloads, "
+          f"{stub.counts['error']} errors")
+
+
+if __name__ == '__main__':
+    main()
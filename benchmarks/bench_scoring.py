@@ -0,0 +1,66 @@
+"""
+Compare scoring.compute_scores against the scalar compute_score.
+
+Checks element-wise equivalence on synthetic rows (random values mixed with
+every threshold edge and NaN) and times both paths.
+
+    python benchmarks/bench_scoring.py [--rows 100000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scoring import SCORE_TABLE, compute_score, compute_scores
+
+COLUMNS = ['growth', 'div_yield', 'per', 'roe', 'margin', 'profit', 'cash_positive']
+
+
+def synthetic_rows(n: int, seed: int = 0) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    edges = sorted({e for _, values, _, _ in SCORE_TABLE.values() for e in values} | {0})
+    special = np.array(edges + [np.nextafter(e, -np.inf) for e in edges] + [-1.0, np.nan, np.inf, -np.inf])
+    data = {}
+    for name in COLUMNS[:-1]:
+        column = rng.uniform(-10, 40, n)
+        mask = rng.random(n) < 0.3
+        column[mask] = rng.choice(special, mask.sum())
+        data[name] = column
+    data['cash_positive'] = rng.integers(0, 2, n)
+    return data
+
+
+def timed(fn, repeat: int):
+    """(result of the last call, mean seconds per call)."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = synthetic_rows(args.rows)
+    rows = [dict(zip(COLUMNS, values)) for values in zip(*(data[c].tolist() for c in COLUMNS))]
+    scalar, scalar_time = timed(lambda: [compute_score(**row) for row in rows], args.repeat)
+    (totals, breakdown), batch_time = timed(lambda: compute_scores(**data), args.repeat)
+
+    for i, (total, parts) in enumerate(scalar):
+        batch_parts = {key: int(values[i]) for key, values in breakdown.items()}
+        if total != totals[i] or parts != batch_parts:
+            raise SystemExit(f"Mismatch at row {i}: {rows[i]} -> {parts} vs {batch_parts}")
+
+    print(f"{args.rows} rows, results identical, mean of {args.repeat} runs")
+    print(f"compute_score  (scalar): {scalar_time * 1000:8.1f} ms")
+    print(f"compute_scores (numpy):  {batch_time * 1000:8.1f} ms  ({scalar_time / batch_time:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
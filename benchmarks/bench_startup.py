@@ -0,0 +1,81 @@
+"""
+Per-worker boot cost: import time, RSS and engine count of a fresh `import app`.
+
+Each run is a new Python process, like a gunicorn worker started without
+--preload. RSS is measured after the import, after serving the index page and
+after loading the refresh stack (HTTP client, listing scraper, numpy), so the
+cost deferred to the first refresh is visible. --ref also measures an older
+commit (exported with git archive) for comparison.
+
+    python benchmarks/bench_startup.py [--runs 5] [--ref HEAD~1]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = r"""
+import gc, json, resource, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+rss = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+from sqlalchemy.engine import Engine
+result = {'import_ms': imported * 1000, 'rss_import': rss(),
+          'engines': sum(isinstance(o, Engine) for o in gc.get_objects())}
+if hasattr(app, 'init_db'):
+    app.init_db()
+assert app.app.test_client().get('/').status_code == 200
+result['rss_page'] = rss()
+if hasattr(app, 'get_http'):
+    app.get_http()
+    import listing
+import scoring
+scoring.compute_scores([1.0], [1.0], [1.0], [1.0], [1.0], [1.0], [1])
+result['rss_refresh'] = rss()
+result['modules'] = len(sys.modules)
+print(json.dumps(result))
+"""
+
+
+def measure(tree: str, runs: int) -> dict:
+    results = []
+    for _ in range(runs):
+        tmp = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", PAYLOAD_CACHE_PATH='',
+                   DATA_VERSION_FILE='')
+        out = subprocess.run([sys.executable, '-c', WORKER], cwd=tree, env=env, capture_output=True, text=True)
+        if out.returncode:
+            raise SystemExit(out.stderr[-2000:])
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(r[key] for r in results) for key in results[0]}
+
+
+def report(label: str, stats: dict) -> None:
+    print(f"{label:10} import {stats['import_ms']:7.0f} ms  engines {stats['engines']:.0f}  modules {stats['modules']:5.0f}  "
+          f"RSS import {stats['rss_import']:6.1f} MiB  after page {stats['rss_page']:6.1f} MiB  "
+          f"after refresh stack {stats['rss_refresh']:6.1f} MiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--ref', help='Also measure this git revision')
+    args = parser.parse_args()
+
+    print(f"Median of {args.runs} fresh processes")
+    if args.ref:
+        tree = tempfile.mkdtemp()
+        archive = subprocess.run(['git', 'archive', args.ref], cwd=ROOT, capture_output=True, check=True).stdout
+        subprocess.run(['tar', '-x', '-C', tree], input=archive, check=True)
+        report(args.ref, measure(tree, args.runs))
+    report('current', measure(ROOT, args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Local stand-in for the i3investor listing API and the klsescreener all.json endpoint.
+
+Serves a fixed stock universe from recorded fixtures (a PayloadCache file or
+a JSON list of all.json payloads, and a JSON list of datatables listing
+responses) or from synthetic data, with configurable latency, jitter and
+error rate. all.json responses carry an ETag and Last-Modified and answer
+a matching If-None-Match with 304. POST /_stub/generation shifts every
+stock to another payload, so the next refresh sees changed scores.
+
+    python benchmarks/stub_upstream.py [--port 8765] [--stocks 1500] [--latency-ms 100] [--error-rate 0.02]
+
+then run the app with KLSESCREENER_URL and I3INVESTOR_URL set to the printed URL.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from listing import LISTING_PATH, MARKETS, parse_listing_row
+
+PAYLOAD_RE = re.compile(r'^/v2/stocks/view/([^/]+)/all\.json$')
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+WORDS = ['GLOBAL', 'HOLDINGS', 'BERHAD', 'BHD', 'TECH', 'PLANTATIONS', 'M&amp;A', 'RESOURCES', 'CAPITAL']
+
+
+def load_payloads(path: str) -> list[dict]:
+    """all.json payloads from a PayloadCache file (.db) or a JSON list."""
+    if path.endswith('.db'):
+        from payload_cache import PayloadCache
+        return [data for _, data in PayloadCache(path).items()]
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_listing(path: str) -> list[tuple[str, str]]:
+    """(market, name cell) listing rows from a JSON list of recorded datatables responses."""
+    with open(path) as f:
+        pages = json.load(f)
+    rows = [row[1] for page in pages for row in page.get('data', []) if len(row) >= 2]
+    return [(MARKETS[i % len(MARKETS)], name_html) for i, name_html in enumerate(rows)]
+
+
+def synthetic_listing(stocks: int, seed: int = 0) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    rows = []
+    for i in range(stocks):
+        short = ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(rng.randint(3, 8)))
+        full = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        rows.append((MARKETS[i % len(MARKETS)], f'<a href="/web/stock/overview/{i:04d}" target="_blank">{short}</a>'
+                                                f'<br><span class="text-muted small">{short} {full}</span>'))
+    return rows
+
+
+def synthetic_payloads(count: int, quarters: int, seed: int = 0) -> list[dict]:
+    from bench_extract import synthetic_payload
+    rng = random.Random(seed)
+    return [synthetic_payload(rng, quarters) for _ in range(count)]
+
+
+class StubUpstream:
+    """
+    Threaded HTTP server answering the listing and all.json requests the refresh makes.
+
+    Args:
+        listing: (market, name cell html) rows served by the datatables endpoint
+        payloads: all.json bodies; stock i gets payload (i + generation) % len(payloads)
+        latency: Seconds slept before each all.json response
+        jitter: Uniform extra latency in [0, jitter) seconds
+        error_rate: Fraction of all.json requests answered with a 500
+        port: 0 picks a free port
+    """
+
+    def __init__(self, listing: list[tuple[str, str]], payloads: list[dict], latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, port: int = 0, seed: int = 0):
+        self.listing = listing
+        self.bodies = [json.dumps(payload).encode() for payload in payloads]
+        self.codes = {}
+        for i, (_, name_html) in enumerate(listing):
+            parsed = parse_listing_row(name_html)
+            if parsed:
+                self.codes[parsed[0]] = i
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.generation = 0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.etags = [f'"{hashlib.sha1(body).hexdigest()}"' for body in self.bodies]
+        self.counts = {'listing': 0, 'payload': 0, 'not_modified': 0, 'error': 0, 'not_found': 0}
+        # all.json requests being served right now, and the most seen at once
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def mean_payload_bytes(self) -> float:
+        return sum(len(body) for body in self.bodies) / len(self.bodies)
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counts[name] += 1
+
+    def listing_page(self, request: dict) -> dict:
+        markets = request.get('marketList') or MARKETS
+        rows = [name_html for market, name_html in self.listing if market in markets]
+        start, size = int(request.get('start', 0)), int(request.get('size', 500))
+        return {'draw': request.get('dtDraw'), 'recordsTotal': len(rows), 'recordsFiltered': len(rows),
+                'data': [['', name_html] for name_html in rows[start:start + size]]}
+
+    def payload(self, code: str) -> Optional[tuple[bytes, str]]:
+        """(body, ETag) currently served for a code, or None if it is not listed."""
+        index = self.codes.get(code)
+        if index is None:
+            return None
+        index = (index + self.generation) % len(self.bodies)
+        return self.bodies[index], self.etags[index]
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this, keep-alive clients hit delayed ACKs
+            disable_nagle_algorithm = True
+
+            def send(self, status: int, body: bytes = b'', content_type: str = 'application/json',
+                     headers: Optional[dict] = None) -> None:
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if self.path == LISTING_PATH:
+                    stub.count('listing')
+                    self.send(200, json.dumps(stub.listing_page(json.loads(request or b'{}'))).encode())
+                elif self.path == '/_stub/generation':
+                    with stub.lock:
+                        stub.generation += 1
+                    self.send(200, json.dumps({'generation': stub.generation}).encode())
+                else:
+                    self.send(404)
+
+            def do_GET(self):
+                match = PAYLOAD_RE.match(self.path)
+                if not match:
+                    return self.send(404)
+                with stub.lock:
+                    delay = stub.latency + stub.rng.random() * stub.jitter
+                    failed = stub.rng.random() < stub.error_rate
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                if delay:
+                    time.sleep(delay)
+                # Released before the response goes out, so a client's next request never overlaps this one
+                with stub.lock:
+                    stub.in_flight -= 1
+                served = stub.payload(match.group(1))
+                if served is None:
+                    stub.count('not_found')
+                    self.send(404)
+                elif failed:
+                    stub.count('error')
+                    self.send(500, b'stub error', 'text/plain')
+                else:
+                    body, etag = served
+                    validators = {'ETag': etag, 'Last-Modified': LAST_MODIFIED}
+                    if self.headers.get('If-None-Match') == etag:
+                        stub.count('not_modified')
+                        self.send(304, headers=validators)
+                    else:
+                        stub.count('payload')
+                        self.send(200, body, headers=validators)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'StubUpstream':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def add_fixture_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--stocks', type=int, default=1500, help='Synthetic listing size')
+    parser.add_argument('--listing', help='JSON file with a list of recorded datatables responses')
+    parser.add_argument('--payloads', help='PayloadCache file (.db) or JSON list of recorded all.json payloads')
+    parser.add_argument('--quarters', type=int, default=40, help='FinancialReport rows per synthetic payload')
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+
+
+def stub_from_args(args: argparse.Namespace, port: int = 0) -> StubUpstream:
+    listing = load_listing(args.listing) if args.listing else synthetic_listing(args.stocks)
+    payloads = load_payloads(args.payloads) if args.payloads else synthetic_payloads(min(len(listing), 500), args.quarters)
+    return StubUpstream(listing, payloads, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                        error_rate=args.error_rate, port=port)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_fixture_arguments(parser)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    stub = stub_from_args(args, args.port).start()
+    print(f"Serving {len(stub.codes)} stocks, {len(stub.bodies)} payloads ({stub.mean_payload_bytes / 1024:.1f} KiB mean) "
+          f"at {stub.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
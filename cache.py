@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DataVersion:
+    """
+    Version stamp of the Stock/History data, bumped by every write path.
+
+    Without a path the version lives in process memory. With a path it is
+    kept in a small file replaced atomically on bump, so every gunicorn
+    worker on the host sees the same version and invalidates together.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.value = str(time.time_ns())
+        if path and not os.path.exists(path):
+            self.bump()
+
+    def get(self) -> str:
+        if not self.path:
+            return self.value
+        try:
+            with open(self.path) as f:
+                return f.read().strip() or self.value
+        except OSError:
+            return self.value
+
+    def bump(self) -> str:
+        with self.lock:
+            self.value = f"{time.time_ns()}-{os.getpid()}"
+            if self.path:
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, 'w') as f:
+                    f.write(self.value)
+                os.replace(tmp, self.path)
+        return self.value
+
+
+class FacetCache:
+    """
+    Memoizes facet lists and filtered counts until the data version changes.
+
+    Args:
+        version: DataVersion shared with the write paths
+        max_entries: Cached keys kept (LRU) for the current version
+    """
+
+    def __init__(self, version: DataVersion, max_entries: int = 256):
+        self.version = version
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self.entries_version = None
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        version = self.version.get()
+        with self.lock:
+            if self.entries_version != version:
+                self.entries.clear()
+                self.entries_version = version
+            elif key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        value = compute()
+        with self.lock:
+            if self.entries_version == version:
+                self.entries[key] = value
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return value
+
+
+class PageCache:
+    """
+    Rendered page fragments, kept until the data version changes.
+
+    Entries are weighed by their length and evicted least recently used
+    first once the total passes max_bytes, so a crawl through every
+    filter/page combination cannot grow a worker without bound.
+
+    Args:
+        version: DataVersion shared with the write paths
+        max_bytes: Total size of the cached fragments (0 disables caching)
+    """
+
+    def __init__(self, version: DataVersion, max_bytes: int):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[Hashable, str] = OrderedDict()
+        self.entries_version = None
+        self.size = 0
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, render: Callable[[], str]) -> str:
+        if not self.max_bytes:
+            return render()
+        version = self.version.get()
+        with self.lock:
+            if self.entries_version != version:
+                self.entries.clear()
+                self.size = 0
+                self.entries_version = version
+            elif key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = render()
+        if len(value) > self.max_bytes:
+            return value
+        with self.lock:
+            if self.entries_version == version and key not in self.entries:
+                self.entries[key] = value
+                self.size += len(value)
+                while self.size > self.max_bytes:
+                    self.size -= len(self.entries.popitem(last=False)[1])
+        return value
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
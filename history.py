@@ -0,0 +1,226 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, distinct, func, select, update
+
+from batch_writer import BREAKDOWN_COLUMNS, HISTORY_COLUMNS, pack_breakdown, unpack_breakdown
+from models import Stock, History, ScoreChange
+
+logger = logging.getLogger(__name__)
+
+INTERVALS = ('raw', 'day', 'week')
+# prune_history: what survives of History older than the cutoff
+RETENTION_KEEP = ('none', 'day', 'week')
+# Stocks whose old History is loaded at once when downsampling
+PRUNE_STOCKS_PER_CHUNK = 100
+# Columns unpack_breakdown needs
+BREAKDOWN_HISTORY_COLUMNS = [getattr(History, column) for column in BREAKDOWN_COLUMNS.values()] + [History.breakdown]
+
+
+def with_breakdown(values: dict) -> dict:
+    """
+    Replace the packed breakdown columns of a History row dict with the breakdown dict.
+    """
+    values['breakdown'] = unpack_breakdown(values)
+    for column in BREAKDOWN_COLUMNS.values():
+        del values[column]
+    return values
+
+
+def compact_history(session, chunk_size: int = 5000) -> dict[str, float]:
+    """
+    Move JSON breakdowns of existing History rows into the packed columns.
+
+    Walks rows that still carry JSON in id order (keyset, chunk_size at a
+    time), committing per chunk, so it can be stopped and rerun. Breakdowns
+    that don't round-trip through pack_breakdown keep their JSON.
+
+    Returns:
+        Dictionary with keys: scanned, packed, seconds
+    """
+    started = time.perf_counter()
+    scanned = packed = 0
+    last_id = 0
+    while True:
+        rows = session.execute(
+            select(History.id, History.breakdown)
+            .where(History.id > last_id, History.g_points.is_(None), History.breakdown.isnot(None))
+            .order_by(History.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scanned += len(rows)
+        updates = []
+        for row in rows:
+            values = pack_breakdown(row.breakdown)
+            if values['breakdown'] is None:
+                updates.append(dict(values, id=row.id))
+        if updates:
+            session.execute(update(History), updates)
+        session.commit()
+        packed += len(updates)
+    seconds = time.perf_counter() - started
+    logger.info(f"Compacted {packed} of {scanned} History breakdowns in {seconds:.2f}s")
+    return {'scanned': scanned, 'packed': packed, 'seconds': seconds}
+
+
+def delete_history_rows(session, ids: list[int], chunk_size: int) -> None:
+    for i in range(0, len(ids), chunk_size):
+        session.execute(delete(History).where(History.id.in_(ids[i:i + chunk_size]))
+                        .execution_options(synchronize_session=False))
+        session.commit()
+
+
+def prune_history(session, before: datetime, keep: str = 'week', chunk_size: int = 5000) -> dict[str, float]:
+    """
+    Thin out History older than before.
+
+    keep 'none' deletes those rows; 'day' or 'week' keeps only the latest
+    snapshot of each stock per day or (Monday-based) week. Deletes go by
+    primary key, at most chunk_size rows per transaction, so no statement
+    holds locks on a large part of the table and the job can be stopped and
+    rerun at any point.
+
+    Returns:
+        Dictionary with keys: scanned, deleted, seconds
+    """
+    started = time.perf_counter()
+    scanned = deleted = 0
+    if keep == 'none':
+        while True:
+            ids = session.execute(select(History.id).where(History.date < before)
+                                  .order_by(History.id).limit(chunk_size)).scalars().all()
+            if not ids:
+                break
+            delete_history_rows(session, ids, chunk_size)
+            scanned += len(ids)
+            deleted += len(ids)
+    else:
+        last_stock_id = 0
+        while True:
+            stock_ids = session.execute(select(Stock.id).where(Stock.id > last_stock_id)
+                                        .order_by(Stock.id).limit(PRUNE_STOCKS_PER_CHUNK)).scalars().all()
+            if not stock_ids:
+                break
+            last_stock_id = stock_ids[-1]
+            # Served by ix_history_stock_date; rows come in (stock, date) order so the last one per bucket is kept
+            rows = session.execute(
+                select(History.id, History.stock_id, History.date)
+                .where(History.stock_id.in_(stock_ids), History.date < before)
+                .order_by(History.stock_id, History.date, History.id)
+            ).all()
+            session.commit()
+            scanned += len(rows)
+            latest = {}
+            for row in rows:
+                day = row.date.date()
+                latest[row.stock_id, day if keep == 'day' else day - timedelta(days=day.weekday())] = row.id
+            kept = set(latest.values())
+            ids = [row.id for row in rows if row.id not in kept]
+            delete_history_rows(session, ids, chunk_size)
+            deleted += len(ids)
+    seconds = time.perf_counter() - started
+    logger.info(f"Pruned {deleted} of {scanned} History rows older than {before:%Y-%m-%d} (keep {keep}) in {seconds:.2f}s")
+    return {'scanned': scanned, 'deleted': deleted, 'seconds': seconds}
+
+
+def bucket_start(session, column, interval: str):
+    """
+    SQL expression truncating column to the start of its day or (Monday-based) week.
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        return func.date_trunc(interval, column)
+    if interval == 'day':
+        return func.date(column)
+    # SQLite: forward to the week's Sunday, then back to its Monday
+    return func.date(column, 'weekday 0', '-6 days')
+
+
+def bucket_label(value) -> str:
+    return value.date().isoformat() if isinstance(value, datetime) else str(value)
+
+
+def score_series(session, interval: str = 'day', start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 stock_id: Optional[int] = None, industry: Optional[str] = None, market: Optional[str] = None,
+                 limit: int = 5000, breakdown: bool = False) -> list[dict]:
+    """
+    Score and metric series from History over [start, end).
+
+    At most limit points are returned: the most recent ones, in date order.
+    With interval 'raw' every snapshot of stock_id is returned,
+    with its breakdown dict when breakdown is set. With 'day' or 'week' rows
+    are grouped server-side into buckets holding the snapshot count, distinct
+    stocks, min/avg/max score and the average of each metric; without
+    stock_id this is the market-wide series, optionally narrowed to one
+    industry or market.
+
+    History holds the value a stock had until the change dated by the row,
+    so the current score is not part of the series.
+    """
+    conditions = []
+    if stock_id is not None:
+        conditions.append(History.stock_id == stock_id)
+    if start:
+        conditions.append(History.date >= start)
+    if end:
+        conditions.append(History.date < end)
+    if industry or market:
+        stocks = select(Stock.id)
+        if industry:
+            stocks = stocks.where(Stock.industry == industry)
+        if market:
+            stocks = stocks.where(Stock.market == market)
+        conditions.append(History.stock_id.in_(stocks))
+
+    if interval == 'raw':
+        columns = [History.date, History.score] + [getattr(History, c) for c in HISTORY_COLUMNS]
+        if breakdown:
+            columns += BREAKDOWN_HISTORY_COLUMNS
+        # Newest limit snapshots, returned oldest first
+        rows = session.execute(select(*columns).where(*conditions).order_by(History.date.desc()).limit(limit)).all()
+        return [with_breakdown(row._asdict()) if breakdown else row._asdict() for row in reversed(rows)]
+
+    bucket = bucket_start(session, History.date, interval).label('bucket')
+    columns = [
+        bucket,
+        func.count().label('count'),
+        func.count(distinct(History.stock_id)).label('stocks'),
+        func.min(History.score).label('min_score'),
+        func.avg(History.score).label('avg_score'),
+        func.max(History.score).label('max_score'),
+    ] + [func.avg(getattr(History, c)).label(c) for c in HISTORY_COLUMNS]
+    rows = session.execute(select(*columns).where(*conditions).group_by(bucket).order_by(bucket.desc()).limit(limit)).all()
+    series = []
+    for row in reversed(rows):
+        point = row._asdict()
+        point['bucket'] = bucket_label(point['bucket'])
+        for key in ['avg_score'] + HISTORY_COLUMNS:
+            if point[key] is not None:
+                point[key] = round(float(point[key]), 4)
+        series.append(point)
+    return series
+
+
+def top_movers(session, since: Optional[datetime] = None, limit: int = 20, direction: Optional[str] = None) -> list[dict]:
+    """
+    Stocks whose latest score change happened at or after since, biggest first.
+
+    Reads ScoreChange (one row per stock) instead of History. direction 'up'
+    or 'down' keeps only gains or losses; otherwise both, by absolute delta.
+    """
+    query = (select(Stock.code, Stock.name, Stock.industry, Stock.market, ScoreChange.previous_score,
+                    ScoreChange.score, ScoreChange.delta, ScoreChange.changed_at)
+             .join(Stock, Stock.id == ScoreChange.stock_id))
+    if since:
+        query = query.where(ScoreChange.changed_at >= since)
+    if direction == 'up':
+        query = query.where(ScoreChange.delta > 0).order_by(ScoreChange.delta.desc())
+    elif direction == 'down':
+        query = query.where(ScoreChange.delta < 0).order_by(ScoreChange.delta)
+    else:
+        query = query.order_by(func.abs(ScoreChange.delta).desc())
+    return [row._asdict() for row in session.execute(query.order_by(Stock.code).limit(limit))]
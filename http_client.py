@@ -0,0 +1,153 @@
+import logging
+import random
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (compatible; YourApp/1.0; +https://yourapp.com)',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryBudget:
+    """
+    Global retry budget shared by every request made through a client.
+
+    Each request deposits `ratio` tokens and each retry spends one, so retries
+    can never exceed roughly `ratio` of the traffic (plus up to `min_retries`
+    banked while things are healthy). When upstream is down this stops every
+    worker from piling exponential backoffs on top of each other.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10):
+        self.ratio = ratio
+        self.cap = float(min_retries)
+        self.tokens = float(min_retries)
+        self.lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.tokens = min(self.tokens + self.ratio, self.cap)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class HostLimiter:
+    """
+    Per-host concurrency cap and minimum spacing between request starts.
+    """
+
+    def __init__(self, max_concurrency: int, rate: float = 0):
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.slots.acquire()
+        if self.interval:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start)
+                self.next_start = start + self.interval
+            if start > now:
+                time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc):
+        self.slots.release()
+
+
+class HttpClient:
+    """
+    Pooled keep-alive HTTP client used by every outbound call in app.py.
+
+    Args:
+        pool_size: Connections kept open per host
+        max_per_host: Max concurrent in-flight requests per host
+        rate_limit: Max request starts per second per host (0 = unlimited)
+        max_retries: Attempts per request, including the first
+        backoff: Base delay in seconds for full-jitter exponential backoff
+        retry_budget: Fraction of requests that may be retried globally
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        max_per_host: int = 4,
+        rate_limit: float = 0,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        retry_budget: float = 0.2
+    ):
+        self.max_per_host = max_per_host
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.budget = RetryBudget(retry_budget)
+        self.limiters: dict[str, HostLimiter] = {}
+        self.limiters_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def limiter(self, url: str) -> HostLimiter:
+        host = urlparse(url).netloc
+        with self.limiters_lock:
+            limiter = self.limiters.get(host)
+            if limiter is None:
+                limiter = HostLimiter(self.max_per_host, self.rate_limit)
+                self.limiters[host] = limiter
+        return limiter
+
+    def request(self, method: str, url: str, retries: Optional[int] = None, **kwargs) -> requests.Response:
+        """
+        Send a request, retrying connection errors, timeouts and 429/5xx responses.
+
+        Returns:
+            The successful response
+
+        Raises:
+            requests.RequestException: Once attempts or the retry budget run out
+        """
+        attempts = retries or self.max_retries
+        kwargs.setdefault('timeout', 10)
+        self.budget.deposit()
+        for attempt in range(attempts):
+            try:
+                with self.limiter(url):
+                    resp = self.session.request(method, url, **kwargs)
+                resp.raise_for_status()
+                return resp
+            except requests.RequestException as e:
+                retryable = not isinstance(e, requests.HTTPError) or e.response.status_code in RETRY_STATUSES
+                if not retryable or attempt == attempts - 1:
+                    raise
+                if not self.budget.withdraw():
+                    logger.warning(f"Retry budget exhausted, giving up on {url}: {e}")
+                    raise
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                logger.warning(f"{method} {url} failed (attempt {attempt + 1}/{attempts}): {e}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
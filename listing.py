@@ -0,0 +1,162 @@
+import html
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Optional
+
+import requests
+from sqlalchemy import delete, insert, select
+
+from models import ListedStock, ListingSync
+
+logger = logging.getLogger(__name__)
+
+LISTING_PATH = '/wapi/web/stock/listing/datatables'
+LISTING_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Content-Type': 'application/json'
+}
+MARKETS = ['ACE', 'ETF', 'MAIN']
+WARRANT_SUFFIXES = ['WA', 'WB', 'WD', 'WC']
+
+ANCHOR_RE = re.compile(r'<a\b([^>]*)>(.*?)</a\s*>', re.IGNORECASE | re.DOTALL)
+HREF_RE = re.compile(r'''\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+TAG_RE = re.compile(r'<[^>]*>')
+
+
+def parse_listing_row(name_html: str) -> Optional[tuple[str, str]]:
+    """
+    Pull (code, "SHORT - FULLNAME") out of a listing row's name cell.
+
+    Regex equivalent of the previous BeautifulSoup parse: the code is the last
+    path segment of the first link, the short name is the link text, and the
+    full name is the remaining text with all spaces removed.
+    """
+    anchor = ANCHOR_RE.search(name_html)
+    if not anchor:
+        return None
+    href = HREF_RE.search(anchor.group(1))
+    if not href:
+        return None
+    code = html.unescape(next(g for g in href.groups() if g is not None)).split('/')[-1]
+    # Skip warrant-like codes
+    if any(suffix in code for suffix in WARRANT_SUFFIXES):
+        return None
+    short_name = html.unescape(TAG_RE.sub('', anchor.group(2))).strip()
+    full_text = html.unescape(TAG_RE.sub(' ', name_html)).strip()
+    full_name = full_text.replace(short_name, '').replace(' ', '')
+    name = f"{short_name} - {full_name}"
+    if not code:
+        return None
+    return code, name
+
+
+def listing_body(start: int, size: int, markets: list[str]) -> dict:
+    return {
+        "dtDraw": 7,
+        "start": start,
+        "order": [{"column": 1, "dir": "asc"}],
+        "page": start // size,
+        "size": size,
+        "marketList": markets,
+        "sectorList": [],
+        "subsectorList": [],
+        "type": "",
+        "stockType": ""
+    }
+
+
+def probe_listing_total(http, base_url: str) -> Optional[int]:
+    """
+    recordsTotal for all markets from a one-row request, or None on error.
+    """
+    try:
+        data = http.post(f"{base_url}{LISTING_PATH}", headers=LISTING_HEADERS,
+                         json=listing_body(0, 1, MARKETS), timeout=15).json()
+        return int(data['recordsTotal'])
+    except (requests.RequestException, KeyError, TypeError, ValueError) as e:
+        logger.warning(f"Listing count probe failed: {e}")
+        return None
+
+
+def fetch_listing(http, base_url: str, size: int = 500) -> tuple[list[tuple[str, str, str]], int, bool]:
+    """
+    Page through the i3investor listing one market at a time.
+
+    A market whose pages stop early (request error or a response without a
+    data list) is logged and left partial, and the result is flagged as
+    incomplete.
+
+    Returns:
+        Tuple of ([(code, name, market)], sum of recordsTotal across markets, whether every page was read)
+    """
+    url = f"{base_url}{LISTING_PATH}"
+    stocks = {}
+    records_total = 0
+    complete = True
+    for market in MARKETS:
+        start = 0
+        while True:
+            try:
+                data = http.post(url, headers=LISTING_HEADERS, json=listing_body(start, size, [market]), timeout=15).json()
+            except requests.RequestException as e:
+                logger.warning(f"API fetch error for {market} at start={start}, stopping pagination: {e}")
+                complete = False
+                break
+            if not isinstance(data, dict) or not isinstance(data.get('data'), list):
+                logger.warning(f"Unexpected {market} listing response at start={start}, stopping pagination")
+                complete = False
+                break
+            if not data['data']:
+                logger.info(f"No more {market} data at start={start}, stopping pagination")
+                break
+            for row in data['data']:
+                if len(row) < 2: continue
+                parsed = parse_listing_row(row[1])
+                if parsed:
+                    stocks[parsed[0]] = (parsed[0], parsed[1], market)
+            total_records = data.get('recordsTotal', start + len(data['data']))
+            if start + len(data['data']) >= total_records:
+                records_total += total_records
+                break
+            start += size
+    return list(stocks.values()), records_total, complete
+
+
+def sync_listing(session, http, base_url: str, max_age: timedelta, force: bool = False) -> list[tuple[str, str]]:
+    """
+    Stock universe as [(code, name)], served from the ListedStock table when possible.
+
+    Within max_age of the last sync only a one-row count probe is sent, and
+    the cached universe is reused while recordsTotal is unchanged. Otherwise
+    (or when force is set) the full listing is fetched and stored. If the
+    fetch comes back empty or incomplete it is not stored and the cached
+    universe is returned instead (the partial listing only when nothing is
+    cached yet).
+    """
+    last = session.query(ListingSync).order_by(ListingSync.id.desc()).first()
+    cached = [(code, name) for code, name in session.execute(select(ListedStock.code, ListedStock.name))]
+    if not force and last and cached and datetime.utcnow() - last.synced_at < max_age:
+        total = probe_listing_total(http, base_url)
+        if total == last.records_total:
+            logger.info(f"Listing unchanged ({total} records), using {len(cached)} cached stock codes")
+            return cached
+        logger.info(f"Listing count changed ({last.records_total} -> {total}), resyncing")
+    stocks, records_total, complete = fetch_listing(http, base_url)
+    if not stocks:
+        logger.warning("Listing fetch returned no stocks, using cached universe")
+        return cached
+    if not complete:
+        if cached:
+            logger.warning(f"Listing fetch incomplete ({len(stocks)} stocks), using {len(cached)} cached stock codes")
+            return cached
+        logger.warning(f"Listing fetch incomplete and nothing cached, using {len(stocks)} stocks without storing them")
+        return [(code, name) for code, name, _ in stocks]
+    now = datetime.utcnow()
+    session.execute(delete(ListedStock))
+    session.execute(insert(ListedStock), [{'code': code, 'name': name, 'market': market, 'synced_at': now}
+                                          for code, name, market in stocks])
+    session.add(ListingSync(synced_at=now, records_total=records_total, stock_count=len(stocks)))
+    session.commit()
+    logger.info(f"Retrieved {len(stocks)} stock codes")
+    return [(code, name) for code, name, _ in stocks]
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+OUTCOMES = ('fetched', 'failed', 'updated')
+LATENCIES = ('fetch', 'db_write')
+
+
+def percentile(samples: list[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class RefreshMetrics:
+    """
+    Process-local refresh instrumentation: outcome counters, a rolling
+    throughput window and recent latency samples for percentiles.
+
+    Counters are cumulative for the life of the process (Prometheus
+    counter semantics); per-job totals come from the RefreshJob row.
+
+    Args:
+        window: Seconds of completions used for the rolling stocks/sec
+        samples: Latency samples kept per stage
+    """
+
+    def __init__(self, window: float = 60, samples: int = 1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.counters = {outcome: 0 for outcome in OUTCOMES}
+        self.completions: deque[float] = deque()
+        self.latencies = {stage: deque(maxlen=samples) for stage in LATENCIES}
+        self.latency_sums = {stage: 0.0 for stage in LATENCIES}
+        self.latency_counts = {stage: 0 for stage in LATENCIES}
+
+    def count(self, outcome: str, n: int = 1) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.counters[outcome] += n
+            if outcome in ('fetched', 'failed'):
+                self.completions.extend([now] * n)
+                self._trim(now)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.latencies[stage].append(seconds)
+            self.latency_sums[stage] += seconds
+            self.latency_counts[stage] += 1
+
+    def _trim(self, now: float) -> None:
+        while self.completions and self.completions[0] < now - self.window:
+            self.completions.popleft()
+
+    def rate(self) -> float:
+        """Stocks fetched (or failed) per second over the rolling window."""
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            if not self.completions:
+                return 0.0
+            span = max(now - self.completions[0], 1.0)
+            return len(self.completions) / span
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            latencies = {stage: list(samples) for stage, samples in self.latencies.items()}
+            counters = dict(self.counters)
+            sums, counts = dict(self.latency_sums), dict(self.latency_counts)
+        return {
+            'counters': counters,
+            'rate': self.rate(),
+            'latency': {stage: {'p50': percentile(samples, 0.5), 'p95': percentile(samples, 0.95),
+                                'sum': sums[stage], 'count': counts[stage]}
+                        for stage, samples in latencies.items()},
+        }
+
+    def prometheus(self, gauges: dict[str, float]) -> str:
+        """
+        Render counters, latency summaries and the given gauges in the Prometheus text format.
+        """
+        snap = self.snapshot()
+        lines = ['# HELP klse_refresh_stocks_total Stocks processed by refresh workers in this process.',
+                 '# TYPE klse_refresh_stocks_total counter']
+        lines += [f'klse_refresh_stocks_total{{outcome="{outcome}"}} {value}' for outcome, value in snap['counters'].items()]
+        for stage, stats in snap['latency'].items():
+            name = f'klse_refresh_{stage}_seconds'
+            lines += [f'# HELP {name} Latency of the refresh {stage} stage.', f'# TYPE {name} summary']
+            for q in ('p50', 'p95'):
+                if stats[q] is not None:
+                    lines.append(f'{name}{{quantile="0.{q[1:]}"}} {stats[q]:.6f}')
+            lines += [f'{name}_sum {stats["sum"]:.6f}', f'{name}_count {stats["count"]}']
+        lines += ['# HELP klse_refresh_rate Stocks per second over the rolling window.',
+                  '# TYPE klse_refresh_rate gauge', f'klse_refresh_rate {snap["rate"]:.4f}']
+        for name, value in gauges.items():
+            lines += [f'# TYPE klse_refresh_{name} gauge', f'klse_refresh_{name} {value}']
+        return '\n'.join(lines) + '\n'
@@ -1,30 +1,25 @@
 #!/bin/sh
 
-# Initialize migrations directory if it doesn't exist
-if [ ! -d "migrations" ]; then
-    echo "Initializing migrations directory..."
-    flask db init
-    if [ $? -ne 0 ]; then
-        echo "Failed to initialize migrations directory."
-        exit 1
-    fi
-    echo "Migrations directory initialized."
+# Generate a migration for model changes; `flask init-db` applies it on deploy.
+# Usage: ./migrate.sh "Describe the schema change"
+if [ -z "$1" ]; then
+    echo "Usage: $0 \"migration message\""
+    exit 1
 fi
 
-# Generate migration script
-echo "Generating migration script..."
-flask db migrate -m "Add industry and market columns to Stock table"
+# Autogenerate compares the models against a database at the latest revision
+echo "Bringing the database up to date..."
+flask init-db
 if [ $? -ne 0 ]; then
-    echo "Failed to generate migration script."
+    echo "Failed to update the database."
     exit 1
 fi
 
-# Apply migration
-echo "Applying migration..."
-flask db upgrade
+echo "Generating migration script..."
+flask db migrate -m "$1"
 if [ $? -ne 0 ]; then
-    echo "Failed to apply migration."
+    echo "Failed to generate migration script."
     exit 1
 fi
 
-echo "Migration completed successfully."
\ No newline at end of file
+echo "Review the new file in migrations/versions/, then run flask init-db to apply it."
@@ -0,0 +1,81 @@
+"""Refresh jobs and items, synced stock listing
+
+Revision ID: 744bd95d4ad0
+Revises: dfea3a4c4a35
+Create Date: 2026-10-16 22:00:02.000000
+
+Tables an earlier flask init-db already created are skipped.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '744bd95d4ad0'
+down_revision = 'dfea3a4c4a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'refresh_job' not in tables:
+        op.create_table(
+            'refresh_job',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('kind', sa.String(length=20), nullable=False),
+            sa.Column('stop_requested', sa.Boolean(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+            sa.Column('total', sa.Integer(), nullable=True),
+            sa.Column('skipped', sa.Integer(), nullable=True),
+            sa.Column('updated', sa.Integer(), nullable=True),
+            sa.Column('failed', sa.Integer(), nullable=True),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'refresh_item' not in tables:
+        op.create_table(
+            'refresh_item',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('job_id', sa.Integer(), nullable=False),
+            sa.Column('code', sa.String(length=10), nullable=False),
+            sa.Column('name', sa.String(length=200), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('priority', sa.Integer(), nullable=False),
+            sa.Column('claimed_by', sa.String(length=100), nullable=True),
+            sa.Column('claimed_at', sa.DateTime(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.ForeignKeyConstraint(['job_id'], ['refresh_job.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_refresh_item_job_status', 'refresh_item', ['job_id', 'status', 'priority'])
+    if 'listed_stock' not in tables:
+        op.create_table(
+            'listed_stock',
+            sa.Column('code', sa.String(length=10), nullable=False),
+            sa.Column('name', sa.String(length=200), nullable=False),
+            sa.Column('market', sa.String(length=10), nullable=True),
+            sa.Column('synced_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('code')
+        )
+    if 'listing_sync' not in tables:
+        op.create_table(
+            'listing_sync',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('synced_at', sa.DateTime(), nullable=True),
+            sa.Column('records_total', sa.Integer(), nullable=False),
+            sa.Column('stock_count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('listing_sync')
+    op.drop_table('listed_stock')
+    op.drop_index('ix_refresh_item_job_status', table_name='refresh_item')
+    op.drop_table('refresh_item')
+    op.drop_table('refresh_job')
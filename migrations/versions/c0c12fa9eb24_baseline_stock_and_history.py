@@ -0,0 +1,61 @@
+"""Baseline: stock and history as they were before migrations were tracked
+
+Revision ID: c0c12fa9eb24
+Revises:
+Create Date: 2026-10-16 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c0c12fa9eb24'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'stock',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('code', sa.String(length=10), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('last_updated', sa.DateTime(), nullable=True),
+        sa.Column('current_score', sa.Integer(), nullable=True),
+        sa.Column('breakdown', sa.JSON(), nullable=True),
+        sa.Column('is_favorite', sa.Boolean(), nullable=True),
+        sa.Column('growth_cagr', sa.Float(), nullable=True),
+        sa.Column('div_yield', sa.Float(), nullable=True),
+        sa.Column('pe_ratio', sa.Float(), nullable=True),
+        sa.Column('roe', sa.Float(), nullable=True),
+        sa.Column('profit', sa.Float(), nullable=True),
+        sa.Column('cash_positive', sa.Float(), nullable=True),
+        sa.Column('last_refreshed', sa.DateTime(), nullable=True),
+        sa.Column('industry', sa.String(length=100), nullable=True),
+        sa.Column('market', sa.String(length=50), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('code')
+    )
+    op.create_table(
+        'history',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('stock_id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.DateTime(), nullable=True),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.Column('breakdown', sa.JSON(), nullable=False),
+        sa.Column('growth_cagr', sa.Float(), nullable=True),
+        sa.Column('div_yield', sa.Float(), nullable=True),
+        sa.Column('pe_ratio', sa.Float(), nullable=True),
+        sa.Column('roe', sa.Float(), nullable=True),
+        sa.Column('profit', sa.Float(), nullable=True),
+        sa.Column('cash_positive', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['stock_id'], ['stock.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('history')
+    op.drop_table('stock')
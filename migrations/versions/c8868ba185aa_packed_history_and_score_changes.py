@@ -0,0 +1,65 @@
+"""Packed History breakdowns, History indexes and the score_change table
+
+Revision ID: c8868ba185aa
+Revises: 744bd95d4ad0
+Create Date: 2026-10-16 22:00:03.000000
+
+history.breakdown becomes nullable (it only holds breakdowns that can't be
+packed); existing rows keep their JSON until flask compact-history. Anything
+an earlier flask init-db already added is skipped.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8868ba185aa'
+down_revision = '744bd95d4ad0'
+branch_labels = None
+depends_on = None
+
+POINT_COLUMNS = ['g_points', 'd_points', 'p_per_points', 'p_pm_points', 'r_points', 'c_points']
+INDEXES = {
+    'ix_history_date': ['date'],
+    'ix_history_stock_date': ['stock_id', 'date'],
+}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name']: column for column in inspector.get_columns('history')}
+    # Batch mode: SQLite can't drop NOT NULL in place, so the table is copied there
+    with op.batch_alter_table('history') as batch:
+        for name in POINT_COLUMNS:
+            if name not in columns:
+                batch.add_column(sa.Column(name, sa.SmallInteger(), nullable=True))
+        if not columns['breakdown']['nullable']:
+            batch.alter_column('breakdown', existing_type=sa.JSON(), nullable=True)
+    indexes = {index['name'] for index in inspector.get_indexes('history')}
+    for name, index_columns in INDEXES.items():
+        if name not in indexes:
+            op.create_index(name, 'history', index_columns)
+    if 'score_change' not in inspector.get_table_names():
+        op.create_table(
+            'score_change',
+            sa.Column('stock_id', sa.Integer(), nullable=False),
+            sa.Column('previous_score', sa.Integer(), nullable=False),
+            sa.Column('score', sa.Integer(), nullable=False),
+            sa.Column('delta', sa.Integer(), nullable=False),
+            sa.Column('changed_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['stock_id'], ['stock.id']),
+            sa.PrimaryKeyConstraint('stock_id')
+        )
+        op.create_index('ix_score_change_changed_at', 'score_change', ['changed_at'])
+
+
+def downgrade():
+    op.drop_index('ix_score_change_changed_at', table_name='score_change')
+    op.drop_table('score_change')
+    for name in INDEXES:
+        op.drop_index(name, table_name='history')
+    # Fails if compact-history has already cleared breakdowns: refill the JSON from the point columns first
+    with op.batch_alter_table('history') as batch:
+        batch.alter_column('breakdown', existing_type=sa.JSON(), nullable=False)
+        for name in reversed(POINT_COLUMNS):
+            batch.drop_column(name)
@@ -0,0 +1,56 @@
+"""Stock listing indexes, refresh status and failure tracking, latest profit
+
+Revision ID: dfea3a4c4a35
+Revises: c0c12fa9eb24
+Create Date: 2026-10-16 22:00:01.000000
+
+Databases that an earlier flask init-db already brought up to date have some
+of these columns and indexes; anything that exists is skipped.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dfea3a4c4a35'
+down_revision = 'c0c12fa9eb24'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    sa.Column('latest_profit', sa.Float(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    # Existing rows start with no failures
+    sa.Column('failure_count', sa.Integer(), nullable=True, server_default='0'),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('last_failed_at', sa.DateTime(), nullable=True),
+]
+INDEXES = {
+    'ix_stock_rank': ['is_favorite', 'current_score', 'id'],
+    'ix_stock_industry_rank': ['industry', 'is_favorite', 'current_score', 'id'],
+    'ix_stock_market_rank': ['market', 'is_favorite', 'current_score', 'id'],
+    'ix_stock_status': ['status'],
+}
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = {column['name'] for column in inspector.get_columns('stock')}
+    for column in COLUMNS:
+        if column.name not in existing:
+            op.add_column('stock', column)
+    # Stocks from before status existed: a zero score means no fetch ever succeeded
+    op.execute("UPDATE stock SET status = CASE WHEN current_score = 0 THEN 'failed' ELSE 'ok' END "
+               "WHERE status IS NULL")
+    indexes = {index['name'] for index in inspector.get_indexes('stock')}
+    for name, columns in INDEXES.items():
+        if name not in indexes:
+            op.create_index(name, 'stock', columns)
+
+
+def downgrade():
+    for name in INDEXES:
+        op.drop_index(name, table_name='stock')
+    with op.batch_alter_table('stock') as batch:
+        for column in reversed(COLUMNS):
+            batch.drop_column(column.name)
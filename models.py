@@ -15,21 +15,99 @@ class Stock(db.Model):
     div_yield = db.Column(db.Float, default=0.0)
     pe_ratio = db.Column(db.Float, default=999.0)
     roe = db.Column(db.Float, default=0.0)
-    profit = db.Column(db.Float, default=0.0)
+    profit = db.Column(db.Float, default=0.0)  # Profit margin (%)
+    latest_profit = db.Column(db.Float)  # Latest quarter's profit/loss; its sign scores C (rescore_stocks)
     cash_positive = db.Column(db.Float, default=0.0)  # Assuming cash flow is represented here
     last_refreshed = db.Column(db.DateTime)  # Tracks last refresh time
     industry = db.Column(db.String(100), default='Unknown')  # New: Industry
     market = db.Column(db.String(50), default='Unknown')     # New: Market
+    status = db.Column(db.String(20), default='failed')  # ok once scored, failed until then (retry_failed)
+    failure_count = db.Column(db.Integer, default=0)  # Consecutive failed fetches, reset on success
+    last_error = db.Column(db.Text)
+    last_failed_at = db.Column(db.DateTime)
+
+    # Listing order (favorites, then score) with id as the keyset tiebreaker,
+    # alone and behind each equality filter used by index(); status for retry_failed
+    __table_args__ = (
+        db.Index('ix_stock_rank', 'is_favorite', 'current_score', 'id'),
+        db.Index('ix_stock_industry_rank', 'industry', 'is_favorite', 'current_score', 'id'),
+        db.Index('ix_stock_market_rank', 'market', 'is_favorite', 'current_score', 'id'),
+        db.Index('ix_stock_status', 'status'),
+    )
 
 class History(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     stock_id = db.Column(db.Integer, db.ForeignKey('stock.id'), nullable=False)
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    date = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Market-wide series scan a date range
     score = db.Column(db.Integer, nullable=False)
-    breakdown = db.Column(db.JSON, nullable=False)
+    # Scored components of the breakdown; GDP, PRC and W are derived on read (batch_writer.unpack_breakdown)
+    g_points = db.Column(db.SmallInteger)
+    d_points = db.Column(db.SmallInteger)
+    p_per_points = db.Column(db.SmallInteger)
+    p_pm_points = db.Column(db.SmallInteger)
+    r_points = db.Column(db.SmallInteger)
+    c_points = db.Column(db.SmallInteger)
+    breakdown = db.Column(db.JSON(none_as_null=True))  # Only for rows whose breakdown can't be packed (legacy/unknown shapes)
     growth_cagr = db.Column(db.Float, default=0.0)
     div_yield = db.Column(db.Float, default=0.0)
     pe_ratio = db.Column(db.Float, default=999.0)
     roe = db.Column(db.Float, default=0.0)
     profit = db.Column(db.Float, default=0.0)
-    cash_positive = db.Column(db.Float, default=0.0)
\ No newline at end of file
+    cash_positive = db.Column(db.Float, default=0.0)
+
+    # Per-stock series read one stock's rows in date order
+    __table_args__ = (
+        db.Index('ix_history_stock_date', 'stock_id', 'date'),
+    )
+
+class ScoreChange(db.Model):
+    # Latest score change of each stock, upserted whenever History is written,
+    # so the movers view reads at most one row per stock instead of History
+    stock_id = db.Column(db.Integer, db.ForeignKey('stock.id'), primary_key=True)
+    previous_score = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class RefreshJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # planning, pending, running, stopped, completed, failed
+    kind = db.Column(db.String(20), nullable=False, default='refresh')  # refresh, retry
+    stop_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # Last heartbeat or checkpoint from any worker; stale means the workers died
+    total = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+
+class RefreshItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('refresh_job.id'), nullable=False)
+    code = db.Column(db.String(10), nullable=False)
+    name = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, claimed, done, failed, skipped
+    priority = db.Column(db.Integer, nullable=False, default=0)  # Lower is fetched first, see scheduler.py
+    claimed_by = db.Column(db.String(100))
+    claimed_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+
+    # Work-queue claims scan pending/claimed items of one job in priority order
+    __table_args__ = (
+        db.Index('ix_refresh_item_job_status', 'job_id', 'status', 'priority'),
+    )
+
+class ListedStock(db.Model):
+    code = db.Column(db.String(10), primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    market = db.Column(db.String(10))  # ACE, ETF or MAIN, as requested from the listing API
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ListingSync(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow)
+    records_total = db.Column(db.Integer, nullable=False)  # recordsTotal reported by the listing API
+    stock_count = db.Column(db.Integer, nullable=False)    # Codes kept after filtering warrants
@@ -0,0 +1,131 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+CacheEntry = namedtuple('CacheEntry', ['body', 'etag', 'last_modified', 'fetched_at'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payload (
+    code TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_payload_accessed_at ON payload (accessed_at);
+"""
+
+
+class PayloadCache:
+    """
+    Local cache of raw klsescreener all.json responses, keyed by stock code.
+
+    Bodies are stored zlib-compressed in a standalone SQLite file (WAL mode, one
+    connection per thread) together with the ETag/Last-Modified validators.
+    Entries younger than ttl are served without a request; older ones are
+    revalidated with a conditional GET. Once the stored bytes exceed
+    max_bytes the least recently used entries are evicted.
+
+    Args:
+        path: SQLite file holding the cache
+        ttl: Seconds an entry is served without revalidation
+        max_bytes: Upper bound on the total compressed size
+    """
+
+    def __init__(self, path: str, ttl: float = 12 * 3600, max_bytes: int = 200 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.evict_lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Opened on first use, so an instance created at import (before a --preload fork) holds no connection
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    def get(self, code: str) -> Optional[CacheEntry]:
+        row = self.conn.execute(
+            'SELECT body, etag, last_modified, fetched_at FROM payload WHERE code = ?', (code,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute('UPDATE payload SET accessed_at = ? WHERE code = ?', (time.time(), code))
+        return CacheEntry(zlib.decompress(row[0]), row[1], row[2], row[3])
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.fetched_at < self.ttl
+
+    def put(self, code: str, body: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        compressed = zlib.compress(body, 6)
+        now = time.time()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO payload (code, body, size, etag, last_modified, fetched_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (code, compressed, len(compressed), etag, last_modified, now, now))
+        self.evict()
+
+    def touch(self, code: str) -> None:
+        """
+        Mark an entry as revalidated (the server answered 304 Not Modified).
+        """
+        now = time.time()
+        self.conn.execute('UPDATE payload SET fetched_at = ?, accessed_at = ? WHERE code = ?', (now, now, code))
+
+    def discard(self, code: str) -> None:
+        """
+        Drop one entry, e.g. a body that can no longer be decoded.
+        """
+        self.conn.execute('DELETE FROM payload WHERE code = ?', (code,))
+
+    def evict(self) -> int:
+        """
+        Drop least recently used entries until the cache fits in max_bytes.
+        """
+        with self.evict_lock:
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM payload').fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            evicted = 0
+            for code, size in self.conn.execute('SELECT code, size FROM payload ORDER BY accessed_at').fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute('DELETE FROM payload WHERE code = ?', (code,))
+                total -= size
+                evicted += 1
+            logger.info(f"Evicted {evicted} cached payloads to stay under {self.max_bytes} bytes")
+            return evicted
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        """
+        Yield (code, stock_data) for every cached payload, for offline replays.
+
+        Entries that cannot be decoded are logged, skipped and discarded once
+        the scan finishes, as fetch_stock_data does on a lookup.
+        """
+        unreadable = []
+        for code, body in self.conn.execute('SELECT code, body FROM payload ORDER BY code'):
+            try:
+                stock_data = json.loads(zlib.decompress(body))
+            except (zlib.error, ValueError) as e:
+                logger.warning(f"Skipping unreadable cached payload for {code}: {e}")
+                unreadable.append(code)
+                continue
+            yield code, stock_data
+        for code in unreadable:
+            self.discard(code)
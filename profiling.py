@@ -0,0 +1,267 @@
+import cProfile
+import functools
+import heapq
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Each level includes the ones before it
+PROFILE_LEVELS = ('off', 'stages', 'sql', 'cprofile')
+# Slowest statements and hottest functions kept in a run summary
+SLOW_STATEMENTS = 5
+PROFILE_TOP_FUNCTIONS = 15
+
+
+class ProfileRun:
+    """Stage, counter and SQL totals of one refresh run."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.info = {}
+        self.counters = {}
+        self.stages = {}
+        self.sql = {}
+        self.slow_statements = []
+        self.profile_path = None
+        self.profile_top = None
+
+    def stage_totals(self, name: str) -> dict:
+        return self.stages.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                             'sql_count': 0, 'sql_seconds': 0.0})
+
+    def add_stage(self, name: str, seconds: float, n: int = 1) -> None:
+        stage = self.stage_totals(name)
+        stage['count'] += n
+        stage['seconds'] += seconds
+        stage['max_seconds'] = max(stage['max_seconds'], seconds)
+
+    def add_sql(self, stage: Optional[str], statement: str, seconds: float) -> None:
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else '?'
+        totals = self.sql.setdefault(verb, {'count': 0, 'seconds': 0.0})
+        totals['count'] += 1
+        totals['seconds'] += seconds
+        if stage:
+            self.stage_totals(stage)['sql_count'] += 1
+            self.stage_totals(stage)['sql_seconds'] += seconds
+        entry = (seconds, ' '.join(statement.split())[:300])
+        if len(self.slow_statements) < SLOW_STATEMENTS:
+            heapq.heappush(self.slow_statements, entry)
+        else:
+            heapq.heappushpop(self.slow_statements, entry)
+
+    def summary(self) -> dict:
+        seconds = time.perf_counter() - self.started
+        sql_count = sum(totals['count'] for totals in self.sql.values())
+        summary = {
+            'label': self.label,
+            'started_at': self.started_at,
+            'seconds': round(seconds, 3),
+            **self.info,
+            'counters': dict(self.counters),
+            'stages': {name: {'count': stage['count'], 'seconds': round(stage['seconds'], 4),
+                              'mean_ms': round(stage['seconds'] / stage['count'] * 1000, 3) if stage['count'] else None,
+                              'max_ms': round(stage['max_seconds'] * 1000, 3),
+                              'share': round(stage['seconds'] / seconds, 4) if seconds else None,
+                              'sql_count': stage['sql_count'], 'sql_seconds': round(stage['sql_seconds'], 4)}
+                       for name, stage in self.stages.items()},
+        }
+        if self.sql:
+            summary['sql'] = {
+                'count': sql_count,
+                'seconds': round(sum(totals['seconds'] for totals in self.sql.values()), 4),
+                'per_stock': round(sql_count / self.counters['stocks'], 2) if self.counters.get('stocks') else None,
+                'by_verb': {verb: {'count': totals['count'], 'seconds': round(totals['seconds'], 4)}
+                            for verb, totals in sorted(self.sql.items())},
+                'slowest': [{'ms': round(s * 1000, 3), 'statement': statement}
+                            for s, statement in sorted(self.slow_statements, reverse=True)],
+            }
+        if self.profile_path or self.profile_top:
+            summary['profile'] = {'path': self.profile_path, 'top': self.profile_top}
+        return summary
+
+
+class RefreshProfiler:
+    """
+    Opt-in timing of the refresh pipeline, summarised per run.
+
+    Levels (each includes the previous one):
+        off: stage() and run() do nothing
+        stages: wall time and count per named stage, plus counters; cheap
+            enough to leave on in production
+        sql: also times every statement the run's own thread executes, per
+            stage and per verb, keeping the slowest few
+        cprofile: also runs cProfile on the run's thread and dumps it to
+            profile_dir (fetch pool threads are covered by the stage timers)
+
+    Stages may be recorded from any thread while a run is active; SQL is only
+    attributed when executed on the thread that started the run, so page
+    requests served meanwhile do not count. One run is active at a time.
+
+    Args:
+        level: One of PROFILE_LEVELS
+        profile_dir: Directory for cProfile dumps
+    """
+
+    def __init__(self, level: str = 'off', profile_dir: str = 'profiles'):
+        if level not in PROFILE_LEVELS:
+            raise ValueError(f"Unknown profile level {level!r}, expected one of {', '.join(PROFILE_LEVELS)}")
+        self.level = PROFILE_LEVELS.index(level)
+        self.profile_dir = profile_dir
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.current: Optional[ProfileRun] = None
+        self.last_summary: Optional[dict] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.level > 0
+
+    def attach(self, engine) -> None:
+        """Register the SQL timing hooks on engine (no-op below the 'sql' level)."""
+        if self.level < PROFILE_LEVELS.index('sql'):
+            return
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self.local, 'run', None) is not None:
+            conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        run = getattr(self.local, 'run', None)
+        if run is None or not conn.info.get('profile_started'):
+            return
+        seconds = time.perf_counter() - conn.info['profile_started'].pop()
+        with self.lock:
+            run.add_sql(getattr(self.local, 'stage', None), statement, seconds)
+
+    @contextmanager
+    def run(self, label: str) -> Iterator[Optional[ProfileRun]]:
+        """
+        Profile the enclosed refresh; the summary is logged and kept as last_summary.
+
+        Yields None (and records nothing) when disabled or another run is active.
+        """
+        with self.lock:
+            if not self.enabled or self.current is not None:
+                owner = None
+            else:
+                owner = self.current = ProfileRun(label)
+        if owner is None:
+            yield None
+            return
+        self.local.run = owner
+        profile = cProfile.Profile() if self.level >= PROFILE_LEVELS.index('cprofile') else None
+        if profile:
+            profile.enable()
+        try:
+            yield owner
+        finally:
+            if profile:
+                profile.disable()
+                self._save_profile(owner, profile)
+            self.local.run = None
+            with self.lock:
+                self.current = None
+                self.last_summary = owner.summary()
+            logger.info(f"Refresh profile: {format_summary(self.last_summary)}")
+
+    def _save_profile(self, run: ProfileRun, profile: cProfile.Profile) -> None:
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"refresh-{run.started_at:%Y%m%d-%H%M%S}-{os.getpid()}.prof")
+            profile.dump_stats(path)
+            run.profile_path = path
+        except OSError as e:
+            logger.error(f"Could not write refresh profile: {e}")
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+        run.profile_top = [{'function': f"{os.path.basename(filename)}:{line}({name})", 'calls': calls,
+                            'tottime': round(tottime, 4), 'cumtime': round(cumtime, 4)}
+                           for (filename, line, name), (_, calls, tottime, cumtime, _) in top]
+
+    def stage(self, name: str):
+        """Context manager adding the enclosed wall time to stage name of the active run."""
+        if self.current is None:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
+        previous = getattr(self.local, 'stage', None)
+        self.local.stage = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.local.stage = previous
+            with self.lock:
+                if self.current is not None:
+                    self.current.add_stage(name, seconds)
+
+    def timed(self, name: str):
+        """Decorator form of stage()."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        """Yield from iterable, timing each wait for the next item as stage name."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.current is None:
+            return
+        with self.lock:
+            if self.current is not None:
+                self.current.counters[name] = self.current.counters.get(name, 0) + n
+
+    def note(self, **info) -> None:
+        """Attach values (e.g. the job id) to the active run's summary."""
+        with self.lock:
+            if self.current is not None:
+                self.current.info.update(info)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            running = self.current.summary() if self.current is not None else None
+            return {'level': PROFILE_LEVELS[self.level], 'running': running, 'last': self.last_summary}
+
+
+def format_summary(summary: dict) -> str:
+    """One log line: run time, then each stage's share, then SQL totals."""
+    stages = ', '.join(f"{name} {stage['seconds']:.2f}s/{stage['count']}"
+                       for name, stage in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']))
+    line = f"{summary['label']} {summary['seconds']:.2f}s; {stages or 'no stages'}"
+    if 'sql' in summary:
+        sql = summary['sql']
+        line += f"; SQL {sql['count']} statements {sql['seconds']:.2f}s"
+        if sql['per_stock'] is not None:
+            line += f" ({sql['per_stock']}/stock)"
+    if 'profile' in summary and summary['profile']['path']:
+        line += f"; cProfile {summary['profile']['path']}"
+    return line
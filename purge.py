@@ -0,0 +1,49 @@
+import logging
+
+from sqlalchemy import delete, select, text
+
+from models import Stock, History, ScoreChange
+
+logger = logging.getLogger(__name__)
+
+# Child tables first so plain DELETEs never trip the stock foreign keys
+STOCK_DATA_TABLES = [History.__table__, ScoreChange.__table__, Stock.__table__]
+
+
+def purge_all(session) -> None:
+    """
+    Remove every Stock, History and ScoreChange row and restart their ids at 1.
+
+    Postgres uses a single TRUNCATE ... RESTART IDENTITY, which frees the
+    pages at once instead of writing a dead tuple per row. SQLite runs
+    unqualified DELETEs (its truncate optimization) and clears any
+    AUTOINCREMENT counters in sqlite_sequence.
+    """
+    names = [table.name for table in STOCK_DATA_TABLES]
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        session.execute(text(f"TRUNCATE TABLE {', '.join(names)} RESTART IDENTITY"))
+    else:
+        for table in STOCK_DATA_TABLES:
+            session.execute(delete(table))
+        if dialect == 'sqlite' and session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'")).first():
+            session.execute(text("DELETE FROM sqlite_sequence WHERE name IN ({})".format(
+                ', '.join(f"'{name}'" for name in names))))
+    session.commit()
+    logger.info(f"Purged {', '.join(names)}")
+
+
+def purge_stock(session, code: str) -> bool:
+    """
+    Remove one stock with its History and ScoreChange rows in one transaction.
+
+    Returns:
+        False if no stock has that code
+    """
+    stock_id = select(Stock.id).where(Stock.code == code).scalar_subquery()
+    session.execute(delete(History).where(History.stock_id == stock_id))
+    session.execute(delete(ScoreChange).where(ScoreChange.stock_id == stock_id))
+    deleted = session.execute(delete(Stock).where(Stock.code == code)).rowcount
+    session.commit()
+    return bool(deleted)
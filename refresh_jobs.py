@@ -0,0 +1,295 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import and_, bindparam, func, insert, or_, select, update
+
+from models import RefreshJob, RefreshItem
+
+logger = logging.getLogger(__name__)
+
+# RefreshJob.status; a planning job is reserved by the worker fetching the listing and has no items yet
+JOB_PLANNING, JOB_PENDING, JOB_RUNNING = 'planning', 'pending', 'running'
+JOB_STOPPED, JOB_COMPLETED, JOB_FAILED = 'stopped', 'completed', 'failed'
+ACTIVE_JOB_STATUSES = (JOB_PLANNING, JOB_PENDING, JOB_RUNNING)
+# RefreshJob.kind: full refresh, or retry_failed over failed stocks only
+KIND_REFRESH, KIND_RETRY = 'refresh', 'retry'
+# pg_advisory_xact_lock key serialising job creation across processes
+JOB_LOCK_KEY = 0x5354_4B52  # 'STKR'
+# RefreshItem.status
+ITEM_PENDING, ITEM_CLAIMED, ITEM_DONE, ITEM_FAILED, ITEM_SKIPPED = 'pending', 'claimed', 'done', 'failed', 'skipped'
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def active_job(session, timeout: timedelta, exclude: Optional[int] = None) -> Optional[RefreshJob]:
+    """
+    The job some worker is currently planning or checkpointing, if any.
+
+    A job whose heartbeat is older than timeout is treated as abandoned (its
+    workers died) and is not active.
+    """
+    query = session.query(RefreshJob).filter(
+        RefreshJob.status.in_(ACTIVE_JOB_STATUSES),
+        RefreshJob.heartbeat_at >= datetime.utcnow() - timeout
+    )
+    if exclude is not None:
+        query = query.filter(RefreshJob.id != exclude)
+    return query.order_by(RefreshJob.id.desc()).first()
+
+
+def resumable_job(session, max_age: timedelta) -> Optional[RefreshJob]:
+    """
+    Latest unfinished full refresh (abandoned or stopped) created within max_age.
+    """
+    return session.query(RefreshJob).filter(
+        RefreshJob.kind == KIND_REFRESH,
+        RefreshJob.status.in_((JOB_PENDING, JOB_RUNNING, JOB_STOPPED)),
+        RefreshJob.created_at >= datetime.utcnow() - max_age
+    ).order_by(RefreshJob.id.desc()).first()
+
+
+def reserve_job(session, timeout: timedelta, max_age: Optional[timedelta] = None,
+                kind: str = KIND_REFRESH) -> tuple[RefreshJob, bool]:
+    """
+    Find the job to work on, or reserve a new one, atomically across processes.
+
+    A planning job is inserted before anything is read. On Postgres the
+    transaction first takes an advisory lock; on SQLite that insert takes
+    the database write lock. Either way a second caller waits until the
+    first commits, then sees its job. If another job is active it is
+    returned instead (and the reservation dropped); with max_age, a
+    resumable refresh is resumed in the same transaction.
+
+    Returns:
+        Tuple of (job, created); a created job is in JOB_PLANNING and must be
+        filled with plan_job or closed with finish_job
+    """
+    # End any open transaction so the lock covers every read below
+    session.commit()
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(select(func.pg_advisory_xact_lock(JOB_LOCK_KEY)))
+    now = datetime.utcnow()
+    job = RefreshJob(status=JOB_PLANNING, kind=kind, created_at=now, heartbeat_at=now)
+    session.add(job)
+    session.flush()
+    existing = active_job(session, timeout, exclude=job.id)
+    if existing is None and max_age is not None:
+        existing = resumable_job(session, max_age)
+        if existing:
+            session.delete(job)
+            resume_job(session, existing)
+            return existing, False
+    if existing:
+        session.delete(job)
+        session.commit()
+        return existing, False
+    session.commit()
+    logger.info(f"Reserved {kind} job {job.id}")
+    return job, True
+
+
+def plan_job(session, job: RefreshJob, planned: Iterable[tuple[str, str, Optional[int]]]) -> RefreshJob:
+    """
+    Fill a reserved job with one item per (code, name, priority); items without a priority are stored as skipped.
+    """
+    items = [{'job_id': job.id, 'code': code, 'name': name, 'priority': priority or 0,
+              'status': ITEM_SKIPPED if priority is None else ITEM_PENDING}
+             for code, name, priority in planned]
+    if items:
+        session.execute(insert(RefreshItem), items)
+    job.status = JOB_PENDING
+    job.heartbeat_at = datetime.utcnow()
+    job.total = len(items)
+    job.skipped = sum(1 for item in items if item['status'] == ITEM_SKIPPED)
+    session.commit()
+    logger.info(f"Planned {job.kind} job {job.id} with {job.total} stocks ({job.skipped} not due, skipped)")
+    return job
+
+
+def resume_job(session, job: RefreshJob) -> None:
+    job.status = JOB_PENDING
+    job.stop_requested = False
+    job.finished_at = None
+    job.heartbeat_at = datetime.utcnow()
+    session.commit()
+    logger.info(f"Resuming refresh job {job.id}")
+
+
+def claim_items(session, job_id: int, worker: str, limit: int, claim_timeout: timedelta) -> list:
+    """
+    Claim up to limit pending items in priority order, plus claims abandoned for longer than claim_timeout.
+
+    On Postgres the candidate rows are locked with FOR UPDATE SKIP LOCKED so
+    concurrent workers never wait on or double-claim each other's rows. On
+    SQLite the database write lock serialises claims and the status guard
+    in the UPDATE does the rest.
+
+    Returns:
+        Rows with id, code, name
+    """
+    now = datetime.utcnow()
+    claimable = or_(RefreshItem.status == ITEM_PENDING,
+                    and_(RefreshItem.status == ITEM_CLAIMED, RefreshItem.claimed_at < now - claim_timeout))
+    ids = session.execute(
+        select(RefreshItem.id)
+        .where(RefreshItem.job_id == job_id, claimable)
+        .order_by(RefreshItem.priority, RefreshItem.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if ids:
+        session.execute(
+            update(RefreshItem)
+            .where(RefreshItem.id.in_(ids), claimable)
+            .values(status=ITEM_CLAIMED, claimed_by=worker, claimed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    session.commit()
+    if not ids:
+        return []
+    return session.execute(
+        select(RefreshItem.id, RefreshItem.code, RefreshItem.name)
+        .where(RefreshItem.id.in_(ids), RefreshItem.claimed_by == worker, RefreshItem.claimed_at == now)
+    ).all()
+
+
+def checkpoint(session, job_id: int, worker: str, done: list[int], failed: dict[int, str], released: list[int]) -> None:
+    """
+    Record the outcome of a claimed batch after its stock rows are committed.
+
+    Released items (claimed but never fetched, e.g. on stop) go back to pending.
+    Only items still claimed by worker are touched and counted, so a claim
+    that expired and went to another worker is left to that worker.
+    """
+    ours = and_(RefreshItem.job_id == job_id, RefreshItem.claimed_by == worker, RefreshItem.status == ITEM_CLAIMED)
+    updated = failed_count = 0
+    if done:
+        updated = session.execute(
+            update(RefreshItem).where(RefreshItem.id.in_(done), ours).values(status=ITEM_DONE)
+            .execution_options(synchronize_session=False)).rowcount
+    if failed:
+        failed_count = session.execute(
+            update(RefreshItem).where(RefreshItem.id.in_(list(failed)), ours).values(status=ITEM_FAILED)
+            .execution_options(synchronize_session=False)).rowcount
+        session.execute(
+            update(RefreshItem.__table__)
+            .where(RefreshItem.id == bindparam('item_id'), RefreshItem.claimed_by == worker,
+                   RefreshItem.status == ITEM_FAILED)
+            .values(error=bindparam('item_error')),
+            [{'item_id': item_id, 'item_error': error} for item_id, error in failed.items()])
+    if released:
+        session.execute(
+            update(RefreshItem).where(RefreshItem.id.in_(released), ours)
+            .values(status=ITEM_PENDING, claimed_by=None, claimed_at=None)
+            .execution_options(synchronize_session=False))
+    if updated != len(done) or failed_count != len(failed):
+        logger.warning(f"Worker {worker} lost {len(done) + len(failed) - updated - failed_count} claims "
+                       f"of job {job_id} to other workers")
+    values = {'updated': RefreshJob.updated + updated, 'failed': RefreshJob.failed + failed_count,
+              'heartbeat_at': datetime.utcnow()}
+    if failed:
+        values['last_error'] = next(reversed(failed.values()))
+    session.execute(update(RefreshJob).where(RefreshJob.id == job_id).values(**values)
+                    .execution_options(synchronize_session=False))
+    session.commit()
+
+
+def heartbeat(session, job_id: int, worker: Optional[str] = None) -> None:
+    """
+    Mark the job alive and, given a worker, extend the claims it still holds.
+    """
+    now = datetime.utcnow()
+    if worker:
+        session.execute(
+            update(RefreshItem)
+            .where(RefreshItem.job_id == job_id, RefreshItem.claimed_by == worker, RefreshItem.status == ITEM_CLAIMED)
+            .values(claimed_at=now)
+            .execution_options(synchronize_session=False))
+    session.execute(update(RefreshJob).where(RefreshJob.id == job_id).values(heartbeat_at=now)
+                    .execution_options(synchronize_session=False))
+    session.commit()
+
+
+class Heartbeat:
+    """
+    Calls heartbeat() every interval on its own session while the with-block runs.
+
+    Keeps a job (and a worker's claims) from looking abandoned during a
+    listing sync or a batch that outlasts the claim timeout.
+    """
+
+    def __init__(self, session_factory: Callable, job_id: int, worker: Optional[str], interval: float):
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.worker = worker
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'Heartbeat':
+        self.thread = threading.Thread(target=self.run, name=f"heartbeat-{self.job_id}", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            session = self.session_factory()
+            try:
+                heartbeat(session, self.job_id, self.worker)
+            except Exception as e:
+                session.rollback()
+                logger.warning(f"Heartbeat for job {self.job_id} failed: {e}")
+            finally:
+                session.close()
+
+
+def mark_running(session, job_id: int) -> None:
+    now = datetime.utcnow()
+    session.execute(update(RefreshJob).where(RefreshJob.id == job_id)
+                    .values(status=JOB_RUNNING, heartbeat_at=now, started_at=func.coalesce(RefreshJob.started_at, now))
+                    .execution_options(synchronize_session=False))
+    session.commit()
+
+
+def request_stop(session, job_id: int) -> None:
+    session.execute(update(RefreshJob).where(RefreshJob.id == job_id).values(stop_requested=True)
+                    .execution_options(synchronize_session=False))
+    session.commit()
+
+
+def stop_requested(session, job_id: int) -> bool:
+    return bool(session.execute(select(RefreshJob.stop_requested).where(RefreshJob.id == job_id)).scalar())
+
+
+def finish_job(session, job_id: int, error: Optional[str] = None) -> Optional[RefreshJob]:
+    """
+    Close the job once no pending or claimed items remain, or it was stopped.
+
+    Returns:
+        The job if this call closed it, None if other workers still hold items
+    """
+    job = session.get(RefreshJob, job_id)
+    remaining = session.query(RefreshItem).filter(
+        RefreshItem.job_id == job_id, RefreshItem.status.in_((ITEM_PENDING, ITEM_CLAIMED))).count()
+    if error:
+        job.status, job.last_error = JOB_FAILED, error
+    elif job.stop_requested:
+        job.status = JOB_STOPPED
+    elif remaining == 0:
+        job.status = JOB_COMPLETED
+    else:
+        session.commit()
+        return None
+    job.finished_at = datetime.utcnow()
+    session.commit()
+    return job
@@ -0,0 +1,138 @@
+import logging
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Iterable
+
+from sqlalchemy import insert, select, update
+
+from batch_writer import HISTORY_COLUMNS, build_stock_row, pack_breakdown, record_score_changes
+from models import Stock, History
+from scoring import compute_scores
+
+logger = logging.getLogger(__name__)
+
+# Columns a cached payload replay may overwrite: score inputs and results, not refresh or failure tracking
+REPLAY_COLUMNS = ['growth_cagr', 'div_yield', 'pe_ratio', 'roe', 'profit', 'latest_profit', 'cash_positive',
+                  'current_score', 'breakdown', 'industry', 'market']
+
+
+def rescore_stocks(session, chunk_size: int = 1000) -> dict[str, float]:
+    """
+    Recompute every stored score from the inputs already on Stock, without refetching.
+
+    Streams scored stocks in id order (keyset, chunk_size rows at a time),
+    rescores each chunk with compute_scores, snapshots changed scores into
+    History and ScoreChange, bulk-updates only the changed rows and commits
+    per chunk. Stocks that were never scored (failed fetches) are left alone.
+
+    C is scored from the sign of Stock.latest_profit. Stocks not refreshed
+    since that column was added fall back to the sign of the profit margin
+    (Stock.profit), which only differs when revenue is 0.
+
+    Returns:
+        Dictionary with keys: scanned, changed, seconds
+    """
+    started = time.perf_counter()
+    columns = [Stock.id, Stock.current_score, Stock.breakdown, Stock.latest_profit] + \
+        [getattr(Stock, c) for c in HISTORY_COLUMNS]
+    scanned = changed = 0
+    last_id = 0
+    while True:
+        rows = session.execute(
+            select(*columns)
+            .where(Stock.id > last_id, Stock.last_refreshed.isnot(None))
+            .order_by(Stock.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scanned += len(rows)
+        margin = [r.profit or 0.0 for r in rows]
+        totals, breakdown = compute_scores(
+            growth=[r.growth_cagr or 0.0 for r in rows],
+            div_yield=[r.div_yield or 0.0 for r in rows],
+            per=[999.0 if r.pe_ratio is None else r.pe_ratio for r in rows],
+            roe=[r.roe or 0.0 for r in rows],
+            margin=margin,
+            profit=[(r.profit or 0.0) if r.latest_profit is None else r.latest_profit for r in rows],
+            cash_positive=[r.cash_positive or 0 for r in rows]
+        )
+        now = datetime.utcnow()
+        updates, history, scores = [], [], {}
+        for i, row in enumerate(rows):
+            new_breakdown = {key: int(values[i]) for key, values in breakdown.items()}
+            new_score = int(totals[i])
+            if new_score == row.current_score and new_breakdown == row.breakdown:
+                continue
+            updates.append({'id': row.id, 'current_score': new_score, 'breakdown': new_breakdown, 'last_updated': now})
+            if row.current_score and row.current_score != new_score:
+                snapshot = {c: getattr(row, c) for c in HISTORY_COLUMNS}
+                history.append(dict(snapshot, **pack_breakdown(row.breakdown), stock_id=row.id, score=row.current_score,
+                                    date=now))
+                scores[row.id] = new_score
+        if history:
+            session.execute(insert(History), history)
+            record_score_changes(session, history, scores)
+        if updates:
+            session.execute(update(Stock), updates)
+        session.commit()
+        changed += len(updates)
+    seconds = time.perf_counter() - started
+    logger.info(f"Rescored {scanned} stocks in {seconds:.2f}s, {changed} changed")
+    return {'scanned': scanned, 'changed': changed, 'seconds': seconds}
+
+
+def rescore_from_payloads(session, payloads: Iterable[tuple[str, dict]], chunk_size: int = 1000) -> dict[str, float]:
+    """
+    Re-extract and rescore stored stocks from (code, stock_data) payloads, e.g. PayloadCache.items().
+
+    Like rescore_stocks, only stocks already in the database that were scored
+    before are touched; payloads for unknown or never-scored codes are
+    skipped. Changed scores get History and ScoreChange rows and only the
+    REPLAY_COLUMNS are written, so last_refreshed, status and the failure
+    tracking still describe the last real fetch. Commits per chunk.
+
+    Returns:
+        Dictionary with keys: scanned, changed, skipped, seconds
+    """
+    started = time.perf_counter()
+    columns = [Stock.id, Stock.code, Stock.current_score, Stock.breakdown] + [getattr(Stock, c) for c in HISTORY_COLUMNS]
+    scanned = changed = skipped = 0
+    payloads = iter(payloads)
+    while True:
+        chunk = dict(islice(payloads, chunk_size))
+        if not chunk:
+            break
+        stored = {r.code: r for r in session.execute(
+            select(*columns).where(Stock.code.in_(chunk), Stock.last_refreshed.isnot(None)))}
+        skipped += len(chunk) - len(stored)
+        now = datetime.utcnow()
+        updates, history, scores = [], [], {}
+        for code, old in stored.items():
+            try:
+                row = build_stock_row(chunk[code])
+            except Exception as e:
+                logger.error(f"Failed to score cached payload of {code}: {e}")
+                skipped += 1
+                continue
+            scanned += 1
+            if row['current_score'] == old.current_score and row['breakdown'] == old.breakdown:
+                continue
+            updates.append(dict({c: row[c] for c in REPLAY_COLUMNS}, id=old.id, last_updated=now))
+            if old.current_score and old.current_score != row['current_score']:
+                snapshot = {c: getattr(old, c) for c in HISTORY_COLUMNS}
+                history.append(dict(snapshot, **pack_breakdown(old.breakdown), stock_id=old.id, score=old.current_score,
+                                    date=now))
+                scores[old.id] = row['current_score']
+        if history:
+            session.execute(insert(History), history)
+            record_score_changes(session, history, scores)
+        if updates:
+            session.execute(update(Stock), updates)
+        session.commit()
+        changed += len(updates)
+    seconds = time.perf_counter() - started
+    logger.info(f"Replayed {scanned} cached payloads in {seconds:.2f}s, {changed} changed, {skipped} skipped")
+    return {'scanned': scanned, 'changed': changed, 'skipped': skipped, 'seconds': seconds}
@@ -0,0 +1,152 @@
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+
+from batch_writer import STOCK_FAILED, IndexEntry, StockIndex
+from models import Stock, History
+
+logger = logging.getLogger(__name__)
+
+TIER_FAVORITE, TIER_HIGH_SCORE, TIER_VOLATILE, TIER_NORMAL = 'favorite', 'high_score', 'volatile', 'normal'
+# Work order: every due favorite before any due high-score stock, and so on
+TIER_ORDER = [TIER_FAVORITE, TIER_HIGH_SCORE, TIER_VOLATILE, TIER_NORMAL]
+
+StockState = namedtuple('StockState', ['id', 'is_favorite', 'current_score', 'last_refreshed', 'changes',
+                                       'failure_count', 'last_failed_at'])
+
+
+class CircuitBreaker:
+    """
+    Per-stock breaker for codes that keep failing, kept apart from the HTTP
+    retry budget and driven by Stock.failure_count / last_failed_at.
+
+    After threshold consecutive failures a code is not fetched again until
+    cooldown has passed since its last failure; the next attempt then either
+    resets the count (success) or reopens the breaker (failure).
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: timedelta = timedelta(hours=24)):
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    def is_open(self, failure_count: Optional[int], last_failed_at: Optional[datetime],
+                now: Optional[datetime] = None) -> bool:
+        if not failure_count or failure_count < self.threshold or last_failed_at is None:
+            return False
+        return (now or datetime.utcnow()) - last_failed_at < self.cooldown
+
+
+def plan_retry(session, breaker: CircuitBreaker, now: Optional[datetime] = None) -> list[tuple[str, str, Optional[int]]]:
+    """
+    Plan for a retry_failed job: every stock with status failed, fewest
+    failures first, with codes behind an open breaker skipped (priority None).
+    """
+    now = now or datetime.utcnow()
+    rows = session.execute(
+        select(Stock.code, Stock.name, Stock.failure_count, Stock.last_failed_at)
+        .where(Stock.status == STOCK_FAILED)
+        .order_by(func.coalesce(Stock.failure_count, 0), Stock.id)
+    ).all()
+    planned, priority = [], 0
+    for code, name, failure_count, last_failed_at in rows:
+        if breaker.is_open(failure_count, last_failed_at, now):
+            planned.append((code, name, None))
+        else:
+            planned.append((code, name, priority))
+            priority += 1
+    logger.info(f"Retry plan: {priority} failed stocks due, {len(planned) - priority} held by the circuit breaker")
+    return planned
+
+
+class RefreshScheduler:
+    """
+    Decides which stocks a refresh should fetch and in what order.
+
+    Each stock falls in the first matching tier: favorite, high score
+    (current_score >= high_score), volatile (at least volatile_changes
+    History rows within volatility_window), or normal. A stock is due once
+    its tier's interval has passed since last_refreshed; stocks never
+    refreshed are always due. Due stocks are ordered by tier, then most
+    overdue first, so a partial or stopped run covers what matters.
+
+    Args:
+        intervals: Refresh interval per tier
+        high_score: Minimum current_score for the high-score tier
+        volatile_changes: Score changes within the window that make a stock volatile
+        volatility_window: How far back History is counted
+        breaker: Optional CircuitBreaker; stocks behind an open breaker are not due
+    """
+
+    def __init__(self, intervals: dict[str, timedelta], high_score: int = 140, volatile_changes: int = 2,
+                 volatility_window: timedelta = timedelta(days=30), breaker: Optional[CircuitBreaker] = None):
+        self.intervals = intervals
+        self.high_score = high_score
+        self.volatile_changes = volatile_changes
+        self.volatility_window = volatility_window
+        self.breaker = breaker
+        self.stocks: dict[str, StockState] = {}
+
+    def load(self, session, now: Optional[datetime] = None) -> 'RefreshScheduler':
+        """
+        Load id, favorite flag, score, last refresh, recent change count and failures for every stock in one query.
+        """
+        since = (now or datetime.utcnow()) - self.volatility_window
+        changes = (select(History.stock_id, func.count().label('changes'))
+                   .where(History.date >= since).group_by(History.stock_id).subquery())
+        rows = session.execute(
+            select(Stock.code, Stock.id, Stock.is_favorite, Stock.current_score, Stock.last_refreshed,
+                   func.coalesce(changes.c.changes, 0), Stock.failure_count, Stock.last_failed_at)
+            .outerjoin(changes, changes.c.stock_id == Stock.id)
+        )
+        self.stocks = {code: StockState(stock_id, bool(favorite), score or 0, last_refreshed, change_count, failures,
+                                        failed_at)
+                       for code, stock_id, favorite, score, last_refreshed, change_count, failures, failed_at in rows}
+        return self
+
+    def index(self) -> StockIndex:
+        """
+        The loaded stocks as a StockIndex, so the run working this plan doesn't load them again.
+        """
+        return StockIndex({code: IndexEntry(state.id, state.last_refreshed, state.current_score)
+                           for code, state in self.stocks.items()})
+
+    def tier(self, code: str) -> str:
+        state = self.stocks.get(code)
+        if state is None:
+            return TIER_NORMAL
+        if state.is_favorite:
+            return TIER_FAVORITE
+        if state.current_score >= self.high_score:
+            return TIER_HIGH_SCORE
+        if state.changes >= self.volatile_changes:
+            return TIER_VOLATILE
+        return TIER_NORMAL
+
+    def plan(self, codes: Iterable[tuple[str, str]], now: Optional[datetime] = None) -> list[tuple[str, str, Optional[int]]]:
+        """
+        Returns:
+            [(code, name, priority)] where priority ranks due stocks from 0
+            (fetch first) and is None for stocks that are not due yet
+        """
+        now = now or datetime.utcnow()
+        due, planned = [], {}
+        counts = {tier: [0, 0] for tier in TIER_ORDER}
+        for code, name in codes:
+            tier = self.tier(code)
+            state = self.stocks.get(code)
+            age = now - state.last_refreshed if state and state.last_refreshed else timedelta.max
+            held = state and self.breaker and self.breaker.is_open(state.failure_count, state.last_failed_at, now)
+            if age < self.intervals[tier] or held:
+                planned[code] = (code, name, None)
+                counts[tier][1] += 1
+                continue
+            counts[tier][0] += 1
+            due.append((TIER_ORDER.index(tier), -age.total_seconds() if age != timedelta.max else float('-inf'), code, name))
+        due.sort()
+        for priority, (_, _, code, name) in enumerate(due):
+            planned[code] = (code, name, priority)
+        logger.info("Refresh plan (due/skipped): " + ', '.join(f"{tier} {d}/{s}" for tier, (d, s) in counts.items()))
+        return list(planned.values())
@@ -1,6 +1,22 @@
 from collections import defaultdict
 from datetime import datetime
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    # Imported inside compute_scores: only rescoring needs numpy, not every web worker
+    import numpy as np
+
+# Declarative threshold table used by compute_scores. Each entry maps a
+# breakdown key to (input, edges, points, side): 'right' ladders award
+# points[i] where i = number of edges <= value (the `>=` ladders in
+# compute_score); 'left' ladders count edges < value (the `<=` ladders).
+SCORE_TABLE = {
+    'G': ('growth', [1, 6, 10, 15], [0, 20, 30, 40, 50], 'right'),
+    'D': ('div_yield', [1, 3, 5, 7], [0, 5, 10, 15, 20], 'right'),
+    'P_PER': ('per', [9, 15, 24], [30, 20, 10, 5], 'left'),
+    'P_PM': ('margin', [1, 6, 11, 16], [0, 5, 10, 15, 20], 'right'),
+    'R': ('roe', [1, 6, 11, 16], [0, 10, 20, 30, 40], 'right'),
+}
 
 def clean_float(value: Any) -> float:
     """
@@ -8,15 +24,27 @@ def clean_float(value: Any) -> float:
     """
     if value is None:
         return 0.0
-    str_val = str(value).replace(',', '')  # Remove commas (e.g., '1,057.27' → '1057.27')
+    value_type = type(value)
+    if value_type is float or value_type is int:
+        return float(value)
+    if value_type is str:
+        try:
+            return float(value)  # Fast path: no commas to strip
+        except ValueError:
+            value = value.replace(',', '')  # Remove commas (e.g., '1,057.27' → '1057.27')
+    else:
+        value = str(value).replace(',', '')
     try:
-        return float(str_val)
+        return float(value)
     except (ValueError, TypeError):
         return 0.0
 
 def extract_values(stock_data: dict) -> dict[str, float]:
     """
     Extract necessary values from stock_data JSON for scoring.
+
+    FinancialReport is walked once: each report's profit is parsed a single
+    time and the latest quarter is found by comparing ISO date strings.
     
     Args:
         stock_data: JSON response from KLSEScreener API
@@ -33,45 +61,55 @@ def extract_values(stock_data: dict) -> dict[str, float]:
     # Extract growth from StockIndicator or calculate manually
     indicators = stock_data.get('StockIndicator', {})
     growth = clean_float(indicators.get('cagr_5y', 0))
-    if growth == 0:
-        reports = stock_data.get('FinancialReport', [])
-        if reports:
-            annual_profits = defaultdict(float)
-            for report in reports:
-                year = report['financial_year_end'][:4]  # Extract year
-                profit = clean_float(report.get('profit_loss', 0))
-                annual_profits[year] += profit
-            
-            years = sorted(annual_profits.keys(), reverse=True)[:5]
-            if len(years) >= 2:
-                latest_year = years[0]
-                earliest_year = years[-1]
-                latest_profit = annual_profits[latest_year]
-                earliest_profit = annual_profits[earliest_year]
-                if earliest_profit <= 0 or latest_profit <= 0:
-                    growth = 0
-                else:
-                    num_years = len(years) - 1
-                    growth = ((latest_profit / earliest_profit) ** (1 / num_years) - 1)
+    need_annual = growth == 0
+
+    # Single pass over the reports: annual profit sums (only needed for the
+    # growth fallback), the latest quarter, and positive profit in the last 4
+    reports = stock_data.get('FinancialReport', [])
+    annual_profits = defaultdict(float)
+    latest = None
+    latest_date = None
+    latest_profit = 0.0
+    recent_positive = False
+    recent_start = len(reports) - 4
+    for i, report in enumerate(reports):
+        profit = clean_float(report.get('profit_loss', 0))
+        if need_annual:
+            annual_profits[report['financial_year_end'][:4]] += profit  # Extract year
+        date = report['quarter_date_end']  # ISO 'YYYY-MM-DD' sorts as a string
+        if len(date) != 10:
+            date = datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')  # Unpadded, e.g. '2024-3-31'
+        if latest is None or date > latest_date:
+            latest, latest_date, latest_profit = report, date, profit
+        if i >= recent_start and profit > 0:
+            recent_positive = True
+
+    if need_annual and reports:
+        years = sorted(annual_profits.keys(), reverse=True)[:5]
+        if len(years) >= 2:
+            latest_year_profit = annual_profits[years[0]]
+            earliest_year_profit = annual_profits[years[-1]]
+            if earliest_year_profit <= 0 or latest_year_profit <= 0:
+                growth = 0
             else:
-                growth = clean_float(indicators.get('cagr_3y', 0))
+                num_years = len(years) - 1
+                growth = ((latest_year_profit / earliest_year_profit) ** (1 / num_years) - 1)
+        else:
+            growth = clean_float(indicators.get('cagr_3y', 0))
     
     growth = growth * 100
     # Extract profit, revenue for margin, and cash_flow from latest report
     profit = 0
     revenue = 1
     cash_positive = False
-    reports = stock_data.get('FinancialReport', [])
-    if reports:
-        # Sort by date to get latest
-        latest = max(reports, key=lambda r: datetime.strptime(r['quarter_date_end'], '%Y-%m-%d'))
-        profit = clean_float(latest.get('profit_loss', 0))
+    if latest is not None:
+        profit = latest_profit
         revenue = clean_float(latest.get('revenue', 1))
         # Check operating CF if available, else fallback to any positive profit in last 4 quarters
         if 'operating_cf' in latest:
             cash_positive = clean_float(latest.get('operating_cf', 0)) > 0
         else:
-            cash_positive = any(clean_float(r.get('profit_loss', 0)) > 0 for r in reports[-4:])  # Last year approx
+            cash_positive = recent_positive  # Last year approx
     
     margin = (profit / revenue * 100) if revenue else 0
 
@@ -210,4 +248,56 @@ def compute_score(
         'P_PM': p_pm_points, 'R': r_points, 'C': c_points, 'PRC': prc,
         'W': total
     }
-    return total, breakdown
\ No newline at end of file
+    return total, breakdown
+
+def compute_scores(
+    growth: 'np.ndarray',
+    div_yield: 'np.ndarray',
+    per: 'np.ndarray',
+    roe: 'np.ndarray',
+    margin: 'np.ndarray',
+    profit: 'np.ndarray',
+    cash_positive: 'np.ndarray'
+) -> tuple['np.ndarray', dict[str, 'np.ndarray']]:
+    """
+    Vectorized compute_score over columnar inputs, one element per stock.
+
+    Bins every input with np.searchsorted against SCORE_TABLE, so results
+    match compute_score element for element (including NaN inputs, which
+    fall through to each ladder's else branch).
+
+    Args:
+        growth, div_yield, per, roe, margin, profit, cash_positive: Array-likes
+            of equal length, same meaning as the compute_score arguments
+
+    Returns:
+        Tuple of (total_scores, breakdown) where breakdown maps each
+        compute_score breakdown key to an int array
+    """
+    import numpy as np
+
+    inputs = {
+        'growth': np.asarray(growth, dtype=float),
+        'div_yield': np.asarray(div_yield, dtype=float),
+        'per': np.asarray(per, dtype=float),
+        'roe': np.asarray(roe, dtype=float),
+        'margin': np.asarray(margin, dtype=float),
+    }
+    breakdown = {}
+    for key, (name, edges, points, side) in SCORE_TABLE.items():
+        values = inputs[name]
+        bins = np.searchsorted(np.asarray(edges, dtype=float), values, side=side)
+        if side == 'right':
+            bins[np.isnan(values)] = 0  # NaN fails every `>=` test
+        breakdown[key] = np.asarray(points, dtype=np.int64)[bins]
+    breakdown['P_PER'][inputs['per'] < 0] = 0
+
+    profit_positive = np.asarray(profit, dtype=float) >= 0
+    cash = np.asarray(cash_positive).astype(bool)
+    breakdown['C'] = np.where(profit_positive, np.where(cash, 40, 30), np.where(cash, 20, 1)).astype(np.int64)
+
+    breakdown['GDP'] = breakdown['G'] + breakdown['D'] + breakdown['P_PER']
+    breakdown['PRC'] = breakdown['P_PM'] + breakdown['R'] + breakdown['C']
+    breakdown['W'] = np.maximum(0, breakdown['GDP'] + breakdown['PRC'])
+    order = ['G', 'D', 'P_PER', 'GDP', 'P_PM', 'R', 'C', 'PRC', 'W']
+    return breakdown['W'], {key: breakdown[key] for key in order}
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from stub_upstream import StubUpstream, synthetic_listing, synthetic_payloads
+
+
+@pytest.fixture(scope='session')
+def stub():
+    """Local stand-in for both upstreams, serving 6 synthetic stocks without latency or errors."""
+    stub = StubUpstream(synthetic_listing(6), synthetic_payloads(6, quarters=8)).start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def make_stub():
+    """Factory for extra stubs with their own latency or error rate, stopped after the test."""
+    stubs = []
+
+    def make(stocks: int = 6, **kwargs) -> StubUpstream:
+        stubs.append(StubUpstream(synthetic_listing(stocks), synthetic_payloads(stocks, quarters=4), **kwargs).start())
+        return stubs[-1]
+
+    yield make
+    for stub in stubs:
+        stub.stop()
+
+
+@pytest.fixture(scope='session')
+def stock_app(stub):
+    """The app module, configured against the stub and a throwaway SQLite file (config is read at import)."""
+    os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}",
+                      KLSESCREENER_URL=stub.url, I3INVESTOR_URL=stub.url,
+                      PAYLOAD_CACHE_PATH='', DATA_VERSION_FILE='')
+    import app as stock_app
+    return stock_app
+
+
+@pytest.fixture
+def fresh_db(stock_app, stub):
+    """Empty tables, an empty message queue and a cleared stop flag for each test."""
+    from models import db
+    db.metadata.drop_all(stock_app.engine)
+    stock_app.init_db()
+    stock_app.refresh_stop_event.clear()
+    while not stock_app.refresh_message_queue.empty():
+        stock_app.refresh_message_queue.get()
+    codes = dict(stub.codes)
+    yield stock_app
+    stub.codes = codes
+    stock_app.refresh_stop_event.clear()
@@ -0,0 +1,64 @@
+"""Packed History breakdowns: pack/unpack round trips and compact_history."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from batch_writer import BREAKDOWN_COLUMNS, pack_breakdown, unpack_breakdown
+from history import BREAKDOWN_HISTORY_COLUMNS, compact_history, with_breakdown
+from models import History, Stock
+from scoring import compute_score
+
+NORMAL = [
+    compute_score(growth=12, div_yield=5, per=9, roe=18, margin=15, profit=1, cash_positive=1)[1],
+    compute_score(growth=-5, div_yield=0, per=80, roe=-3, margin=-2, profit=-1, cash_positive=0)[1],
+]
+ODD = [
+    {},
+    {'G': 10, 'D': 5},                                                       # missing components
+    dict(NORMAL[0], G=1.5),                                                  # non-integer points
+    dict(NORMAL[0], D=True),                                                 # bool is not a point value
+    dict(NORMAL[0], G=40000),                                                # does not fit a SmallInteger
+    dict(NORMAL[0], W=NORMAL[0]['W'] + 1),                                   # totals that don't add up
+    dict(NORMAL[0], extra=3),                                                # unknown keys
+    {'score': 'n/a'},
+]
+
+
+@pytest.mark.parametrize('breakdown', NORMAL)
+def test_scored_breakdowns_pack_losslessly(breakdown):
+    values = pack_breakdown(breakdown)
+    assert values['breakdown'] is None
+    assert all(isinstance(values[column], int) for column in BREAKDOWN_COLUMNS.values())
+    assert unpack_breakdown(values) == breakdown
+
+
+@pytest.mark.parametrize('breakdown', ODD + [None])
+def test_odd_breakdowns_keep_their_json(breakdown):
+    values = pack_breakdown(breakdown)
+    assert all(values[column] is None for column in BREAKDOWN_COLUMNS.values())
+    assert unpack_breakdown(values) == (breakdown or {})
+
+
+def test_compact_history_round_trips_legacy_rows(fresh_db):
+    session = fresh_db.Session()
+    try:
+        stock = Stock(code='0001', name='one')
+        session.add(stock)
+        session.flush()
+        breakdowns = NORMAL + ODD
+        # Legacy rows: the whole breakdown stored as JSON, packed columns empty
+        session.add_all([History(stock_id=stock.id, score=i, breakdown=breakdown, date=datetime(2024, 1, 1))
+                         for i, breakdown in enumerate(breakdowns)])
+        session.commit()
+
+        stats = compact_history(session, chunk_size=3)
+        assert (stats['scanned'], stats['packed']) == (len(breakdowns), len(NORMAL))
+        # Reruns only revisit the rows that kept their JSON
+        assert compact_history(session)['scanned'] == len(ODD)
+
+        rows = session.execute(select(History.score, *BREAKDOWN_HISTORY_COLUMNS).order_by(History.score)).all()
+        assert [with_breakdown(row._asdict())['breakdown'] for row in rows] == breakdowns
+        assert [row.g_points is not None for row in rows] == [True] * len(NORMAL) + [False] * len(ODD)
+    finally:
+        session.close()
@@ -0,0 +1,69 @@
+"""HttpClient retry rules, RetryBudget and per-host concurrency against benchmarks/stub_upstream.py."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from http_client import HttpClient, RetryBudget
+
+
+def payload_url(stub, code: str) -> str:
+    return f"{stub.url}/v2/stocks/view/{code}/all.json"
+
+
+def test_retries_5xx_until_attempts_run_out(make_stub):
+    stub = make_stub(error_rate=1.0)
+    client = HttpClient(max_retries=3, backoff=0)
+    with pytest.raises(requests.HTTPError):
+        client.get(payload_url(stub, next(iter(stub.codes))))
+    assert stub.counts['error'] == 3
+
+
+def test_recovers_after_a_5xx(make_stub):
+    stub = make_stub(error_rate=1.0)
+    client = HttpClient(max_retries=3, backoff=0)
+    hooks = {'response': lambda resp, **kwargs: setattr(stub, 'error_rate', 0.0)}
+    resp = client.get(payload_url(stub, next(iter(stub.codes))), hooks=hooks)
+    assert resp.status_code == 200
+    assert (stub.counts['error'], stub.counts['payload']) == (1, 1)
+
+
+def test_does_not_retry_404(make_stub):
+    stub = make_stub()
+    client = HttpClient(max_retries=3, backoff=0)
+    with pytest.raises(requests.HTTPError):
+        client.get(payload_url(stub, 'NOPE'))
+    assert stub.counts['not_found'] == 1
+
+
+def test_retries_stop_once_the_budget_is_spent(make_stub):
+    stub = make_stub(error_rate=1.0)
+    client = HttpClient(max_retries=3, backoff=0)
+    client.budget = RetryBudget(ratio=0, min_retries=1)
+    code = next(iter(stub.codes))
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.get(payload_url(stub, code))
+    # One banked retry: the first request gets two attempts, the second only one
+    assert stub.counts['error'] == 3
+
+
+def test_retry_budget_refills_up_to_its_cap():
+    budget = RetryBudget(ratio=0.5, min_retries=2)
+    assert budget.withdraw() and budget.withdraw() and not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2
+
+
+def test_requests_per_host_stay_under_the_cap(make_stub):
+    stub = make_stub(stocks=8, latency=0.1)
+    client = HttpClient(max_per_host=2)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(lambda code: client.get(payload_url(stub, code)).status_code, stub.codes))
+    assert statuses == [200] * 8
+    assert stub.peak_in_flight == 2
@@ -0,0 +1,35 @@
+"""sync_listing against benchmarks/stub_upstream.py."""
+from datetime import timedelta
+
+import requests
+
+from listing import sync_listing
+from models import ListedStock, ListingSync
+
+
+class FailingMarket:
+    """Wraps the shared HTTP client so listing requests for one market fail."""
+
+    def __init__(self, http, market: str):
+        self.http = http
+        self.market = market
+
+    def post(self, url, json=None, **kwargs):
+        if json and json.get('marketList') == [self.market]:
+            raise requests.ConnectionError(f"{self.market} unavailable")
+        return self.http.post(url, json=json, **kwargs)
+
+
+def test_sync_listing_keeps_cached_universe_when_a_market_fails(fresh_db, stub):
+    session = fresh_db.Session()
+    try:
+        full = sync_listing(session, fresh_db.get_http(), stub.url, timedelta(hours=1), force=True)
+        assert len(full) == 6
+
+        partial = sync_listing(session, FailingMarket(fresh_db.get_http(), 'MAIN'), stub.url, timedelta(hours=1),
+                               force=True)
+        assert sorted(partial) == sorted(full)
+        assert session.query(ListedStock).count() == 6
+        assert session.query(ListingSync).count() == 1
+    finally:
+        session.close()
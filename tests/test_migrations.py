@@ -0,0 +1,80 @@
+"""flask init-db against empty, pre-migration and partially upgraded databases."""
+from datetime import datetime
+
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+from models import db
+
+
+def reset(stock_app) -> None:
+    db.metadata.drop_all(stock_app.engine)
+    with stock_app.engine.begin() as conn:
+        conn.execute(text('DROP TABLE IF EXISTS alembic_version'))
+
+
+def baseline_schema(stock_app) -> None:
+    """Tables as a deployment from before migrations were tracked has them (no alembic_version)."""
+    with stock_app.app.app_context():
+        stock_app.migrate_extension()
+        upgrade(stock_app.MIGRATIONS_DIR, stock_app.BASELINE_REVISION)
+    with stock_app.engine.begin() as conn:
+        conn.execute(text('DROP TABLE alembic_version'))
+
+
+def assert_at_head(stock_app) -> None:
+    with stock_app.engine.connect() as conn:
+        context = MigrationContext.configure(conn)
+        assert context.get_current_revision() == 'c8868ba185aa'
+        assert compare_metadata(context, db.metadata) == []
+
+
+@pytest.fixture
+def empty_db(fresh_db):
+    reset(fresh_db)
+    yield fresh_db
+    reset(fresh_db)
+
+
+def test_empty_database_is_created_and_stamped(empty_db):
+    empty_db.init_db()
+    assert_at_head(empty_db)
+
+
+def test_pre_migration_database_is_upgraded(empty_db):
+    baseline_schema(empty_db)
+    with empty_db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO stock (id, code, name, current_score) VALUES (1, '0001', 'one', 120), "
+                          "(2, '0002', 'two', 0)"))
+        conn.execute(text("INSERT INTO history (stock_id, date, score, breakdown) VALUES (1, :date, 100, '{\"G\": 40}')"),
+                     {'date': datetime(2024, 1, 1)})
+
+    empty_db.init_db()
+    assert_at_head(empty_db)
+    with empty_db.engine.connect() as conn:
+        assert conn.execute(text('SELECT code, status, failure_count FROM stock ORDER BY id')).all() == \
+            [('0001', 'ok', 0), ('0002', 'failed', 0)]
+        assert conn.execute(text('SELECT breakdown, g_points FROM history')).all() == [('{"G": 40}', None)]
+    # Rerunning is a no-op
+    empty_db.init_db()
+    assert_at_head(empty_db)
+
+
+def test_database_from_an_unknown_revision_is_upgraded(empty_db):
+    # e.g. migrations generated locally by an old migrate.sh
+    baseline_schema(empty_db)
+    with empty_db.engine.begin() as conn:
+        conn.execute(text('CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL PRIMARY KEY)'))
+        conn.execute(text("INSERT INTO alembic_version VALUES ('1a2b3c4d5e6f')"))
+    empty_db.init_db()
+    assert_at_head(empty_db)
+
+
+def test_database_upgraded_by_an_earlier_init_db_is_upgraded(empty_db):
+    # The schema is already current but was never stamped
+    db.metadata.create_all(empty_db.engine)
+    empty_db.init_db()
+    assert_at_head(empty_db)
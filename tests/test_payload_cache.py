@@ -0,0 +1,30 @@
+"""PayloadCache storage and the conditional GETs fetch_stock_data makes through it."""
+from payload_cache import PayloadCache
+
+
+def test_items_skips_and_discards_unreadable_entries(tmp_path):
+    cache = PayloadCache(str(tmp_path / 'payload_cache.db'))
+    cache.put('0001', b'{"Stock": {}}')
+    cache.put('0002', b'not json{')
+    cache.put('0003', b'{"Stock": {"name": "x"}}')
+    cache.conn.execute("UPDATE payload SET body = ? WHERE code = '0003'", (b'not zlib',))
+    assert list(cache.items()) == [('0001', {'Stock': {}})]
+    assert cache.get('0002') is None and cache.get('0003') is None
+
+
+def test_stale_entries_are_revalidated_with_a_conditional_get(fresh_db, stub, monkeypatch, tmp_path):
+    cache = PayloadCache(str(tmp_path / 'payload_cache.db'), ttl=3600)
+    monkeypatch.setattr(fresh_db, 'payload_cache', cache)
+    stub.counts.update(payload=0, not_modified=0)
+    code = sorted(stub.codes)[0]
+
+    data, error = fresh_db.fetch_stock_data(code)
+    assert error is None and cache.get(code).etag == stub.payload(code)[1]
+    # Within the TTL the cached body is served without a request
+    assert fresh_db.fetch_stock_data(code) == (data, None)
+    assert (stub.counts['payload'], stub.counts['not_modified']) == (1, 0)
+
+    cache.conn.execute('UPDATE payload SET fetched_at = fetched_at - 7200')
+    assert fresh_db.fetch_stock_data(code) == (data, None)
+    assert (stub.counts['payload'], stub.counts['not_modified']) == (1, 1)
+    assert cache.is_fresh(cache.get(code))
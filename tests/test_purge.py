@@ -0,0 +1,56 @@
+"""purge_all and prune_history on SQLite."""
+from datetime import datetime
+
+from sqlalchemy import select
+
+from history import prune_history
+from models import History, ScoreChange, Stock
+from purge import purge_all
+
+
+def add_stock(session, code: str, dates: list[datetime]) -> Stock:
+    stock = Stock(code=code, name=code)
+    session.add(stock)
+    session.flush()
+    session.add_all([History(stock_id=stock.id, score=i, date=date) for i, date in enumerate(dates)])
+    session.commit()
+    return stock
+
+
+def test_purge_all_clears_stock_data_and_restarts_ids(fresh_db):
+    session = fresh_db.Session()
+    try:
+        for code in ('0001', '0002'):
+            stock = add_stock(session, code, [datetime(2024, 1, 1), datetime(2024, 1, 2)])
+        session.add(ScoreChange(stock_id=stock.id, previous_score=1, score=2, delta=1, changed_at=datetime(2024, 1, 2)))
+        session.commit()
+
+        purge_all(session)
+        assert [session.query(model).count() for model in (Stock, History, ScoreChange)] == [0, 0, 0]
+        stock = add_stock(session, '0003', [datetime(2024, 1, 3)])
+        assert stock.id == 1 and session.query(History.id).scalar() == 1
+    finally:
+        session.close()
+
+
+def test_prune_history_keeps_the_latest_row_per_stock_per_week(fresh_db):
+    session = fresh_db.Session()
+    try:
+        # 2024-01-01 is a Monday
+        a = add_stock(session, '0001', [
+            datetime(2023, 12, 31, 12),   # Sunday: alone in the previous week, kept
+            datetime(2024, 1, 1, 9),      # Monday
+            datetime(2024, 1, 3, 9),      # Wednesday
+            datetime(2024, 1, 7, 23),     # Sunday: latest of its week, kept
+            datetime(2024, 1, 8, 9),      # latest of its week before the cutoff, kept
+            datetime(2024, 1, 10, 12),    # after the cutoff, untouched
+            datetime(2024, 1, 11, 12),    # after the cutoff, untouched
+        ])
+        b = add_stock(session, '0002', [datetime(2024, 1, 2), datetime(2024, 1, 2), datetime(2024, 1, 4)])
+
+        stats = prune_history(session, before=datetime(2024, 1, 10), keep='week', chunk_size=1)
+        assert (stats['scanned'], stats['deleted']) == (8, 4)
+        kept = session.execute(select(History.stock_id, History.score).order_by(History.stock_id, History.score)).all()
+        assert kept == [(a.id, 0), (a.id, 3), (a.id, 4), (a.id, 5), (a.id, 6), (b.id, 2)]
+    finally:
+        session.close()
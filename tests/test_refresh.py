@@ -0,0 +1,143 @@
+"""background_refresh and fetch_many end to end against benchmarks/stub_upstream.py."""
+import time
+
+from batch_writer import STOCK_FAILED, STOCK_OK
+from models import RefreshItem, RefreshJob, Stock
+from refresh_jobs import ITEM_PENDING, JOB_COMPLETED, JOB_STOPPED
+
+
+def messages(stock_app) -> list[str]:
+    queue = stock_app.refresh_message_queue
+    return [queue.get() for _ in range(queue.qsize())]
+
+
+def latest_job(session) -> RefreshJob:
+    return session.query(RefreshJob).order_by(RefreshJob.id.desc()).first()
+
+
+def test_fetch_many_yields_every_item_once(fresh_db, stub):
+    codes = sorted(stub.codes)
+    results = list(fresh_db.fetch_many([(code, f"name {code}") for code in codes] + [('NOPE', 'missing')], workers=3))
+    assert sorted(code for code, _, _, _ in results) == sorted(codes + ['NOPE'])
+    by_code = {code: (name, data, error) for code, name, data, error in results}
+    assert by_code['NOPE'] == ('missing', None, 'Failed to fetch NOPE')
+    for code in codes:
+        name, data, error = by_code[code]
+        assert name == f"name {code}" and error is None and 'Stock' in data
+
+
+def test_fetch_many_stops_submitting(fresh_db, stub):
+    items = [(code, code) for code in sorted(stub.codes)]
+    results = list(fresh_db.fetch_many(items, workers=1, should_stop=lambda: True))
+    # Only the initial 2x workers submissions go out
+    assert len(results) == 2
+
+
+def test_fetch_many_overlaps_requests_within_the_host_cap(fresh_db, make_stub, monkeypatch):
+    from http_client import HttpClient
+    slow = make_stub(stocks=8, latency=0.2)
+    monkeypatch.setitem(fresh_db.app.config, 'KLSESCREENER_URL', slow.url)
+    monkeypatch.setattr(fresh_db, 'http', HttpClient(max_per_host=3))
+    started = time.perf_counter()
+    results = list(fresh_db.fetch_many([(code, code) for code in slow.codes], workers=8))
+    elapsed = time.perf_counter() - started
+
+    assert [error for _, _, _, error in results] == [None] * 8
+    # Serially this is 8 x 0.2s; three at a time it is three rounds
+    assert elapsed < 8 * 0.2 / 2
+    assert slow.peak_in_flight == 3
+
+
+def test_background_refresh_reports_per_stock_failures(fresh_db, stub):
+    broken = sorted(stub.codes)[0]
+    del stub.codes[broken]
+    fresh_db.background_refresh()
+
+    session = fresh_db.Session()
+    try:
+        job = latest_job(session)
+        assert job.status == JOB_COMPLETED
+        assert (job.updated, job.failed) == (5, 1)
+        statuses = {stock.code: stock.status for stock in session.query(Stock)}
+        assert statuses.pop(broken) == STOCK_FAILED
+        assert set(statuses.values()) == {STOCK_OK}
+        failed = session.query(Stock).filter_by(code=broken).one()
+        assert failed.last_error == f"Failed to fetch {broken}" and failed.failure_count == 1
+    finally:
+        session.close()
+    assert messages(fresh_db) == [f"Failed to fetch {broken}", "Refresh complete! Updated 5 stocks."]
+
+
+def test_background_refresh_survives_fetch_exceptions(fresh_db, stub, monkeypatch):
+    broken = sorted(stub.codes)[0]
+    fetch_stock_data = fresh_db.fetch_stock_data
+
+    def explode_on_broken(code, revalidate=False):
+        if code == broken:
+            raise RuntimeError('boom')
+        return fetch_stock_data(code, revalidate)
+
+    monkeypatch.setattr(fresh_db, 'fetch_stock_data', explode_on_broken)
+    fresh_db.background_refresh()
+
+    session = fresh_db.Session()
+    try:
+        job = latest_job(session)
+        assert job.status == JOB_COMPLETED
+        assert (job.updated, job.failed) == (5, 1)
+        failed = session.query(Stock).filter_by(code=broken).one()
+        assert failed.status == STOCK_FAILED and failed.last_error == f"Failed to fetch {broken}: boom"
+    finally:
+        session.close()
+    assert messages(fresh_db) == [f"Failed to fetch {broken}: boom", "Refresh complete! Updated 5 stocks."]
+
+
+def test_background_refresh_stop_and_resume(fresh_db, monkeypatch):
+    monkeypatch.setitem(fresh_db.app.config, 'REFRESH_WORKERS', 1)
+    monkeypatch.setitem(fresh_db.app.config, 'REFRESH_BATCH_SIZE', 2)
+    build_stock_row = fresh_db.build_stock_row
+
+    def stop_after_first(stock_data):
+        fresh_db.refresh_stop_event.set()
+        return build_stock_row(stock_data)
+
+    monkeypatch.setattr(fresh_db, 'build_stock_row', stop_after_first)
+    fresh_db.background_refresh()
+
+    session = fresh_db.Session()
+    try:
+        job = latest_job(session)
+        assert job.status == JOB_STOPPED
+        # The claimed batch is finished and checkpointed; nothing after it is fetched
+        assert job.updated == 2
+        assert session.query(RefreshItem).filter_by(job_id=job.id, status=ITEM_PENDING).count() == 4
+        assert messages(fresh_db) == ["Refresh process stopped by user."]
+
+        monkeypatch.setattr(fresh_db, 'build_stock_row', build_stock_row)
+        fresh_db.refresh_stop_event.clear()
+        fresh_db.background_refresh()
+        session.expire_all()
+        resumed = latest_job(session)
+        assert resumed.id == job.id and resumed.status == JOB_COMPLETED
+        assert resumed.updated == 6
+        assert messages(fresh_db) == ["Refresh complete! Updated 6 stocks."]
+    finally:
+        session.close()
+
+
+def test_background_refresh_ignores_corrupt_cached_payload(fresh_db, stub, monkeypatch, tmp_path):
+    from payload_cache import PayloadCache
+    cache = PayloadCache(str(tmp_path / 'payload_cache.db'))
+    monkeypatch.setattr(fresh_db, 'payload_cache', cache)
+    corrupt = sorted(stub.codes)[0]
+    cache.put(corrupt, b'not json{')
+    fresh_db.background_refresh()
+
+    session = fresh_db.Session()
+    try:
+        job = latest_job(session)
+        assert job.status == JOB_COMPLETED and (job.updated, job.failed) == (6, 0)
+    finally:
+        session.close()
+    # The unreadable entry was replaced by the refetched payload
+    assert 'Stock' in fresh_db.json.loads(cache.get(corrupt).body)
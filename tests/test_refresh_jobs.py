@@ -0,0 +1,101 @@
+"""Job reservation, claims and checkpoints in refresh_jobs.py."""
+import threading
+import time
+from datetime import timedelta
+
+from models import RefreshItem, RefreshJob
+from refresh_jobs import (ITEM_CLAIMED, ITEM_DONE, ITEM_FAILED, JOB_PENDING, JOB_PLANNING, Heartbeat, checkpoint,
+                          claim_items, plan_job, reserve_job)
+
+TIMEOUT = timedelta(minutes=5)
+
+
+def test_concurrent_reservations_share_one_job(fresh_db):
+    barrier = threading.Barrier(4)
+    results = []
+
+    def reserve():
+        session = fresh_db.Session()
+        try:
+            barrier.wait()
+            job, created = reserve_job(session, TIMEOUT, timedelta(hours=1))
+            results.append((job.id, created))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=reserve) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(created for _, created in results) == 1
+    assert len({job_id for job_id, _ in results}) == 1
+    session = fresh_db.Session()
+    try:
+        assert [job.status for job in session.query(RefreshJob)] == [JOB_PLANNING]
+    finally:
+        session.close()
+
+
+def test_refresh_waits_for_a_job_being_planned(fresh_db):
+    session = fresh_db.Session()
+    try:
+        job, created = reserve_job(session, TIMEOUT, timedelta(hours=1))
+        fresh_db.background_refresh()
+        session.expire_all()
+        assert created and session.query(RefreshJob).count() == 1
+        assert session.get(RefreshJob, job.id).status == JOB_PLANNING
+
+        plan_job(session, job, [('0001', 'one', 0), ('0002', 'two', None)])
+        assert (job.status, job.total, job.skipped) == (JOB_PENDING, 2, 1)
+    finally:
+        session.close()
+
+
+def planned_job(session, codes=('0001', '0002')) -> RefreshJob:
+    job, _ = reserve_job(session, TIMEOUT)
+    return plan_job(session, job, [(code, code, 0) for code in codes])
+
+
+def expire_claims(session) -> None:
+    session.query(RefreshItem).update({RefreshItem.claimed_at: RefreshItem.claimed_at - 2 * TIMEOUT})
+    session.commit()
+
+
+def test_checkpoint_ignores_claims_taken_over_by_another_worker(fresh_db):
+    session = fresh_db.Session()
+    try:
+        job = planned_job(session)
+        first, second = [item.id for item in claim_items(session, job.id, 'a', 10, TIMEOUT)]
+        expire_claims(session)
+        assert len(claim_items(session, job.id, 'b', 10, TIMEOUT)) == 2
+
+        checkpoint(session, job.id, 'a', [first], {second: 'late'}, [])
+        session.expire_all()
+        assert (job.updated, job.failed) == (0, 0)
+        assert {item.claimed_by for item in session.query(RefreshItem)} == {'b'}
+        assert {item.status for item in session.query(RefreshItem)} == {ITEM_CLAIMED}
+
+        checkpoint(session, job.id, 'b', [first], {second: 'boom'}, [])
+        session.expire_all()
+        assert (job.updated, job.failed, job.last_error) == (1, 1, 'boom')
+        assert session.get(RefreshItem, first).status == ITEM_DONE
+        assert (session.get(RefreshItem, second).status, session.get(RefreshItem, second).error) == (ITEM_FAILED, 'boom')
+    finally:
+        session.close()
+
+
+def test_heartbeat_keeps_claims_from_expiring(fresh_db):
+    session = fresh_db.Session()
+    try:
+        job = planned_job(session)
+        claim_items(session, job.id, 'a', 10, TIMEOUT)
+        expire_claims(session)
+        with Heartbeat(fresh_db.Session, job.id, 'a', interval=0.05):
+            time.sleep(0.2)
+        assert claim_items(session, job.id, 'b', 10, TIMEOUT) == []
+        session.expire_all()
+        assert fresh_db.active_job(session, TIMEOUT).id == job.id
+    finally:
+        session.close()
@@ -0,0 +1,73 @@
+"""compute_scores must agree with compute_score element for element."""
+import math
+import random
+
+import numpy as np
+
+from scoring import SCORE_TABLE, compute_score, compute_scores
+
+INPUTS = ['growth', 'div_yield', 'per', 'roe', 'margin', 'profit', 'cash_positive']
+SPECIAL = [0.0, -0.0, -1.0, -999.0, 999.0, math.nan, math.inf, -math.inf]
+
+
+def edge_values(name: str) -> list[float]:
+    """Every threshold of the input's ladder, plus the nearest floats either side of it."""
+    values = []
+    for field, edges, _, _ in SCORE_TABLE.values():
+        if field == name:
+            for edge in edges:
+                values += [math.nextafter(edge, -math.inf), float(edge), math.nextafter(edge, math.inf)]
+    return values
+
+
+def random_row(rng: random.Random) -> dict:
+    return {
+        'growth': rng.uniform(-20, 30), 'div_yield': rng.uniform(-1, 12), 'per': rng.uniform(-30, 60),
+        'roe': rng.uniform(-20, 30), 'margin': rng.uniform(-20, 30), 'profit': rng.uniform(-1e6, 1e6),
+        'cash_positive': rng.randint(0, 1),
+    }
+
+
+def generated_rows() -> list[dict]:
+    rng = random.Random(0)
+    rows = [random_row(rng) for _ in range(2000)]
+    for name in INPUTS:
+        if name == 'cash_positive':
+            continue
+        for value in edge_values(name) + SPECIAL:
+            for _ in range(4):
+                rows.append(dict(random_row(rng), **{name: value}))
+    return rows
+
+
+def assert_matches(rows: list[dict]) -> None:
+    totals, breakdown = compute_scores(**{name: [row[name] for row in rows] for name in INPUTS})
+    for i, row in enumerate(rows):
+        total, expected = compute_score(**row)
+        actual = {key: int(values[i]) for key, values in breakdown.items()}
+        assert (int(totals[i]), actual) == (total, expected), row
+
+
+def test_matches_compute_score_on_generated_inputs():
+    assert_matches(generated_rows())
+
+
+def test_negative_and_non_finite_pe():
+    rows = [dict(random_row(random.Random(i)), per=per)
+            for i, per in enumerate([-0.01, -5.0, -math.inf, 0.0, -0.0, math.nan, math.inf])]
+    assert_matches(rows)
+    _, breakdown = compute_scores(**{name: [row[name] for row in rows] for name in INPUTS})
+    assert list(breakdown['P_PER']) == [0, 0, 0, 30, 30, 5, 5]
+
+
+def test_threshold_edges_are_inclusive():
+    _, breakdown = compute_scores(growth=[15.0, np.nextafter(15.0, 0)], div_yield=[7.0, 7.0], per=[9.0, np.nextafter(9.0, 99)],
+                                  roe=[16.0, 16.0], margin=[16.0, 16.0], profit=[0.0, -0.0], cash_positive=[1, 0])
+    assert list(breakdown['G']) == [50, 40]
+    assert list(breakdown['P_PER']) == [30, 20]
+    assert list(breakdown['C']) == [40, 30]
+
+
+def test_empty_input():
+    totals, breakdown = compute_scores(**{name: [] for name in INPUTS})
+    assert len(totals) == 0 and all(len(values) == 0 for values in breakdown.values())